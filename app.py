@@ -1,21 +1,22 @@
 # app.py — FINAL (Triple-zone decision + optional calibration + PDF)
 
 import os
-import math
 import streamlit as st
-import torch
-import nibabel as nib
 import numpy as np
-from model.network import Network
-from skimage.transform import resize
-import matplotlib.pyplot as plt
+import metrics
+from inference_engine import (INPUT_SHAPE, PRESENT, NOT_PRESENT, UNCERTAIN, TRIPLE_ZONE_BAND, load_volume,
+                              preprocess, apply_temperature, decide_band, load_network, infer_batch)
 import tempfile
 import datetime
 import time
-from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from log_utils import configure_logging
+
+# Same leveled, rate-limited logging as the scripts (AD_LOG_LEVEL); the handler is installed once across reruns
+configure_logging()
 
 # ----------------- PAGE CONFIG -----------------
 st.set_page_config(page_title="🧠 Alzheimer's Detection", layout="centered")
@@ -23,22 +24,12 @@ st.title("🧠 Alzheimer's MRI Prediction System")
 st.write("Upload your MRI scan (.nii or .nii.gz) and enter patient details to get AI-powered prediction results.")
 
 # ----------------- MODEL PARAMETERS -----------------
-input_channels = 1
-input_shape = (200, 200, 150)
-output_size = 2
-CLASSES = ["No Alzheimer's", "Alzheimer's Detected"]
+input_shape = INPUT_SHAPE
+# A model trained on brain crops (predict.py --crop-shape) or another architecture (predict.py --architecture)
+crop_shape = tuple(int(n) for n in os.getenv("APP_CROP_SHAPE", "").split(",") if n.strip()) or None
+architecture = os.getenv("APP_ARCHITECTURE") or None
 
 # ----------------- CALIBRATION HELPERS (optional) -----------------
-def apply_temperature_to_prob(prob_pos: float, T: float) -> float:
-    """Temperature scaling on binary probability (fallback when logits are not available).
-    T=1.0 no change; T<1.0 sharpens; T>1.0 smooths. Use a T learned on validation for honesty."""
-    eps = 1e-8
-    p = max(min(float(prob_pos), 1 - eps), eps)
-    logit = math.log(p / (1.0 - p))
-    logit_T = logit / max(T, eps)
-    pT = 1.0 / (1.0 + math.exp(-logit_T))
-    return pT
-
 def confidence_bucket(p: float) -> str:
     if p >= 0.85: return "High"
     if p >= 0.70: return "Medium"
@@ -47,160 +38,131 @@ def confidence_bucket(p: float) -> str:
 # ----------------- LOAD MODEL -----------------
 @st.cache_resource
 def load_model():
-    model = Network(input_channels, input_shape, output_size)
-    model.load_state_dict(torch.load("alzheimers_model.pth", map_location="cpu"))
-    model.eval()
-    return model
+    return load_network("alzheimers_model.pth", "cpu", crop_shape or input_shape, architecture=architecture)
 
 model = load_model()
 
-# ----------------- PDF BUILDER -----------------
-def build_pdf_bytes(patient_info, mri_filename, model_name, predicted_label, probs_or_none, chart_png_buf, conf_text=None):
-    buffer = BytesIO()
-    PAGE_WIDTH, PAGE_HEIGHT = A4
-    margin_x = 50
-    y = PAGE_HEIGHT - 60
-
-    c = canvas.Canvas(buffer, pagesize=A4)
-
-    # ---------- HEADER ----------
-    c.setFont("Helvetica-Bold", 18)
-    c.drawCentredString(PAGE_WIDTH/2, y, "🧠 Alzheimer's Detection MRI Report")
-    y -= 25
-    c.setFont("Helvetica", 10)
-    c.drawCentredString(PAGE_WIDTH/2, y, f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    y -= 20
-
-    # Blue line
-    c.setStrokeColorRGB(0/255, 102/255, 204/255)
-    c.setLineWidth(2)
-    c.line(margin_x, y, PAGE_WIDTH - margin_x, y)
-    y -= 30
-
-    # ---------- PATIENT INFO ----------
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(margin_x, y, "Patient Information")
-    y -= 18
-    c.setFont("Helvetica", 10)
-    info_lines = [
-        f"Name: {patient_info['name']}",
-        f"Patient ID: {patient_info['id']}",
-        f"Age: {patient_info['age']}",
-        f"Contact: {patient_info['contact']}",
-        f"Report Date: {patient_info['date']}"
-    ]
-    for line in info_lines:
-        c.drawString(margin_x+10, y, line)
-        y -= 14
-    if patient_info.get("notes"):
-        c.drawString(margin_x+10, y, f"Notes: {patient_info['notes']}")
-        y -= 20
-
-    # Blue line
-    c.setStrokeColorRGB(0/255, 102/255, 204/255)
-    c.line(margin_x, y, PAGE_WIDTH - margin_x, y)
-    y -= 30
-
-    # ---------- PREDICTION RESULT ----------
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(margin_x, y, "Prediction Result")
-    y -= 25
-
-    result_text = predicted_label
-    confidence_text = conf_text if conf_text is not None else "N/A"
-
-    if "Alzheimer" in predicted_label and "No" not in predicted_label and "Inconclusive" not in predicted_label:
-        c.setFillColorRGB(0.9, 0.2, 0.2)  # red
-    elif "No Alzheimer" in predicted_label:
-        c.setFillColorRGB(0.2, 0.7, 0.2)  # green
-    else:
-        c.setFillColorRGB(0.5, 0.5, 0.5)  # gray for inconclusive
-
-    c.rect(margin_x, y-10, PAGE_WIDTH - 2*margin_x, 25, fill=1, stroke=0)
-    c.setFillColorRGB(1, 1, 1)
-    c.setFont("Helvetica-Bold", 12)
-    c.drawCentredString(PAGE_WIDTH/2, y+2, f"{result_text}  — Confidence: {confidence_text}")
-    y -= 50
-
-    # Extra details
-    c.setFillColorRGB(0,0,0)
-    c.setFont("Helvetica", 10)
-    c.drawString(margin_x+10, y, f"MRI File: {mri_filename}")
-    y -= 15
-    c.drawString(margin_x+10, y, f"Model Used: {model_name}")
-    y -= 25
-
-    # Blue line
-    c.setStrokeColorRGB(0/255, 102/255, 204/255)
-    c.line(margin_x, y, PAGE_WIDTH - margin_x, y)
-    y -= 30
-
-    # ---------- PROBABILITY + DONUT CHART ----------
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(margin_x, y, "Probability Distribution")
-    y -= 20
-
-    if probs_or_none is not None:
-        # Left column = probability bars
-        bar_x = margin_x+10
-        bar_w = 200
-        bar_h = 14
-        text_offset = 220
-        c.setFont("Helvetica", 10)
-
-        # No Alzheimer's (green)
-        c.setFillColorRGB(0.9, 1, 0.9)
-        c.rect(bar_x, y, bar_w, bar_h, fill=1, stroke=0)
-        c.setFillColorRGB(0.2, 0.8, 0.2)
-        c.rect(bar_x, y, bar_w*probs_or_none[0], bar_h, fill=1, stroke=0)
-        c.setFillColorRGB(0,0,0)
-        c.drawString(bar_x+text_offset, y+2, f"No Alzheimer's: {probs_or_none[0]*100:.2f}%")
-        y -= 25
-
-        # Alzheimer's (red)
-        c.setFillColorRGB(1, 0.9, 0.9)
-        c.rect(bar_x, y, bar_w, bar_h, fill=1, stroke=0)
-        c.setFillColorRGB(0.9, 0.2, 0.2)
-        c.rect(bar_x, y, bar_w*probs_or_none[1], bar_h, fill=1, stroke=0)
-        c.setFillColorRGB(0,0,0)
-        c.drawString(bar_x+text_offset, y+2, f"Alzheimer's: {probs_or_none[1]*100:.2f}%")
-
-        # Right column = donut chart
-        try:
-            img = ImageReader(chart_png_buf)
-            img_x = PAGE_WIDTH - margin_x - 180
-            img_y = PAGE_HEIGHT/2 - 80
-            c.drawImage(img, img_x, img_y, width=160, height=160)
-        except:
-            pass
-        y -= 70
-    else:
-        c.setFont("Helvetica", 10)
-        c.drawString(margin_x+10, y, "Inconclusive case — probabilities not shown due to low confidence.")
-        y -= 25
-
-    # Blue line
-    c.setStrokeColorRGB(0/255, 102/255, 204/255)
-    c.line(margin_x, y, PAGE_WIDTH - margin_x, y)
-    y -= 30
-
-    # ---------- DISCLAIMER ----------
-    c.setFont("Helvetica", 9)
-    disclaimer = (
-        "Disclaimer: This is an AI-assisted prediction report intended for research/educational purposes only. "
-        "It should not be used as a definitive medical diagnosis. "
-        "Please consult a qualified medical professional for clinical decisions."
-    )
-    text_obj = c.beginText(margin_x, y)
-    text_obj.setFont("Helvetica", 9)
-    for line in disclaimer.split(". "):
-        text_obj.textLine(line.strip() + ('.' if not line.endswith('.') else ''))
-    c.drawText(text_obj)
-
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
+# ----------------- CACHED BACKGROUND INFERENCE -----------------
+# Analyses are kept per upload (SHA-256 of the bytes), so reruns triggered by editing patient fields or
+# downloading the PDF reuse them instead of decoding and scoring the scan again.
+APP_CACHE_ENTRIES = int(os.getenv("APP_CACHE_ENTRIES", "8"))  # each entry holds a ~24 MB volume
+
+# Progress shown when each stage starts, and its label
+STAGES = {
+    "queued": (0, "Waiting for the previous scan to finish..."),
+    "upload": (5, "Reading upload..."),
+    "decode": (10, "Decoding NIfTI..."),
+    "preprocess": (40, "Normalizing and resizing to model input..."),
+    "forward": (80, "Running model..."),
+    "done": (100, "Done"),
+}
+
+class AnalysisCache:
+    """Upload hash -> analysis dict, dropping the least recently used beyond max_entries. Shared by all
+    sessions like st.cache_data, but filled from the background executor; scans being analyzed are
+    tracked too, so a rerun (or a second session) attaches to the running job instead of starting another."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def pending(self, key, start):
+        """The (future, status) for `key`, calling start() to submit it if nothing is running yet."""
+        with self._lock:
+            if key not in self._pending:
+                self._pending[key] = start()
+            return self._pending[key]
+
+    def finish(self, key, entry=None):
+        with self._lock:
+            self._pending.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+@st.cache_resource
+def analysis_cache():
+    return AnalysisCache(APP_CACHE_ENTRIES)
+
+@st.cache_resource
+def inference_executor():
+    # one scan at a time: a single 3D forward pass already uses every core
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+def analyze_upload(data, filename, status):
+    """Runs on the executor (no Streamlit calls here): decode, preprocess and score one upload.
+    The current stage is published in status["stage"] for the progress bar."""
+    timings = {}
+    run_start = time.perf_counter()
+
+    # nibabel picks the reader from the extension, so keep .nii.gz uploads as .nii.gz
+    suffix = ".nii.gz" if filename.lower().endswith(".nii.gz") else ".nii"
+    status["stage"] = "upload"
+    with metrics.timed("upload", timings), tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        tmp_file.write(data)
+        tmp_path = tmp_file.name
+    try:
+        status["stage"] = "decode"
+        mri_data = load_volume(tmp_path, timings)
+    finally:
+        os.remove(tmp_path)
+    original_shape = tuple(mri_data.shape)
+
+    # Normalize, resize (and crop), timed per stage inside preprocess
+    status["stage"] = "preprocess"
+    volume = preprocess(mri_data, input_shape, timings, crop_shape)
+
+    # One scan as a length-1 sequence, as predict.py does; shape [2,]
+    status["stage"] = "forward"
+    probs = infer_batch(model, [volume], mode="sequence", timings=timings)[0]
+
+    metrics.record_decision(float(probs[1]))
+    timings["end_to_end"] = time.perf_counter() - run_start
+    metrics.STAGE_SECONDS.observe(timings["end_to_end"], stage="end_to_end")
+    status["stage"] = "done"
+    return {"volume": volume, "probs": probs, "timings": timings, "original_shape": original_shape}
+
+def run_analysis(upload_hash, data, filename):
+    """Returns the cached analysis of this upload, or waits for the background job while showing its stage."""
+    cache = analysis_cache()
+    cached = cache.get(upload_hash)
+    if cached is not None:
+        return cached
+
+    def start():
+        status = {"stage": "queued"}
+        return inference_executor().submit(analyze_upload, data, filename, status), status
+
+    future, status = cache.pending(upload_hash, start)
+    progress = st.progress(0, text=STAGES["queued"][1])
+    while not future.done():
+        value, text = STAGES[status["stage"]]
+        progress.progress(value, text=text)
+        time.sleep(0.1)
+    progress.empty()
+    try:
+        result = future.result()  # re-raises what went wrong in the worker
+    except Exception:
+        cache.finish(upload_hash)
+        raise
+    cache.finish(upload_hash, result)
+    return result
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def donut_chart_svg(prob_neg, prob_pos):
+    from reports import donut_svg
+    return donut_svg(prob_neg, prob_pos)
 
 # ----------------- PATIENT INFO FORM -----------------
 st.markdown("### 🧾 Patient Information")
@@ -220,70 +182,37 @@ uploaded_file = st.file_uploader("📂 Upload MRI File", type=["nii", "nii.gz"])
 # ----------------- PREDICTION -----------------
 if uploaded_file is not None:
     st.success(f"✅ File uploaded: {uploaded_file.name}")
+    upload_bytes = uploaded_file.getvalue()
+    upload_hash = hashlib.sha256(upload_bytes).hexdigest()
 
+    # The result stays on screen across reruns (field edits, PDF download) until another file is uploaded
     if st.button("🔍 Run Prediction"):
-        try:
-            with st.spinner("⏳ Processing MRI Scan... Please wait"):
-                progress = st.progress(0)
-                for i in range(100):
-                    time.sleep(0.02)
-                    progress.progress(i + 1)
-
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".nii") as tmp_file:
-                tmp_file.write(uploaded_file.getbuffer())
-                tmp_path = tmp_file.name
-
-            # Load MRI file
-            mri_img = nib.load(tmp_path)
-            mri_data = mri_img.get_fdata()
-
-            # Normalize & resize
-            mri_min, mri_max = float(np.min(mri_data)), float(np.max(mri_data))
-            mri_data = (mri_data - mri_min) / (mri_max - mri_min + 1e-8)
-            if mri_data.shape != input_shape:
-                st.warning(f"⚠ MRI shape {mri_data.shape} does not match {input_shape}. Resizing...")
-                mri_data = resize(mri_data, input_shape, anti_aliasing=True, preserve_range=True).astype(np.float32)
-
-            # Convert to tensor: [1,1,D,H,W]
-            mri_tensor = torch.tensor(mri_data, dtype=torch.float32).unsqueeze(0).unsqueeze(0)
+        st.session_state["analysis_for"] = upload_hash
 
+    if st.session_state.get("analysis_for") == upload_hash:
+        try:
             # ----------------- RUN PREDICTION -----------------
-            with torch.no_grad():
-                output = model(mri_tensor)                # could be [2] or [1,2]
-                probs_t = torch.softmax(output, dim=-1)   # robust last-dim softmax
-                probs_np = probs_t.detach().cpu().numpy()
-                probs = probs_np[0] if probs_np.ndim == 2 else probs_np  # shape [2,]
-                predicted_class = int(np.argmax(probs))
+            analysis = run_analysis(upload_hash, upload_bytes, uploaded_file.name)
+            probs = analysis["probs"]
+            timings = analysis["timings"]  # same stage names as predict.py and the API's /metrics
+            if analysis["original_shape"] != input_shape:
+                st.warning(f"⚠ MRI shape {analysis['original_shape']} does not match {input_shape}. Resized.")
 
             # --------- Optional temperature scaling (default OFF) ---------
             T = float(os.getenv("TEMP_CAL", "1.0"))  # set TEMP_CAL=0.85 (example) if you calibrate later
             prob_pos = float(probs[1])
-            prob_pos_cal = apply_temperature_to_prob(prob_pos, T)
+            prob_pos_cal = apply_temperature(prob_pos, T)
             probs = np.array([1.0 - prob_pos_cal, prob_pos_cal], dtype=float)
             predicted_class = int(np.argmax(probs))
 
             # ----------------- TRIPLE-ZONE DECISION -----------------
+            # reportlab is only loaded once there is a result to report, keeping the first page load fast
+            from reports import headline, render_report
             prob_pos = float(probs[1])   # P(Alzheimer's)
-            prob_neg = float(probs[0])   # P(No Alzheimer's)
-            HARD_POS = 0.90
-            HARD_NEG = 0.10
-
-            if prob_pos >= HARD_POS:
-                display_label = "Alzheimer's Detected"
-                display_conf = f"{prob_pos*100:.0f}%"
-                display_style = "high_pos"
-                show_probs = True
-            elif prob_pos <= HARD_NEG:
-                display_label = "No Alzheimer's"
-                display_conf = f"{prob_neg*100:.0f}%"
-                display_style = "high_neg"
-                show_probs = True
-            else:
-                display_label = "Inconclusive"
-                display_conf = None
-                display_style = "inconclusive"
-                show_probs = False  # hide numeric % for inconclusive cases
+            zone = decide_band(prob_pos, *TRIPLE_ZONE_BAND)
+            display_label, display_conf = headline(prob_pos, decision=zone)
+            display_style = {PRESENT: "high_pos", NOT_PRESENT: "high_neg"}.get(zone, "inconclusive")
+            show_probs = zone != UNCERTAIN  # hide numeric % for inconclusive cases
 
             # ----------------- REPORT DISPLAY -----------------
             st.markdown("## 📋 Prediction Report")
@@ -298,6 +227,7 @@ if uploaded_file is not None:
 
             st.info(f"**Patient MRI File:** {uploaded_file.name}")
             st.write(f"**Model Used:** `alzheimers_model.pth`")
+            st.caption("⏱ " + " · ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
             st.write(f"**Device:** CPU")
 
             # ---------- Stylish Prediction Card (triple-zone) ----------
@@ -324,23 +254,7 @@ if uploaded_file is not None:
                 st.write(f"🔴 Alzheimer's Detected: {probs[1]*100:.2f}%")
 
                 st.markdown("### 🎯 Probability Distribution")
-                fig, ax = plt.subplots()
-                ax.pie(
-                    probs,
-                    labels=CLASSES,
-                    autopct='%1.1f%%',
-                    startangle=90,
-                    colors=["#4ade80", "#f87171"],
-                    wedgeprops={'width': 0.4}
-                )
-                ax.axis('equal')
-                st.pyplot(fig)
-
-                chart_buf = BytesIO()
-                fig.savefig(chart_buf, format="png")
-                chart_buf.seek(0)
-            else:
-                chart_buf = BytesIO()  # empty buffer for PDF
+                st.image(donut_chart_svg(float(probs[0]), float(probs[1])))
 
             # ----------------- DOWNLOAD PDF -----------------
             patient_info = {
@@ -356,19 +270,18 @@ if uploaded_file is not None:
             pdf_probs = probs if show_probs else None
             pdf_conf_text = display_conf if display_conf is not None else "N/A"
 
-            pdf_buffer = build_pdf_bytes(
+            pdf_bytes = render_report(
                 patient_info,
                 uploaded_file.name,
                 "alzheimers_model.pth",
                 display_label,
                 pdf_probs,
-                chart_buf,
                 conf_text=pdf_conf_text
             )
 
             st.download_button(
                 label="📥 Download Professional PDF Report",
-                data=pdf_buffer,
+                data=pdf_bytes,
                 file_name=f"Alzheimers_Report_{patient_info['id']}.pdf",
                 mime="application/pdf"
             )
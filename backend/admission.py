@@ -0,0 +1,156 @@
+# admission.py
+""" Admission control for api_server.py.
+
+Every prediction reserves an estimated amount of memory from a shared budget before it starts
+(decoding, resizing and the 3D convolution activations of one 200x200x150 scan need a few hundred MB).
+When the budget is exhausted, a request waits briefly in a bounded queue. If there is still no room,
+it is rejected with 429 and a Retry-After estimate instead of pushing the process into the OOM killer.
+Each client is also limited by a token bucket.
+
+Configuration (environment):
+    ADMISSION_MEMORY_MB      total budget for in-flight inferences (default 2048)
+    ADMISSION_SCAN_MB        estimated peak memory per scan (default 450)
+    ADMISSION_MAX_WAITERS    requests allowed to wait for budget (default 8)
+    ADMISSION_MAX_WAIT       seconds a request may wait before 429 (default 5)
+    CLIENT_RATE              sustained requests per second per client (default 1.0)
+    CLIENT_BURST             token bucket size per client (default 5)
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class Rejected(Exception):
+    """Raised when a request cannot be admitted. `retry_after` is in whole seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class MemoryBudget:
+    """Counting reservation of megabytes with a bounded wait queue."""
+
+    def __init__(self, capacity_mb, max_waiters=8, max_wait=5.0):
+        self.capacity_mb = capacity_mb
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self.used_mb = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        # smoothed time a reservation is held, used for Retry-After
+        self.mean_hold = 1.0
+        self._cond = threading.Condition()
+
+    def acquire(self, cost_mb, timeout=None, bounded=True):
+        """Reserves `cost_mb`, waiting up to `timeout` (default max_wait) seconds. Raises Rejected.
+        A single request larger than the whole budget is admitted only when nothing else is running.
+        bounded=False skips the waiter limit, for internal workers that are already few in number."""
+        timeout = self.max_wait if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if not self._fits(cost_mb):
+                if bounded and self.waiting >= self.max_waiters:
+                    self.rejected += 1
+                    raise Rejected("Server is at capacity", self._retry_after())
+                self.waiting += 1
+                try:
+                    while not self._fits(cost_mb):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            raise Rejected("Timed out waiting for capacity", self._retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.used_mb += cost_mb
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, cost_mb, acquired_at=None):
+        with self._cond:
+            self.used_mb -= cost_mb
+            self.in_flight -= 1
+            if acquired_at is not None:
+                held = time.monotonic() - acquired_at
+                self.mean_hold = 0.8 * self.mean_hold + 0.2 * held
+            self._cond.notify_all()
+
+    def _fits(self, cost_mb):
+        return self.used_mb + cost_mb <= self.capacity_mb or self.in_flight == 0
+
+    def _retry_after(self):
+        # roughly: the queue ahead of us drains at in_flight requests per mean_hold seconds
+        slots = max(1, self.in_flight)
+        return max(1, math.ceil(self.mean_hold * (self.waiting + 1) / slots))
+
+    def status(self):
+        with self._cond:
+            return {"capacity_mb": self.capacity_mb, "used_mb": self.used_mb, "in_flight": self.in_flight,
+                    "waiting": self.waiting, "rejected": self.rejected, "mean_hold_seconds": round(self.mean_hold, 3)}
+
+
+class TokenBuckets:
+    """Per-client token buckets. Idle clients are evicted once more than `max_clients` are tracked."""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client, cost=1.0):
+        """Consumes `cost` tokens for `client` or raises Rejected with the wait until enough refill."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < cost:
+                self._buckets[client] = (tokens, now)
+                retry_after = max(1, math.ceil((cost - tokens) / self.rate)) if self.rate > 0 else 60
+                raise Rejected("Rate limit exceeded", retry_after)
+            self._buckets[client] = (tokens - cost, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+
+class AdmissionController:
+    def __init__(self, memory_mb=None, scan_mb=None, max_waiters=None, max_wait=None, rate=None, burst=None):
+        env = os.environ.get
+        self.scan_mb = scan_mb if scan_mb is not None else int(env("ADMISSION_SCAN_MB", "450"))
+        self.budget = MemoryBudget(
+            memory_mb if memory_mb is not None else int(env("ADMISSION_MEMORY_MB", "2048")),
+            max_waiters=max_waiters if max_waiters is not None else int(env("ADMISSION_MAX_WAITERS", "8")),
+            max_wait=max_wait if max_wait is not None else float(env("ADMISSION_MAX_WAIT", "5")),
+        )
+        self.clients = TokenBuckets(
+            rate if rate is not None else float(env("CLIENT_RATE", "1.0")),
+            burst if burst is not None else float(env("CLIENT_BURST", "5")),
+        )
+
+    def cost_for(self, num_scans=1):
+        return self.scan_mb * max(1, num_scans)
+
+    def check_client(self, client, cost=1.0):
+        self.clients.take(client, cost)
+
+    def reserve(self, num_scans=1, timeout=None, bounded=True):
+        """Blocks (briefly) for budget. Returns a ticket to pass to release()."""
+        cost = self.cost_for(num_scans)
+        acquired_at = self.budget.acquire(cost, timeout, bounded)
+        return cost, acquired_at
+
+    def release(self, ticket):
+        cost, acquired_at = ticket
+        self.budget.release(cost, acquired_at)
+
+
+def client_key(request):
+    """Identifies the caller: an explicit X-Client-Id header, else the remote address."""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
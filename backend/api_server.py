@@ -1,12 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import tempfile, subprocess, json, os, uuid, sys, traceback, re
-from typing import Optional
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+import tempfile, subprocess, json, os, uuid, sys, traceback, re, asyncio, shutil, zipfile, time
+from typing import Optional, List
 
 HERE = os.path.dirname(os.path.abspath(__file__))
-PREDICT = os.path.join(HERE, "predict.py")
-DEFAULT_MODEL = os.path.join(HERE, "alzheimers_model.pth")  # your model filename here
+# predict.py and the checkpoints sit next to this file in a flat deployment, or one level up in the repo
+ROOT = HERE if os.path.exists(os.path.join(HERE, "predict.py")) else os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+PREDICT = os.path.join(ROOT, "predict.py")
+DEFAULT_MODEL = os.path.join(ROOT, "alzheimers_model.pth")  # your model filename here
+
+from jobs import JobManager, QueueFull, public_view, DONE, FAILED
+from admission import AdmissionController, Rejected, client_key
+import metrics
+from inference_engine import CLASSES, MAX_NUM_IMAGES
+from log_utils import configure_logging
+
+# Same leveled, rate-limited logging as the scripts (AD_LOG_LEVEL); library modules log through it
+configure_logging()
+
+# Uploads for queued jobs are kept here until a worker has processed them
+JOB_SPOOL = os.environ.get("JOB_SPOOL", os.path.join(tempfile.gettempdir(), "alzheimer-jobs"))
 
 app = FastAPI(title="Alzheimer API", version="1.0")
 
@@ -18,46 +36,242 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+admission = AdmissionController()
+
+REJECTIONS = metrics.REGISTRY.register(metrics.Counter(
+    "alzheimer_rejected_requests_total", "Requests refused by admission control.", ["reason"]))
+metrics.IN_FLIGHT.set_function(lambda: admission.budget.in_flight, kind="inference")
+metrics.QUEUE_DEPTH.set_function(lambda: admission.budget.waiting, queue="admission")
+metrics.QUEUE_DEPTH.set_function(lambda: job_manager.queue_depth, queue="jobs")
+READY = metrics.REGISTRY.register(metrics.Gauge(
+    "alzheimer_ready", "1 once model warm-up has finished and the replica accepts traffic."))
+READY.set_function(lambda: 1 if warmer is not None and warmer.ready else 0)
+
+# Set on startup; see model_manager.py, warmup.py and worker_pool.py
+models = None
+warmer = None
+pool = None
+
+
+@app.on_event("startup")
+def start_models():
+    global models, warmer, pool
+    from model_manager import ModelManager
+    models = ModelManager.from_env(ROOT)
+    if os.environ.get("INFERENCE_WORKERS", "0") != "0":
+        # forked workers hold the (shared) weights and warm themselves; /ready waits for all of them
+        from worker_pool import WorkerPool
+        pool = warmer = WorkerPool.from_env(models).start()
+    else:
+        from warmup import Warmup
+        warmer = Warmup.from_env(models.names(), models.get)
+        warmer.start()
+
+
 @app.get("/health")
 def health():
     return {"ok": True}
 
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until warm-up has brought every configured model to steady-state latency."""
+    if warmer is None:
+        return JSONResponse(status_code=503, content={"state": "pending", "ready": False})
+    status = warmer.status()
+    if not warmer.ready:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+
+@app.get("/admission")
+def admission_status():
+    """Current memory budget use, waiting requests and job queue depth."""
+    status = admission.budget.status()
+    status["job_queue_depth"] = job_manager.queue_depth
+    status["jobs"] = job_manager.store.counts()
+    return status
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of stage histograms, decision counters, queue depth and RSS."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/models")
+def list_models():
+    """Registered models with their active and known versions, what is resident, and the A/B and shadow setup."""
+    return models.status()
+
+
+@app.post("/models/{name}")
+async def swap_model(
+    name: str,
+    path: str = Form(...),
+    version: Optional[str] = Form(None),
+    activate: bool = Form(True),
+    device: Optional[str] = Form("cpu"),
+):
+    """Registers a checkpoint (a path on the server) as a version of `name` and, by default, makes it active.
+    The new version is loaded before the switch; requests already running finish on the old one."""
+    if pool is not None:
+        return JSONResponse(status_code=409, content={
+            "error": "Models are fixed while INFERENCE_WORKERS is set; restart the server to change them"})
+    checkpoint = resolve_model(path)
+    try:
+        version = await run_in_threadpool(models.register, name, checkpoint, version, activate, True, device)
+    except FileNotFoundError:
+        return JSONResponse(status_code=400, content={"error": f"Model not found at {checkpoint}"})
+    return {"name": name, "version": version, "active": models.status()["models"][name]["active"]}
+
+
+def rejected_response(e):
+    REJECTIONS.inc(reason=e.reason)
+    return JSONResponse(status_code=429, headers={"Retry-After": str(e.retry_after)},
+                        content={"error": e.reason, "retry_after": e.retry_after})
+
+
+# ----------------- HELPERS -----------------
+def upload_suffix(filename):
+    return ".nii.gz" if (filename or "").lower().endswith(".nii.gz") else ".nii"
+
+
+def resolve_model(model_path):
+    model_arg = model_path or DEFAULT_MODEL
+    if not os.path.isabs(model_arg):
+        model_arg = os.path.join(ROOT, model_arg)
+    return model_arg
+
+
+def predict_command(mri_path, model_arg, device):
+    return [
+        sys.executable, PREDICT,
+        "--mri", mri_path,
+        "--model", model_arg,
+        "--device", device
+    ]
+
+
+def predict_env():
+    # force UTF-8 output to avoid Windows console encoding issues
+    env = os.environ.copy()
+    env["PYTHONIOENCODING"] = "utf-8"
+    return env
+
+
+def parse_predict_output(stdout):
+    """Turns predict.py's printed results into decision / class_probs / prob_pos fields."""
+    out = {}
+
+    # Parse "Predicted Class: Alzheimer's Detected"
+    m_class = re.search(r"Predicted Class:\s*(.+)", stdout)
+    if m_class:
+        label_raw = m_class.group(1).strip()
+        label = label_raw.lower()
+        if "not" in label or "no alzheimer" in label:
+            out["decision"] = "ALZHEIMER_NOT_PRESENT"
+        else:
+            out["decision"] = "ALZHEIMER_PRESENT"
+        out["predicted_label_raw"] = label_raw
+
+    # Parse "Class Probabilities: [p0 p1]"
+    m_probs = re.search(r"Class\s+Probabilities:\s*\[([^\]]+)\]", stdout)
+    if m_probs:
+        try:
+            nums = [float(x) for x in m_probs.group(1).split()]
+            out["class_probs"] = nums  # [neg, pos]
+            if len(nums) >= 2:
+                out["prob_pos"] = nums[1]
+        except Exception:
+            pass
+
+    # Fallback: "Probability (positive class): 0.6123"
+    if "prob_pos" not in out:
+        m_p = re.search(r"Probability.*?:\s*([0-9.]+)", stdout)
+        if m_p:
+            try:
+                out["prob_pos"] = float(m_p.group(1))
+            except Exception:
+                pass
+    return out
+
+
+def predict_resident(headers, client, mri_path, device):
+    """Scores one scan in-process on a resident model chosen by model_manager's routing."""
+    import inference
+
+    name, version = models.route(headers, client)
+    if pool is not None:
+        name, version, probs = score_in_pool(name, version, "independent", paths=[mri_path])
+    else:
+        volumes = inference.preprocess_many([mri_path])
+        with models.lease(name, version, device) as lease:
+            probs = inference.score_independent(lease.model, volumes, device)
+        name, version = lease.name, lease.version
+        # the shadow model runs after the caller's result is ready, on its own thread
+        models.submit_shadow(name, volumes, probs, device)
+    out = inference.scan_result(probs[0])
+    out["predicted_label_raw"] = CLASSES[int(probs[0].argmax())]
+    out["model"], out["model_version"] = name, version
+    return out
+
+
+def score_in_pool(name, version, mode, paths=None, shared=None):
+    """Runs one request on a forked worker, from files (`paths`) or from a tensor in shared memory
+    (`shared` = (block, shape, dtype)). Only the versions loaded when the pool started are served."""
+    if version and version != pool.versions.get(name):
+        raise LookupError(f"Version {version!r} of model {name!r} is not loaded in the worker pool")
+    if shared is not None:
+        future = pool.submit_shared(name, *shared, mode=mode)
+    else:
+        future = pool.submit(name, paths, mode)
+    return name, pool.versions[name], future.result(timeout=600)
+
+
 @app.post("/predict")
 async def predict(
+    request: Request,
     file: UploadFile = File(...),
     model_path: Optional[str] = Form(None),
     device: Optional[str] = Form("cpu"),
 ):
     mri_path = None
+    ticket = None
+    request_start = time.perf_counter()
+    try:
+        admission.check_client(client_key(request))
+        ticket = await run_in_threadpool(admission.reserve, 1)
+    except Rejected as e:
+        return rejected_response(e)
     try:
         # ---- save upload ----
-        suffix = ".nii.gz" if file.filename.lower().endswith(".nii.gz") else ".nii"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_in:
+        suffix = upload_suffix(file.filename)
+        with metrics.timed("upload"), tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_in:
             tmp_in.write(await file.read())
             mri_path = tmp_in.name
 
-        # ---- resolve model ----
-        model_arg = model_path or DEFAULT_MODEL
-        if not os.path.isabs(model_arg):
-            model_arg = os.path.join(HERE, model_arg)
+        # ---- resident models, routed by X-Model header / A/B split ----
+        if model_path is None and models is not None and models.default is not None:
+            try:
+                out = await run_in_threadpool(predict_resident, request.headers, client_key(request), mri_path, device)
+            except LookupError as e:
+                return JSONResponse(status_code=404, content={"error": str(e)})
+            metrics.record_decision(out["prob_pos"])
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - request_start, stage="end_to_end")
+            return out
+
+        # ---- explicit checkpoint path: resolve model ----
+        model_arg = resolve_model(model_path)
         if not os.path.exists(model_arg):
             return JSONResponse(status_code=400, content={"error": f"Model not found at {model_arg}"})
 
         # ---- call predict.py (no unsupported args) ----
-        cmd = [
-            sys.executable, PREDICT,
-            "--mri", mri_path,
-            "--model", model_arg,
-            "--device", device
-        ]
-
-        # force UTF-8 output to avoid Windows console encoding issues
-        env = os.environ.copy()
-        env["PYTHONIOENCODING"] = "utf-8"
-
-        proc = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            text=True, timeout=600, env=env
+        # run the subprocess off the event loop so other requests keep being served meanwhile
+        proc = await run_in_threadpool(
+            subprocess.run,
+            predict_command(mri_path, model_arg, device), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, timeout=600, env=predict_env()
         )
 
         # ---- parse stdout to structured JSON ----
@@ -69,42 +283,17 @@ async def predict(
             "stdout_tail": stdout[-4000:],
             "stderr_tail": stderr[-4000:]
         }
-
-        # Parse "Predicted Class: Alzheimer's Detected"
-        m_class = re.search(r"Predicted Class:\s*(.+)", stdout)
-        if m_class:
-            label_raw = m_class.group(1).strip()
-            label = label_raw.lower()
-            if "not" in label or "no alzheimer" in label:
-                out["decision"] = "ALZHEIMER_NOT_PRESENT"
-            else:
-                out["decision"] = "ALZHEIMER_PRESENT"
-            out["predicted_label_raw"] = label_raw
-
-        # Parse "Class Probabilities: [p0 p1]"
-        m_probs = re.search(r"Class\s+Probabilities:\s*\[([^\]]+)\]", stdout)
-        if m_probs:
-            try:
-                nums = [float(x) for x in m_probs.group(1).split()]
-                out["class_probs"] = nums  # [neg, pos]
-                if len(nums) >= 2:
-                    out["prob_pos"] = nums[1]
-            except Exception:
-                pass
-
-        # Fallback: "Probability (positive class): 0.6123"
-        if "prob_pos" not in out:
-            m_p = re.search(r"Probability.*?:\s*([0-9.]+)", stdout)
-            if m_p:
-                try:
-                    out["prob_pos"] = float(m_p.group(1))
-                except Exception:
-                    pass
+        out.update(parse_predict_output(stdout))
+        # predict.py reports its decode/normalize/resample/forward times on stderr
+        metrics.observe_stage_line(stderr)
 
         # If failed and nothing useful parsed, return logs with 500
         if proc.returncode != 0 and ("decision" not in out and "prob_pos" not in out):
             return JSONResponse(status_code=500, content=out)
 
+        if "prob_pos" in out:
+            metrics.record_decision(out["prob_pos"])
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - request_start, stage="end_to_end")
         return out
 
     except Exception as e:
@@ -113,8 +302,456 @@ async def predict(
             content={"error": str(e), "traceback": traceback.format_exc()[-4000:]}
         )
     finally:
+        admission.release(ticket)
         if mri_path:
             try:
                 os.remove(mri_path)
             except Exception:
                 pass
+
+
+# ----------------- ASYNC JOBS -----------------
+# predict.py log lines that mark how far a job has got, with the progress they correspond to
+PROGRESS_MARKERS = [
+    ("Using device", "loading_model", 10),
+    ("Loading MRI", "decoding", 30),
+    ("Resizing", "resampling", 55),
+    ("Cascade stage", "inference", 85),
+    ("Prediction Results", "inference", 90),
+]
+
+
+def run_predict_job(params, report):
+    """Runs predict.py for one queued job, publishing progress as its log lines arrive."""
+    report("waiting_for_capacity", 2)
+    # job workers wait as long as needed instead of being rejected: the job queue already bounds them
+    ticket = admission.reserve(1, timeout=3600, bounded=False)
+    try:
+        result = _run_predict_subprocess(params, report)
+    finally:
+        admission.release(ticket)
+    # for a job, end-to-end runs from submission (queue wait included) to the result
+    if params.get("submitted_at"):
+        metrics.STAGE_SECONDS.observe(time.time() - params["submitted_at"], stage="end_to_end")
+    return result
+
+
+def _run_predict_subprocess(params, report):
+    report("loading_model", 5)
+    proc = subprocess.Popen(
+        predict_command(params["mri_path"], params["model_path"], params["device"]),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=predict_env()
+    )
+    lines = []
+    try:
+        for line in proc.stdout:
+            lines.append(line)
+            for marker, stage, progress in PROGRESS_MARKERS:
+                if marker in line:
+                    report(stage, progress)
+                    break
+        proc.wait(timeout=600)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        raise
+    output = "".join(lines)
+    metrics.observe_stage_line(output)
+    result = parse_predict_output(output)
+    result["returncode"] = proc.returncode
+    if proc.returncode != 0 and "decision" not in result and "prob_pos" not in result:
+        raise RuntimeError(output[-4000:])
+    if "prob_pos" in result:
+        metrics.record_decision(result["prob_pos"])
+    return result
+
+
+job_manager = JobManager(
+    run_predict_job,
+    workers=int(os.environ.get("JOB_WORKERS", "2")),
+    max_queued=int(os.environ.get("JOB_QUEUE_SIZE", "32")),
+    db_path=os.environ.get("JOB_DB") or None,
+)
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    request: Request,
+    file: UploadFile = File(...),
+    model_path: Optional[str] = Form(None),
+    device: Optional[str] = Form("cpu"),
+):
+    try:
+        admission.check_client(client_key(request))
+    except Rejected as e:
+        return rejected_response(e)
+    model_arg = resolve_model(model_path)
+    if not os.path.exists(model_arg):
+        return JSONResponse(status_code=400, content={"error": f"Model not found at {model_arg}"})
+
+    os.makedirs(JOB_SPOOL, exist_ok=True)
+    submitted_at = time.time()
+    mri_path = os.path.join(JOB_SPOOL, uuid.uuid4().hex + upload_suffix(file.filename))
+    with metrics.timed("upload"), open(mri_path, "wb") as f:
+        f.write(await file.read())
+
+    try:
+        job = job_manager.submit({"mri_path": mri_path, "model_path": model_arg, "device": device,
+                                  "filename": file.filename, "cleanup_path": mri_path,
+                                  "submitted_at": submitted_at})
+    except QueueFull:
+        os.remove(mri_path)
+        return JSONResponse(status_code=503, headers={"Retry-After": "30"},
+                            content={"error": "Too many queued jobs, try again later"})
+
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events",
+    }
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job id"})
+    view = public_view(job)
+    view["queue_depth"] = job_manager.queue_depth
+    return view
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: one `data:` message each time the job changes, ending when it finishes."""
+    if job_manager.get(job_id) is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job id"})
+
+    async def stream():
+        last_version = -1
+        while True:
+            job = job_manager.get(job_id)
+            if job is None:  # Evicted (see jobs.JOB_TTL)
+                return
+            if job["version"] != last_version:
+                last_version = job["version"]
+                yield f"event: progress\ndata: {json.dumps(public_view(job))}\n\n"
+            if job["status"] in (DONE, FAILED):
+                return
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ----------------- BATCH / SEQUENCE PREDICTION -----------------
+NIFTI_SUFFIXES = (".nii", ".nii.gz")
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "64"))
+# Uploaded plus extracted bytes one /predict/batch request may put on disk
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", str(4 * 2 ** 30)))
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+async def save_upload(upload, path):
+    """Streams an upload to `path` (never holding it in memory) and returns its size in bytes."""
+    with open(path, "wb") as f:
+        await run_in_threadpool(shutil.copyfileobj, upload.file, f)
+        return f.tell()
+
+
+def extract_niftis(archive_path, dest_dir, max_files=MAX_BATCH_FILES, max_bytes=MAX_BATCH_BYTES):
+    """Extracts the NIfTI members of a zip into dest_dir, flattened and sorted by member name. The member
+    count and the declared uncompressed sizes are checked against the limits before anything is written
+    (zipfile stops reading a member at its declared size, so the check also holds for a lying header);
+    raises BatchTooLarge when they are exceeded."""
+    paths = []
+    with zipfile.ZipFile(archive_path) as archive:
+        members = sorted((m for m in archive.infolist() if m.filename.lower().endswith(NIFTI_SUFFIXES)),
+                         key=lambda m: m.filename)
+        if len(members) > max_files:
+            raise BatchTooLarge(f"At most {max_files} files per request")
+        if sum(m.file_size for m in members) > max_bytes:
+            raise BatchTooLarge(f"At most {max_bytes} bytes of scans per request")
+        for i, member in enumerate(members):
+            # never trust member paths: write under a generated name that keeps the original suffix
+            target = os.path.join(dest_dir, f"{i:04d}{upload_suffix(member.filename)}")
+            with archive.open(member) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            paths.append((os.path.basename(member.filename), target))
+    return paths
+
+
+def batch_response(mode, probs, served, filenames=None):
+    """Per-scan results and the patient-level aggregate returned by /predict/batch and /predict/tensor.
+    Scans are labelled by filename when there are files, else by position."""
+    import inference
+
+    per_scan = []
+    for i, p in enumerate(probs):
+        result = inference.scan_result(p)
+        if filenames is not None:
+            result["filename"] = filenames[i]
+        else:
+            result["index"] = i
+        per_scan.append(result)
+    if mode == "sequence":
+        # the last step of the LSTM has seen the whole series
+        patient = inference.scan_result(probs[-1])
+        patient["aggregation"] = "lstm_last_step"
+    else:
+        patient = inference.scan_result(probs.mean(axis=0))
+        patient["aggregation"] = "mean"
+    patient["num_scans"] = len(per_scan)
+    metrics.record_decision(patient["prob_pos"])
+    out = {"mode": mode, "scans": per_scan, "patient": patient}
+    if served is not None:
+        out["model"], out["model_version"] = served
+    return out
+
+
+@app.post("/predict/batch")
+async def predict_batch(
+    request: Request,
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    mode: str = Form("independent"),
+    model_path: Optional[str] = Form(None),
+    device: Optional[str] = Form("cpu"),
+):
+    """Scores many scans in one request. `files` keep their upload order; a zip `archive` is ordered by
+    member name. mode=independent scores each scan on its own; mode=sequence feeds them, in order, as one
+    patient's longitudinal series through the LSTM (at most MAX_NUM_IMAGES scans)."""
+    import inference
+
+    try:
+        admission.check_client(client_key(request))
+    except Rejected as e:
+        return rejected_response(e)
+
+    if mode not in ("independent", "sequence"):
+        return JSONResponse(status_code=400, content={"error": "mode must be 'independent' or 'sequence'"})
+    if pool is not None and model_path is not None:
+        # the parent never runs a forward pass (see worker_pool.py); workers only hold the registered models
+        return JSONResponse(status_code=409, content={
+            "error": "model_path is not accepted while INFERENCE_WORKERS is set; use a registered model"})
+    resident = model_path is None and models is not None and models.default is not None
+    model_arg = None if resident else resolve_model(model_path)
+    if model_arg is not None and not os.path.exists(model_arg):
+        return JSONResponse(status_code=400, content={"error": f"Model not found at {model_arg}"})
+    route = models.route(request.headers, client_key(request)) if resident else None
+
+    work_dir = tempfile.mkdtemp(prefix="alzheimer-batch-")
+    ticket = None
+    request_start = time.perf_counter()
+    try:
+        # Limits are checked before each step that would materialise more data, not after the whole batch
+        if len(files or []) > MAX_BATCH_FILES:
+            return JSONResponse(status_code=413, content={"error": f"At most {MAX_BATCH_FILES} files per request"})
+        scans = []  # (original filename, local path)
+        received = 0
+        for i, upload in enumerate(files or []):
+            local = os.path.join(work_dir, f"upload-{i:04d}{upload_suffix(upload.filename)}")
+            with metrics.timed("upload"):
+                received += await save_upload(upload, local)
+            if received > MAX_BATCH_BYTES:
+                return JSONResponse(status_code=413, content={
+                    "error": f"At most {MAX_BATCH_BYTES} bytes of scans per request"})
+            scans.append((upload.filename, local))
+        if archive is not None:
+            archive_path = os.path.join(work_dir, "archive.zip")
+            with metrics.timed("upload"):
+                size = await save_upload(archive, archive_path)
+            if received + size > MAX_BATCH_BYTES:
+                return JSONResponse(status_code=413, content={
+                    "error": f"At most {MAX_BATCH_BYTES} bytes of scans per request"})
+            try:
+                scans += await run_in_threadpool(extract_niftis, archive_path, work_dir,
+                                                 MAX_BATCH_FILES - len(scans), MAX_BATCH_BYTES - received)
+            except zipfile.BadZipFile:
+                return JSONResponse(status_code=400, content={"error": "archive is not a valid zip file"})
+            except BatchTooLarge as e:
+                return JSONResponse(status_code=413, content={"error": str(e)})
+            os.remove(archive_path)
+
+        if not scans:
+            return JSONResponse(status_code=400, content={"error": "No .nii / .nii.gz files received"})
+        if mode == "sequence" and len(scans) > MAX_NUM_IMAGES:
+            return JSONResponse(status_code=400, content={
+                "error": f"A sequence can hold at most {MAX_NUM_IMAGES} scans"})
+
+        # a sequence runs all scans through the convolutions at once; independent mode in SCAN_BATCH chunks
+        concurrent_scans = len(scans) if mode == "sequence" else min(len(scans), inference.SCAN_BATCH)
+        try:
+            ticket = await run_in_threadpool(admission.reserve, concurrent_scans)
+        except Rejected as e:
+            return rejected_response(e)
+
+        def score(model, volumes):
+            if mode == "sequence":
+                return inference.score_sequence(model, volumes, device)
+            return inference.score_independent(model, volumes, device)
+
+        def run():
+            paths = [local for _, local in scans]
+            if pool is not None:
+                name, version, probs = score_in_pool(*route, mode, paths=paths)
+                return probs, (name, version)
+            volumes = inference.preprocess_many(paths)
+            if route is None:
+                return score(inference.get_model(model_arg, device), volumes), None
+            with models.lease(*route, device) as lease:
+                probs = score(lease.model, volumes)
+            if mode == "independent":
+                models.submit_shadow(lease.name, volumes, probs, device)
+            return probs, (lease.name, lease.version)
+
+        try:
+            probs, served = await run_in_threadpool(run)
+        except LookupError as e:
+            return JSONResponse(status_code=404, content={"error": str(e)})
+
+        out = batch_response(mode, probs, served, [filename for filename, _ in scans])
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - request_start, stage="end_to_end")
+        return out
+
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": str(e), "traceback": traceback.format_exc()[-4000:]}
+        )
+    finally:
+        if ticket is not None:
+            admission.release(ticket)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# ----------------- BINARY TENSOR INGESTION -----------------
+TENSOR_DTYPES = ("float32", "float16")
+
+
+def parse_tensor_header(headers, input_shape):
+    """Reads X-Tensor-Dtype (float32 | float16) and X-Tensor-Shape ("D,H,W" or "N,D,H,W").
+    Returns (dtype, (N, D, H, W)); raises ValueError when they do not describe preprocessed volumes."""
+    dtype = headers.get("x-tensor-dtype", "float32").lower()
+    if dtype not in TENSOR_DTYPES:
+        raise ValueError(f"X-Tensor-Dtype must be one of {', '.join(TENSOR_DTYPES)}")
+    try:
+        shape = tuple(int(x) for x in headers.get("x-tensor-shape", ",".join(map(str, input_shape))).split(","))
+    except ValueError:
+        raise ValueError("X-Tensor-Shape must be comma-separated integers")
+    if len(shape) == 3:
+        shape = (1,) + shape
+    if len(shape) != 4 or shape[0] < 1 or shape[1:] != tuple(input_shape):
+        raise ValueError(f"X-Tensor-Shape must be D,H,W or N,D,H,W with D,H,W = {','.join(map(str, input_shape))}")
+    return dtype, shape
+
+
+async def read_body_into(request, buffer):
+    """Streams the request body straight into a preallocated writable buffer. Returns the bytes received."""
+    view = memoryview(buffer)
+    offset = 0
+    try:
+        async for chunk in request.stream():
+            end = offset + len(chunk)
+            if end > len(view):
+                raise ValueError("Body is larger than the tensor described by the headers")
+            view[offset:end] = chunk
+            offset = end
+    finally:
+        view.release()
+    return offset
+
+
+@app.post("/predict/tensor")
+async def predict_tensor(request: Request, mode: str = "independent", device: str = "cpu"):
+    """Scores volumes that are already normalized to [0, 1] and resampled to the model's input shape, sent
+    as the raw C-order bytes of a float32/float16 array (Content-Type: application/octet-stream).
+    No NIfTI decoding or resizing happens: the body is read into one buffer, viewed with np.frombuffer and
+    handed to torch.from_numpy (float16 is widened while being copied into the input batch). With
+    INFERENCE_WORKERS the buffer is a shared-memory block that the worker maps directly."""
+    import numpy as np
+    import inference
+
+    try:
+        admission.check_client(client_key(request))
+    except Rejected as e:
+        return rejected_response(e)
+    if mode not in ("independent", "sequence"):
+        return JSONResponse(status_code=400, content={"error": "mode must be 'independent' or 'sequence'"})
+    if models is None or models.default is None:
+        return JSONResponse(status_code=503, content={"error": "No resident model is configured"})
+    try:
+        dtype, shape = parse_tensor_header(request.headers, inference.INPUT_SHAPE)
+        declared = request.headers.get("content-length")
+        if declared is not None:
+            try:
+                declared = int(declared)
+            except ValueError:
+                raise ValueError(f"Content-Length must be an integer, got {declared!r}") from None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if shape[0] > MAX_BATCH_FILES:
+        return JSONResponse(status_code=413, content={"error": f"At most {MAX_BATCH_FILES} volumes per request"})
+    if mode == "sequence" and shape[0] > MAX_NUM_IMAGES:
+        return JSONResponse(status_code=400, content={
+            "error": f"A sequence can hold at most {MAX_NUM_IMAGES} scans"})
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if declared is not None and declared != nbytes:
+        return JSONResponse(status_code=400, content={
+            "error": f"Content-Length {declared} does not match {dtype} {shape} ({nbytes} bytes)"})
+    route = models.route(request.headers, client_key(request))
+
+    request_start = time.perf_counter()
+    concurrent_scans = shape[0] if mode == "sequence" else min(shape[0], inference.SCAN_BATCH)
+    try:
+        ticket = await run_in_threadpool(admission.reserve, concurrent_scans)
+    except Rejected as e:
+        return rejected_response(e)
+    shm = pool.allocate_shared(nbytes) if pool is not None else None
+    buffer = shm.buf if shm is not None else bytearray(nbytes)
+    try:
+        try:
+            with metrics.timed("upload"):
+                received = await read_body_into(request, buffer)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        if received != nbytes:
+            return JSONResponse(status_code=400, content={
+                "error": f"Received {received} bytes, expected {nbytes} for {dtype} {shape}"})
+
+        def run():
+            if pool is not None:
+                name, version, probs = score_in_pool(*route, mode, shared=(shm, shape, dtype))
+                return probs, (name, version)
+            volumes = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+            with models.lease(*route, device) as lease:
+                if mode == "sequence":
+                    probs = inference.score_sequence(lease.model, volumes, device)
+                else:
+                    probs = inference.score_independent(lease.model, volumes, device)
+            if mode == "independent":
+                models.submit_shadow(lease.name, volumes, probs, device)
+            return probs, (lease.name, lease.version)
+
+        try:
+            probs, served = await run_in_threadpool(run)
+        except LookupError as e:
+            return JSONResponse(status_code=404, content={"error": str(e)})
+        out = batch_response(mode, probs, served)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - request_start, stage="end_to_end")
+        return out
+
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": str(e), "traceback": traceback.format_exc()[-4000:]}
+        )
+    finally:
+        admission.release(ticket)
+        if shm is not None:
+            buffer = None
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,87 @@
+# inference.py
+""" In-process inference for api_server.py endpoints that need more than one scan per model call.
+
+Models are loaded once per (path, device) and kept resident. Uploaded volumes are decoded and resized
+concurrently in a process pool (PREPROCESS_WORKERS, default: all cores) and then scored either as
+independent scans in batches or as one ordered patient sequence through the Network's LSTM. """
+
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = HERE if os.path.isdir(os.path.join(HERE, "inference_engine")) else os.path.dirname(HERE)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from inference_engine import INPUT_SHAPE, preprocess_file_timed, binary_decision
+from inference_engine.bgzf import share_cores
+from inference_engine.engine import infer_batch, load_network
+import metrics
+
+SCAN_BATCH = int(os.environ.get("SCAN_BATCH", "4"))
+
+_models = {}
+_models_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def load_model(model_path, device="cpu"):
+    """Builds the Network and loads a state_dict checkpoint, ready for inference."""
+    return load_network(model_path, device)
+
+
+def get_model(model_path, device="cpu"):
+    """Loads a checkpoint once and returns the resident model on later calls."""
+    key = (os.path.abspath(model_path), str(device))
+    with _models_lock:
+        model = _models.get(key)
+        metrics.record_cache("model", model is not None)
+        if model is None:
+            model = load_model(model_path, device)
+            _models[key] = model
+        return model
+
+
+def _preprocess_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get("PREPROCESS_WORKERS", "0")) or (os.cpu_count() or 1)
+            _pool = ProcessPoolExecutor(max_workers=workers, initializer=share_cores, initargs=(workers,))
+        return _pool
+
+
+def preprocess_many(paths):
+    """Decodes, normalizes and resizes the files in parallel. Returns float32 volumes in input order."""
+    if len(paths) == 1:
+        results = [preprocess_file_timed(paths[0], INPUT_SHAPE)]
+    else:
+        results = list(_preprocess_pool().map(preprocess_file_timed, paths, [INPUT_SHAPE] * len(paths)))
+    volumes = []
+    for volume, timings in results:
+        metrics.observe_timings(timings)
+        volumes.append(volume)
+    return volumes
+
+
+def decision_for(prob_pos):
+    return binary_decision(prob_pos)
+
+
+def scan_result(probs):
+    probs = [float(p) for p in probs]
+    return {"class_probs": probs, "prob_pos": probs[1], "decision": decision_for(probs[1])}
+
+
+def score_independent(model, volumes, device="cpu"):
+    """Each scan scored on its own, SCAN_BATCH scans per forward. Returns (N, 2) probabilities."""
+    return infer_batch(model, volumes, "independent", device, batch_size=SCAN_BATCH)
+
+
+def score_sequence(model, volumes, device="cpu"):
+    """The scans as one ordered patient sequence through the LSTM, the way evaluate.py trains.
+    Returns (N, 2) probabilities; row i has seen scans 0..i, so the last row is the patient-level result."""
+    return infer_batch(model, volumes, "sequence", device)
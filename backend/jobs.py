@@ -0,0 +1,180 @@
+# jobs.py
+""" Asynchronous prediction jobs for api_server.py.
+
+A JobManager owns a bounded queue and a fixed number of worker threads. POST /jobs only saves the
+upload and enqueues a job id, so no HTTP connection is held while a scan is processed. Job state lives
+in memory, or in SQLite when a database path is given (JOB_DB). With SQLite, jobs that were still
+queued when the server stopped are picked up again on restart.
+
+Finished (done or failed) jobs are kept for JOB_TTL seconds (default 86400) and at most JOB_MAX_FINISHED
+of them (default 1000, oldest evicted first) so neither memory nor the database grows with every request;
+set either to 0 to turn that limit off. An evicted job's id answers 404. """
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+JOB_TTL = float(os.environ.get("JOB_TTL", "86400"))
+JOB_MAX_FINISHED = int(os.environ.get("JOB_MAX_FINISHED", "1000"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobStore:
+    """Thread-safe job records. Every update bumps `version`, which the SSE endpoint watches. Finished jobs
+    older than `ttl` seconds, and the oldest beyond `max_finished`, are evicted (0 or None: no limit)."""
+
+    def __init__(self, db_path=None, ttl=JOB_TTL, max_finished=JOB_MAX_FINISHED):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, record TEXT NOT NULL)")
+            self._db.commit()
+            for job_id, record in self._db.execute("SELECT id, record FROM jobs"):
+                self._jobs[job_id] = json.loads(record)
+            with self._lock:
+                self._evict()
+
+    def create(self, params):
+        now = time.time()
+        job = {"id": uuid.uuid4().hex, "status": QUEUED, "stage": "queued", "progress": 0,
+               "params": params, "result": None, "error": None,
+               "created": now, "updated": now, "version": 0}
+        with self._lock:
+            self._evict()
+            self._jobs[job["id"]] = job
+            self._persist(job)
+        return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job["updated"] = time.time()
+            job["version"] += 1
+            self._persist(job)
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def pending(self):
+        """Jobs that never finished, oldest first (used to resume after a restart)."""
+        with self._lock:
+            jobs = [dict(j) for j in self._jobs.values() if j["status"] in (QUEUED, RUNNING)]
+        return sorted(jobs, key=lambda j: j["created"])
+
+    def counts(self):
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def _evict(self):
+        """Drops expired finished jobs, then the oldest finished ones beyond max_finished. Caller holds the lock."""
+        finished = sorted((j for j in self._jobs.values() if j["status"] in FINISHED), key=lambda j: j["updated"])
+        drop = 0
+        if self.ttl:
+            cutoff = time.time() - self.ttl
+            while drop < len(finished) and finished[drop]["updated"] < cutoff:
+                drop += 1
+        if self.max_finished:
+            drop = max(drop, len(finished) - self.max_finished)
+        if not drop:
+            return
+        ids = [job["id"] for job in finished[:drop]]
+        for job_id in ids:
+            del self._jobs[job_id]
+        if self._db is not None:
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+            self._db.commit()
+
+    def _persist(self, job):
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO jobs (id, record) VALUES (?, ?)", (job["id"], json.dumps(job)))
+            self._db.commit()
+
+
+class JobManager:
+    """ Runs jobs on `workers` threads. Specify:
+        + runner, a callable (params, report) -> result dict, where report(stage, progress) publishes progress
+        + workers, the number of jobs executed concurrently
+        + max_queued, how many jobs may wait before submit() raises QueueFull
+        + db_path, optional SQLite file for job state
+        + ttl / max_finished, how long and how many finished jobs are kept (see JobStore)"""
+
+    def __init__(self, runner, workers=2, max_queued=32, db_path=None, ttl=JOB_TTL, max_finished=JOB_MAX_FINISHED):
+        self.runner = runner
+        self.store = JobStore(db_path, ttl, max_finished)
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        # Re-queue work interrupted by a restart (only possible with a SQLite store)
+        for job in self.store.pending():
+            self.store.update(job["id"], status=QUEUED, stage="queued", progress=0)
+            try:
+                self._queue.put_nowait(job["id"])
+            except queue.Full:
+                self.store.update(job["id"], status=FAILED, error="Queue full after restart")
+
+    def submit(self, params):
+        job = self.store.create(params)
+        try:
+            self._queue.put_nowait(job["id"])
+        except queue.Full:
+            self.store.update(job["id"], status=FAILED, stage="rejected", error="Job queue is full")
+            raise QueueFull()
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            job = self.store.get(job_id)
+            try:
+                self.store.update(job_id, status=RUNNING, stage="starting", progress=1)
+
+                def report(stage, progress):
+                    self.store.update(job_id, stage=stage, progress=int(progress))
+
+                result = self.runner(job["params"], report)
+                self.store.update(job_id, status=DONE, stage="done", progress=100, result=result)
+            except Exception as e:
+                self.store.update(job_id, status=FAILED, stage="failed", error=f"{type(e).__name__}: {e}")
+            finally:
+                cleanup = job["params"].get("cleanup_path") if job else None
+                if cleanup and os.path.exists(cleanup):
+                    try:
+                        os.remove(cleanup)
+                    except OSError:
+                        pass
+                self._queue.task_done()
+
+
+def public_view(job):
+    """The parts of a job record returned to API clients."""
+    return {key: job[key] for key in ("id", "status", "stage", "progress", "result", "error", "created", "updated")}
@@ -0,0 +1,274 @@
+# model_manager.py
+""" Resident, versioned models for api_server.py.
+
+Models are registered under a name (e.g. "alzheimers") with one or more versions, each backed by a
+checkpoint. One version per name is active. Loaded versions stay resident in an LRU that is kept under
+a memory budget. A request holds a lease on the model it runs, and a leased model is never evicted. A
+hot-swap therefore loads the new checkpoint first and then flips the active version under the lock:
+in-flight requests finish on the old version and new requests get the new one.
+
+Requests are routed by header:
+    X-Model: <name> or <name>@<version>
+    X-Model-Version: <version>   (optional, with X-Model)
+Without a header, MODEL_AB splits traffic between names by weight, sticky per client. MODEL_SHADOW
+names a model that is also run on every resident prediction, in the background, after the response
+has been computed. It only feeds the alzheimer_shadow_* metrics.
+
+Configuration (environment):
+    MODELS             name=checkpoint pairs, comma-separated; paths are relative to the repo root
+                       (default: alzheimers=alzheimers_model.pth,ad-model=ad-model.pt, whichever exist)
+    MODEL_DEFAULT      name served when nothing else decides (default: the first of MODELS)
+    MODEL_MEMORY_MB    budget for resident models (default 512)
+    MODEL_AB           e.g. "alzheimers=90,ad-model=10"
+    MODEL_SHADOW       e.g. "ad-model"
+    SHADOW_QUEUE       shadow evaluations allowed to wait; more are dropped (default 4)
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import inference
+import metrics
+
+log = logging.getLogger(__name__)
+
+SERVED = metrics.REGISTRY.register(metrics.Counter(
+    "alzheimer_model_requests_total", "Resident predictions by model and version.", ["model", "version"]))
+RESIDENT_BYTES = metrics.REGISTRY.register(metrics.Gauge(
+    "alzheimer_resident_model_bytes", "Memory held by resident models."))
+SHADOW_RESULTS = metrics.REGISTRY.register(metrics.Counter(
+    "alzheimer_shadow_comparisons_total", "Shadow evaluations by primary/shadow model and agreement.",
+    ["primary", "shadow", "agreement"]))
+SHADOW_DIFF = metrics.REGISTRY.register(metrics.Histogram(
+    "alzheimer_shadow_prob_abs_diff", "Absolute difference in P(Alzheimer's) between primary and shadow.",
+    ["primary", "shadow"], buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0)))
+
+
+class UnknownModel(LookupError):
+    pass
+
+
+def checkpoint_version(path):
+    """Content hash of a checkpoint, used as its version when none is given."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def model_bytes(model):
+    return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+
+
+def parse_pairs(value, cast=str):
+    """ "a=1,b=2" -> OrderedDict(a=cast("1"), b=cast("2")) """
+    pairs = OrderedDict()
+    for item in (value or "").split(","):
+        if "=" in item:
+            key, val = item.split("=", 1)
+            pairs[key.strip()] = cast(val.strip())
+    return pairs
+
+
+class Lease:
+    def __init__(self, name, version, model):
+        self.name, self.version, self.model = name, version, model
+
+
+class ModelManager:
+    """ Named, versioned models with an LRU of resident ones. Specify:
+        + budget_mb, memory allowed for resident models (leased models may push it over temporarily)
+        + ab_weights, optional {name: weight} used to route requests without a model header
+        + shadow, optional model name evaluated in the background next to every resident prediction
+        + loader, a callable (path, device) -> model"""
+
+    def __init__(self, budget_mb=512, ab_weights=None, shadow=None, shadow_queue=4, loader=inference.load_model):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.ab_weights = OrderedDict(ab_weights or {})
+        self.shadow = shadow
+        self.default = None
+        self.loader = loader
+        self._versions = {}       # name -> {version: checkpoint path}
+        self._active = {}         # name -> version
+        self._resident = OrderedDict()  # (name, version, device) -> {"model", "bytes", "leases"}
+        self._loading = {}        # key -> Event, so concurrent requests share one load
+        self._lock = threading.Lock()
+        self._shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._shadow_slots = threading.BoundedSemaphore(max(1, shadow_queue))
+        RESIDENT_BYTES.set_function(lambda: sum(e["bytes"] for e in list(self._resident.values())))
+
+    @classmethod
+    def from_env(cls, root):
+        env = os.environ.get
+        manager = cls(budget_mb=float(env("MODEL_MEMORY_MB", "512")),
+                      ab_weights=parse_pairs(env("MODEL_AB"), float), shadow=env("MODEL_SHADOW") or None,
+                      shadow_queue=int(env("SHADOW_QUEUE", "4")))
+        models = parse_pairs(env("MODELS"))
+        if not models:
+            for name, filename in (("alzheimers", "alzheimers_model.pth"), ("ad-model", "ad-model.pt")):
+                if os.path.exists(os.path.join(root, filename)):
+                    models[name] = filename
+        for name, path in models.items():
+            manager.register(name, path if os.path.isabs(path) else os.path.join(root, path), load=False)
+        manager.default = env("MODEL_DEFAULT") or next(iter(models), None)
+        return manager
+
+    # ----------------- REGISTRY -----------------
+    def register(self, name, path, version=None, activate=True, load=True, device="cpu"):
+        """Adds a checkpoint as a version of `name` and optionally makes it active. With load=True the
+        model is loaded before the switch, so requests never wait on a swap. Returns the version."""
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        version = version or checkpoint_version(path)
+        with self._lock:
+            self._versions.setdefault(name, {})[version] = path
+        if load:
+            self._ensure_loaded(name, version, device)
+        if activate:
+            with self._lock:
+                previous = self._active.get(name)
+                self._active[name] = version
+            if previous and previous != version:
+                log.info("Model %s switched from %s to %s", name, previous, version)
+        return version
+
+    def names(self):
+        with self._lock:
+            return list(self._active)
+
+    def active(self, name):
+        """(version, checkpoint path) of the active version of `name`."""
+        with self._lock:
+            if name not in self._active:
+                raise UnknownModel(f"Unknown model {name!r}")
+            version = self._active[name]
+            return version, self._versions[name][version]
+
+    def status(self):
+        with self._lock:
+            return {
+                "default": self.default, "ab": dict(self.ab_weights), "shadow": self.shadow,
+                "budget_bytes": self.budget_bytes,
+                "models": {name: {"active": self._active.get(name), "versions": sorted(versions)}
+                           for name, versions in self._versions.items()},
+                "resident": [{"model": n, "version": v, "device": d, "bytes": e["bytes"], "leases": e["leases"]}
+                             for (n, v, d), e in self._resident.items()],
+            }
+
+    # ----------------- ROUTING -----------------
+    def route(self, headers, client=""):
+        """Returns (name, version) for a request; version None means the active one."""
+        requested = headers.get("x-model")
+        version = headers.get("x-model-version")
+        if requested:
+            if "@" in requested:
+                requested, version = requested.split("@", 1)
+            return requested, version or None
+        if self.ab_weights:
+            # sticky split: the same client always lands on the same arm
+            total = sum(self.ab_weights.values())
+            point = (zlib.crc32(client.encode()) % 10000) / 10000 * total
+            for name, weight in self.ab_weights.items():
+                if point < weight:
+                    return name, None
+                point -= weight
+        return self.default, None
+
+    # ----------------- RESIDENCY -----------------
+    @contextmanager
+    def lease(self, name, version=None, device="cpu"):
+        """Pins a resident model for the duration of one request."""
+        with self._lock:
+            if name not in self._versions:
+                raise UnknownModel(f"Unknown model {name!r}")
+            version = version or self._active.get(name)
+            if version not in self._versions[name]:
+                raise UnknownModel(f"Unknown version {version!r} of model {name!r}")
+        key = self._ensure_loaded(name, version, device, pin=True)
+        try:
+            SERVED.inc(model=name, version=version)
+            yield Lease(name, version, self._resident[key]["model"])
+        finally:
+            with self._lock:
+                self._resident[key]["leases"] -= 1
+            self._evict()
+
+    def get(self, name, device="cpu"):
+        """The active version of `name`, loaded if needed (no lease: for warm-up and tooling)."""
+        with self.lease(name, device=device) as lease:
+            return lease.model
+
+    def _ensure_loaded(self, name, version, device, pin=False):
+        key = (name, version, str(device))
+        while True:
+            with self._lock:
+                entry = self._resident.get(key)
+                if entry is not None:
+                    self._resident.move_to_end(key)
+                    if pin:
+                        entry["leases"] += 1
+                    metrics.record_cache("resident_model", True)
+                    return key
+                pending = self._loading.get(key)
+                if pending is None:
+                    pending = self._loading[key] = threading.Event()
+                    path = self._versions[name][version]
+                    break
+            pending.wait()
+        metrics.record_cache("resident_model", False)
+        try:
+            model = self.loader(path, device)
+            with self._lock:
+                self._resident[key] = {"model": model, "bytes": model_bytes(model), "leases": 1 if pin else 0}
+            log.info("Loaded model %s@%s on %s", name, version, device)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            pending.set()
+        self._evict()
+        return key
+
+    def _evict(self):
+        """Drops least recently used, unleased models until the resident set fits the budget."""
+        with self._lock:
+            used = sum(e["bytes"] for e in self._resident.values())
+            for key in list(self._resident):
+                if used <= self.budget_bytes:
+                    break
+                entry = self._resident[key]
+                if entry["leases"] == 0:
+                    used -= entry["bytes"]
+                    del self._resident[key]
+                    log.info("Evicted model %s@%s from %s", *key)
+
+    # ----------------- SHADOW -----------------
+    def submit_shadow(self, primary, volumes, primary_probs, device="cpu"):
+        """Scores `volumes` with the shadow model in the background and records how it compares.
+        Never blocks the caller: when the shadow queue is full the evaluation is dropped."""
+        if not self.shadow or self.shadow == primary:
+            return False
+        if not self._shadow_slots.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                with self.lease(self.shadow, device=device) as lease:
+                    shadow_probs = inference.score_independent(lease.model, volumes, device)
+                for p, s in zip(primary_probs, shadow_probs):
+                    agree = (p[1] >= 0.5) == (s[1] >= 0.5)
+                    SHADOW_RESULTS.inc(primary=primary, shadow=self.shadow, agreement="agree" if agree else "disagree")
+                    SHADOW_DIFF.observe(abs(float(p[1]) - float(s[1])), primary=primary, shadow=self.shadow)
+            except Exception:
+                log.exception("Shadow evaluation with %s failed", self.shadow)
+            finally:
+                self._shadow_slots.release()
+
+        self._shadow_pool.submit(run)
+        return True
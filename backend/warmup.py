@@ -0,0 +1,196 @@
+# warmup.py
+""" Startup warm-up and readiness for api_server.py.
+
+The first forward of a fresh process is several times slower than the steady state: the allocator
+grows its pools, and oneDNN/MKL pick kernels for each 3D convolution shape on first use. Before a
+replica is reported ready, Warmup runs synthetic (N, 1, 200, 200, 150) batches through every
+configured model and batch size, using the same inference.py path and pooled input buffers as real
+requests. It repeats until the p99 latency of the last WARMUP_WINDOW passes stops moving. The sequence
+path runs every served length (1 to MAX_NUM_IMAGES scans through the convolutions at once) once, and the
+longest until it is stable. A batch size that does not stabilize is warmed again after a backoff; if it
+never does, the replica stays not-ready (state "failed") unless WARMUP_ALLOW_UNSTABLE=1.
+
+Configuration (environment):
+    WARMUP                 0 disables warm-up; the server is ready immediately (default 1)
+    WARMUP_MODELS          comma-separated model names (default: every model registered in model_manager.py)
+                           (with INFERENCE_WORKERS, each worker process runs this warm-up itself)
+    WARMUP_DEVICE          device to warm (default cpu)
+    WARMUP_BATCH_SIZES     comma-separated batch sizes, at most SCAN_BATCH (default: 1 and SCAN_BATCH)
+    WARMUP_SEQUENCE        0 skips warming the sequence path (default 1)
+    WARMUP_WINDOW          passes per p99 window (default 3)
+    WARMUP_TOLERANCE       relative p99 change between windows that counts as stable (default 0.10)
+    WARMUP_MAX_ITERS       passes per batch size before giving up on stabilizing (default 15)
+    WARMUP_RETRIES         further rounds for batch sizes that did not stabilize, with backoff (default 2)
+    WARMUP_ALLOW_UNSTABLE  1 reports ready even if p99 never stabilized (default 0)
+    WARMUP_BUFFERS         idle input buffers kept per batch size (default 2)
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import inference
+from inference_engine import MAX_NUM_IMAGES
+from inference_engine.engine import buffers as input_buffers
+
+log = logging.getLogger(__name__)
+
+PENDING, WARMING, READY, FAILED = "pending", "warming", "ready", "failed"
+
+
+def p99(latencies):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, math.ceil(0.99 * len(ordered)) - 1)]
+
+
+def is_stable(latencies, window, tolerance):
+    """True once the p99 of the last `window` passes is within `tolerance` of the window before it."""
+    if len(latencies) < 2 * window:
+        return False
+    previous, current = p99(latencies[-2 * window:-window]), p99(latencies[-window:])
+    return abs(current - previous) <= tolerance * previous
+
+
+def _env_list(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+class Warmup:
+    """ Warms models in a background thread and tracks readiness. Specify:
+        + models, identifiers passed to `load`
+        + load, a callable (model id, device) -> resident model (default: inference.get_model on a path)
+        + batch_sizes, the scan batch sizes to exercise
+        + device, where the models run
+        + window / tolerance / max_iters, the p99 stabilization rule
+        + retries / allow_unstable, what happens when p99 does not stabilize
+        + sequence, whether to warm the sequence path too
+        + buffers, idle input buffers to preallocate per batch size"""
+
+    def __init__(self, models, batch_sizes, load=inference.get_model, device="cpu", window=3, tolerance=0.10,
+                 max_iters=15, buffers=2, retries=2, allow_unstable=False, sequence=True):
+        self.models = list(models)
+        self.load = load
+        self.batch_sizes = sorted(set(int(b) for b in batch_sizes))
+        if self.batch_sizes and self.batch_sizes[-1] > inference.SCAN_BATCH:
+            # score_independent splits larger batches into SCAN_BATCH chunks, so they would warm nothing new
+            raise ValueError(f"Warm-up batch sizes {self.batch_sizes} exceed SCAN_BATCH={inference.SCAN_BATCH}")
+        self.device = device
+        self.window = window
+        self.tolerance = tolerance
+        self.max_iters = max(max_iters, 2 * window)
+        self.buffers = buffers
+        self.retries = retries
+        self.allow_unstable = allow_unstable
+        self.sequence = sequence
+        self.state = PENDING
+        self.error = None
+        self.results = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, names, load):
+        env = os.environ.get
+        models = _env_list("WARMUP_MODELS", names)
+        batch_sizes = _env_list("WARMUP_BATCH_SIZES", [1, inference.SCAN_BATCH])
+        return cls(models, batch_sizes, load=load, device=env("WARMUP_DEVICE", "cpu"),
+                   window=int(env("WARMUP_WINDOW", "3")), tolerance=float(env("WARMUP_TOLERANCE", "0.10")),
+                   max_iters=int(env("WARMUP_MAX_ITERS", "15")), buffers=int(env("WARMUP_BUFFERS", "2")),
+                   retries=int(env("WARMUP_RETRIES", "2")), allow_unstable=env("WARMUP_ALLOW_UNSTABLE", "0") == "1",
+                   sequence=env("WARMUP_SEQUENCE", "1") != "0")
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def start(self):
+        """Runs warm-up in a daemon thread (or marks ready at once when disabled / nothing to warm)."""
+        if os.environ.get("WARMUP", "1") == "0" or not self.models:
+            if not self.models:
+                log.warning("No model to warm up; reporting ready without warm-up")
+            self.state = READY
+            return None
+        thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        self.state = WARMING
+        started = time.perf_counter()
+        try:
+            unstable = []
+            for model_id in self.models:
+                model = self.load(model_id, self.device)
+                shapes = [("independent", batch_size) for batch_size in self.batch_sizes]
+                if self.sequence:
+                    # a sequence pushes all its scans through the convolutions at once: every length is a
+                    # new shape, and the LSTM kernels are not exercised by independent scoring at all
+                    for length in range(1, MAX_NUM_IMAGES):
+                        inference.score_sequence(model, self._volumes(length), self.device)
+                    shapes.append(("sequence", MAX_NUM_IMAGES))
+                for attempt in range(self.retries + 1):
+                    if attempt:
+                        delay = min(30.0, 2.0 ** attempt)
+                        log.info("Retrying warm-up of %d shapes in %.0fs", len(shapes), delay)
+                        time.sleep(delay)
+                    shapes = [(mode, size) for mode, size in shapes if not self._warm(model, model_id, size, mode)]
+                    if not shapes:
+                        break
+                unstable += [f"{os.path.basename(str(model_id))} {mode} x{size}" for mode, size in shapes]
+        except Exception as e:
+            log.exception("Warm-up failed")
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = FAILED
+            return
+        if unstable and not self.allow_unstable:
+            self.error = f"p99 did not stabilize for {', '.join(unstable)}"
+            log.error("Warm-up failed after %.1fs: %s (WARMUP_ALLOW_UNSTABLE=1 reports ready anyway)",
+                      time.perf_counter() - started, self.error)
+            self.state = FAILED
+            return
+        if unstable:
+            log.warning("Reporting ready although p99 did not stabilize for %s", ", ".join(unstable))
+        log.info("Warm-up finished in %.1fs", time.perf_counter() - started)
+        self.state = READY
+
+    def _volumes(self, batch_size):
+        rng = np.random.default_rng(0)
+        return [rng.random(inference.INPUT_SHAPE, dtype=np.float32) for _ in range(batch_size)]
+
+    def _warm(self, model, model_id, batch_size, mode="independent"):
+        """Runs `batch_size` scans until p99 is stable or max_iters passes; returns whether it stabilized."""
+        input_buffers.preallocate(batch_size, self.device, self.buffers)
+        volumes = self._volumes(batch_size)
+        score = inference.score_sequence if mode == "sequence" else inference.score_independent
+        latencies = []
+        while len(latencies) < self.max_iters:
+            start = time.perf_counter()
+            score(model, volumes, self.device)
+            latencies.append(time.perf_counter() - start)
+            if is_stable(latencies, self.window, self.tolerance):
+                break
+        stable = is_stable(latencies, self.window, self.tolerance)
+        result = {"model": os.path.basename(str(model_id)), "mode": mode, "batch_size": batch_size,
+                  "iterations": len(latencies),
+                  "first_seconds": round(latencies[0], 4), "p99_seconds": round(p99(latencies[-self.window:]), 4),
+                  "stabilized": stable}
+        if not stable:
+            log.warning("p99 for %s batch size %d did not stabilize within %d passes", mode, batch_size,
+                        self.max_iters)
+        log.info("Warm-up %s %s batch=%d: first %.3fs, steady p99 %.3fs after %d passes", result["model"], mode,
+                 batch_size, result["first_seconds"], result["p99_seconds"], result["iterations"])
+        with self._lock:
+            self.results.append(result)
+        return stable
+
+    def status(self):
+        with self._lock:
+            return {"state": self.state, "ready": self.ready, "error": self.error, "models": self.models,
+                    "batch_sizes": self.batch_sizes, "device": self.device, "results": list(self.results),
+                    "buffers": input_buffers.status()}
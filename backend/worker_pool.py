@@ -0,0 +1,304 @@
+# worker_pool.py
+""" Forked inference workers that share one copy of the model weights.
+
+Several uvicorn workers would each load their own copy of every Network and each start a torch
+thread pool sized to the whole machine, so N workers oversubscribe the cores N times over. In this
+mode a single API process loads the active models once and moves their weights into shared memory
+(Module.share_memory()). It then forks INFERENCE_WORKERS processes, which map those pages instead of
+copying them. Each worker decodes, preprocesses and scores whole requests with
+THREADS_PER_WORKER intra-op threads, so workers x threads matches the cores the process may use.
+Only file paths (or the name of a shared-memory tensor, for /predict/tensor) and (N, 2) probabilities
+cross the process boundary.
+
+The parent never runs a forward pass and keeps torch at one thread, so no OpenMP team exists when
+it forks (forking after OpenMP has started can hang the child). The parent queues requests itself and
+hands each one to an idle worker through that worker's own pipe, so it always knows which request a
+worker holds: a worker that dies is replaced, and its request fails at once instead of hanging.
+
+Configuration (environment):
+    INFERENCE_WORKERS     0 = score in the API process (default); N or "auto" = forked workers
+    THREADS_PER_WORKER    intra-op threads per worker (default: planned, see plan_workers)
+"""
+
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import torch
+
+import inference
+import metrics
+
+log = logging.getLogger(__name__)
+
+# 3D convolutions on 200x200x150 volumes stop scaling well past a handful of threads per process
+DEFAULT_THREADS_PER_WORKER = 4
+# Longest wait for a result before worker liveness is checked again
+CHECK_INTERVAL = 0.5
+
+WORKERS_BUSY = metrics.REGISTRY.register(metrics.Gauge(
+    "alzheimer_inference_workers", "Forked inference workers by state.", ["state"]))
+
+
+def available_cores():
+    """Cores this process may run on (respects cgroup/cpuset affinity, unlike os.cpu_count())."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def plan_workers(cores, workers=None, threads=None):
+    """Splits `cores` into (workers, threads per worker) so that workers * threads <= cores.
+    Either value may be fixed; the other is derived. With neither, threads defaults to
+    DEFAULT_THREADS_PER_WORKER (or fewer on small machines) and workers fill the remaining cores."""
+    cores = max(1, cores)
+    if workers and threads:
+        if workers * threads > cores:
+            log.warning("%d workers x %d threads oversubscribes %d cores", workers, threads, cores)
+        return workers, threads
+    if workers:
+        return workers, max(1, cores // workers)
+    threads = threads or min(DEFAULT_THREADS_PER_WORKER, cores)
+    return max(1, cores // threads), threads
+
+
+def _attach_shared(name):
+    """Maps a block created by the parent. The parent owns (and unlinks) it, so the worker must not
+    register it with the resource tracker, which would otherwise unlink it when the worker exits."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _load_source(source, preprocess, stage_timings):
+    """File paths are decoded and preprocessed; a shared tensor is used in place."""
+    if isinstance(source, dict):
+        shm = _attach_shared(source["shm"])
+        return np.ndarray(source["shape"], dtype=source["dtype"], buffer=shm.buf), shm
+    volumes = []
+    for path in source:
+        volume, timings = preprocess(path)
+        volumes.append(volume)
+        stage_timings.append(timings)
+    return volumes, None
+
+
+def _worker_main(index, models, threads, tasks, results):
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    from inference_engine import preprocess_file_timed
+    from inference_engine.bgzf import share_cores
+    from warmup import Warmup
+
+    # BGZF scans inflate on this worker's share of the cores, like its intra-op threads
+    share_cores(max(1, available_cores() // threads))
+
+    warmer = Warmup.from_env(list(models), lambda name, device: models[name])
+    if os.environ.get("WARMUP", "1") != "0" and warmer.models:
+        warmer.run()
+    status = warmer.status()
+    # a worker whose warm-up failed still serves requests, but keeps the pool not-ready
+    results.put(("failed" if status["state"] == "failed" else "ready", index, None,
+                 {"results": status["results"], "error": status["error"]}))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, name, source, mode = task
+        volumes = shm = None
+        try:
+            stage_timings = []
+            volumes, shm = _load_source(source, preprocess_file_timed, stage_timings)
+            start = time.perf_counter()
+            score = inference.score_sequence if mode == "sequence" else inference.score_independent
+            probs = score(models[name], volumes)
+            stage_timings.append({"forward": time.perf_counter() - start})
+            results.put(("done", index, task_id, {"probs": probs, "timings": stage_timings}))
+        except Exception as e:
+            results.put(("error", index, task_id, f"{type(e).__name__}: {e}"))
+        finally:
+            # the array view must go before the mapping can be closed
+            volumes = None
+            if shm is not None:
+                shm.close()
+
+
+class WorkerPool:
+    """ Shared-weight inference processes. Specify:
+        + models, {name: (version, checkpoint path)} to load once and share
+        + workers / threads, the process and per-process thread counts (see plan_workers)
+
+    Also serves as the readiness source for /ready: ready once every worker has finished its warm-up,
+    failed if any worker's warm-up failed (see warmup.py)."""
+
+    def __init__(self, models, workers, threads):
+        self.workers = workers
+        self.threads = threads
+        self.versions = {name: version for name, (version, _) in models.items()}
+        # no OpenMP team in the parent before fork(); the parent only loads weights
+        torch.set_num_threads(1)
+        self.models = {}
+        for name, (version, path) in models.items():
+            model = inference.load_model(path)
+            for p in model.parameters():
+                p.requires_grad_(False)
+            self.models[name] = model.share_memory()
+            log.info("Shared %s@%s with %d workers", name, version, workers)
+        self._ctx = mp.get_context("fork")
+        self._results = self._ctx.Queue()
+        self._procs = [None] * workers
+        self._inboxes = [None] * workers  # worker index -> the pipe its tasks are sent through
+        self._pending = deque()  # tasks waiting for an idle worker
+        self._ready = set()
+        self._failed = {}    # worker index -> warm-up error
+        self._running = {}   # worker index -> task id handed to it
+        self._futures = {}   # task id -> Future
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.warmup_results = []
+        WORKERS_BUSY.set_function(lambda: len(self._running), state="busy")
+        WORKERS_BUSY.set_function(lambda: sum(p is not None and p.is_alive() for p in self._procs), state="alive")
+
+    @classmethod
+    def from_env(cls, manager):
+        setting = os.environ.get("INFERENCE_WORKERS", "0")
+        threads = int(os.environ.get("THREADS_PER_WORKER", "0")) or None
+        workers, threads = plan_workers(available_cores(), None if setting == "auto" else int(setting), threads)
+        models = {name: manager.active(name) for name in manager.names()}
+        log.info("Inference workers: %d x %d threads on %d cores", workers, threads, available_cores())
+        return cls(models, workers, threads)
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        threading.Thread(target=self._collect, name="worker-pool-results", daemon=True).start()
+        return self
+
+    def _spawn(self, index):
+        # a new pipe per process: a worker that died mid-read may have left the old one unusable
+        self._inboxes[index] = self._ctx.SimpleQueue()
+        proc = self._ctx.Process(target=_worker_main, name=f"inference-worker-{index}",
+                                 args=(index, self.models, self.threads, self._inboxes[index], self._results),
+                                 daemon=True)
+        proc.start()
+        self._procs[index] = proc
+
+    # ----------------- REQUESTS -----------------
+    def submit(self, name, paths, mode="independent"):
+        """Queues one request (all its scans go to the same worker). Returns a Future of (N, 2) probabilities."""
+        return self._submit(name, list(paths), mode)
+
+    def submit_shared(self, name, shm, shape, dtype, mode="independent"):
+        """Like submit, for an (N, D, H, W) tensor already written into `shm` (see allocate_shared).
+        The worker maps the block instead of receiving a copy; the caller unlinks it afterwards."""
+        return self._submit(name, {"shm": shm.name, "shape": tuple(shape), "dtype": np.dtype(dtype).str}, mode)
+
+    @staticmethod
+    def allocate_shared(nbytes):
+        return shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+
+    def _submit(self, name, source, mode):
+        if name not in self.models:
+            raise LookupError(f"Unknown model {name!r}")
+        future = Future()
+        with self._lock:
+            task_id = next(self._ids)
+            self._futures[task_id] = future
+            self._pending.append((task_id, name, source, mode))
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """Hands waiting tasks to idle workers that finished their warm-up, recording the assignment before
+        the worker can see the task. Caller holds the lock."""
+        for index in range(self.workers):
+            if not self._pending:
+                return
+            if index in self._running or (index not in self._ready and index not in self._failed):
+                continue
+            task = self._pending.popleft()
+            self._running[index] = task[0]
+            self._inboxes[index].put(task)
+
+    def _collect(self):
+        # liveness is checked on every pass, so a crashed worker is replaced under steady load too
+        while True:
+            try:
+                self._handle(*self._results.get(timeout=CHECK_INTERVAL))
+            except queue.Empty:
+                pass
+            self._check_workers()
+
+    def _handle(self, kind, index, task_id, payload):
+        with self._lock:
+            if kind in ("ready", "failed"):
+                if kind == "ready":
+                    self._ready.add(index)
+                else:
+                    self._failed[index] = payload["error"]
+                self.warmup_results.extend(payload["results"])
+                self._dispatch()
+                return
+            self._running.pop(index, None)
+            future = self._futures.pop(task_id, None)
+            self._dispatch()
+        if future is None:
+            return
+        if kind == "done":
+            for timings in payload["timings"]:
+                metrics.observe_timings(timings)
+            future.set_result(payload["probs"])
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _check_workers(self):
+        dead = [index for index, proc in enumerate(self._procs) if proc is not None and not proc.is_alive()]
+        if not dead:
+            return
+        # a worker may have posted its last result just before exiting; deliver it rather than fail the task
+        while True:
+            try:
+                self._handle(*self._results.get_nowait())
+            except queue.Empty:
+                break
+        for index in dead:
+            proc = self._procs[index]
+            log.error("Inference worker %d exited with %s; restarting", index, proc.exitcode)
+            with self._lock:
+                self._ready.discard(index)
+                self._failed.pop(index, None)
+                # the task handed to it, whether or not it had read it yet
+                task_id = self._running.pop(index, None)
+                future = self._futures.pop(task_id, None) if task_id is not None else None
+            if future is not None:
+                future.set_exception(RuntimeError(f"Inference worker exited with {proc.exitcode}"))
+            self._spawn(index)
+
+    # ----------------- READINESS -----------------
+    @property
+    def ready(self):
+        return len(self._ready) == self.workers
+
+    def status(self):
+        with self._lock:
+            state = "failed" if self._failed else "ready" if self.ready else "warming"
+            return {"state": state, "ready": self.ready, "error": "; ".join(sorted(set(self._failed.values()))) or None,
+                    "workers": self.workers, "threads_per_worker": self.threads, "ready_workers": len(self._ready),
+                    "busy_workers": len(self._running), "pids": [p.pid for p in self._procs if p is not None],
+                    "models": self.versions, "results": list(self.warmup_results)}
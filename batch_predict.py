@@ -0,0 +1,257 @@
+# batch_predict.py
+""" Scores a whole cohort in one process: one checkpoint load, a process pool for NIfTI decoding and
+preprocessing, and batched Network inference. Results stream to CSV as each batch finishes, and a
+restarted run skips every scan already in the output file.
+
+    python batch_predict.py data_sample/Data --model alzheimers_model.pth --out cohort.csv
+    python batch_predict.py "scans/**/*.nii.gz" Data/Combined_MRI_List.pkl --root ./ --out cohort.parquet
+
+Scan paths in a manifest are relative to --root (the MRIData root_dir, as for pack_volumes.py); the output
+holds them resolved. Parquet output needs pandas and pyarrow.
+"""
+
+import argparse
+import csv
+import glob
+import os
+import pickle
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from inference_engine import CLASSES, INPUT_SHAPE, preprocess_file
+from inference_engine.bgzf import share_cores
+from log_utils import configure_logging, get_logger
+
+FIELDS = ["path", "label", "prob_neg", "prob_pos", "predicted_class", "predicted_label", "status", "error"]
+NIFTI_SUFFIXES = (".nii", ".nii.gz")
+
+log = get_logger("batch_predict")
+
+
+# ----------------- INPUT DISCOVERY -----------------
+def scans_from_manifest(path, root=None):
+    """Reads (scan path, label or None) pairs from a manifest, with relative scan paths joined to `root`
+    (if given) the way MRIData joins them to its root_dir.
+    .pkl: Combined_MRI_List-style entries [path..., label] (every string is a scan, the last item the label)
+    .csv: a `path` column and an optional `label` column
+    anything else: one path per line"""
+    resolve = (lambda item: os.path.join(root, item)) if root else (lambda item: item)
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            entries = pickle.load(f)
+        for entry in entries:
+            label = entry[-1] if not isinstance(entry[-1], str) else None
+            for item in entry:
+                if isinstance(item, str):
+                    yield resolve(item), label
+    elif path.endswith(".csv"):
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                yield resolve(row["path"]), row.get("label")
+    else:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield resolve(line), None
+
+
+def collect_scans(inputs, root=None):
+    """Expands directories, glob patterns and manifests into an ordered, de-duplicated list of (path, label).
+    Only manifest entries are resolved against `root`."""
+    seen = set()
+    scans = []
+
+    def add(path, label=None):
+        if path not in seen:
+            seen.add(path)
+            scans.append((path, label))
+
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in sorted(files):
+                    if name.lower().endswith(NIFTI_SUFFIXES):
+                        add(os.path.join(root, name))
+        elif any(ch in item for ch in "*?["):
+            for path in sorted(glob.glob(item, recursive=True)):
+                if path.lower().endswith(NIFTI_SUFFIXES):
+                    add(path)
+        elif item.lower().endswith(NIFTI_SUFFIXES):
+            add(item)
+        elif os.path.isfile(item):
+            for path, label in scans_from_manifest(item, root):
+                add(path, label)
+        else:
+            log.warning("Skipping %s: not a directory, glob, NIfTI file or manifest", item)
+    return scans
+
+
+# ----------------- RESULTS -----------------
+def partial_csv_path(out_path):
+    # Parquet cannot be appended to, so rows stream to a CSV next to it and are converted at the end.
+    return out_path + ".partial.csv" if out_path.endswith(".parquet") else out_path
+
+
+def completed_paths(out_path):
+    """Paths already scored successfully by a previous run; failed scans are retried."""
+    done = set()
+    if out_path.endswith(".parquet") and os.path.exists(out_path):
+        import pandas as pd
+        frame = pd.read_parquet(out_path, columns=["path", "status"])
+        done.update(frame.loc[frame["status"] == "ok", "path"])
+    csv_path = partial_csv_path(out_path)
+    if os.path.exists(csv_path):
+        with open(csv_path, newline="") as f:
+            done.update(row["path"] for row in csv.DictReader(f) if row.get("status") == "ok")
+    return done
+
+
+def missing_parquet_modules():
+    """The modules Parquet output needs that are not installed, checked before any scan is scored."""
+    missing = []
+    for module in ("pandas", "pyarrow"):
+        try:
+            __import__(module)
+        except ImportError:
+            missing.append(module)
+    return missing
+
+
+def finalize_parquet(out_path):
+    import pandas as pd
+    csv_path = partial_csv_path(out_path)
+    frames = [pd.read_parquet(out_path)] if os.path.exists(out_path) else []
+    frames.append(pd.read_csv(csv_path))
+    # A retried scan appears once per attempt; keep the latest row.
+    frame = pd.concat(frames, ignore_index=True).drop_duplicates(subset="path", keep="last")
+    frame.to_parquet(out_path, index=False)
+    os.remove(csv_path)
+
+
+# ----------------- PIPELINE -----------------
+def _preprocess(path):
+    """Worker-side: returns (path, volume or None, error message or None)."""
+    try:
+        return path, preprocess_file(path, INPUT_SHAPE), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def preprocessed(paths, workers, window):
+    """Yields preprocessed volumes in input order while keeping at most `window` scans in flight,
+    so memory stays bounded no matter how large the cohort is."""
+    if workers <= 1:
+        for path in paths:
+            yield _preprocess(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=share_cores, initargs=(workers,)) as pool:
+        pending = deque()
+        paths = iter(paths)
+        for path in paths:
+            pending.append(pool.submit(_preprocess, path))
+            if len(pending) >= window:
+                break
+        while pending:
+            result = pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(pool.submit(_preprocess, next_path))
+            yield result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score many MRI scans with one model load.")
+    parser.add_argument("inputs", nargs="+",
+                        help="Directories, glob patterns (quote them), NIfTI files or manifests (.pkl/.csv/.txt)")
+    parser.add_argument("--model", type=str, default="alzheimers_model.pth", help="Path to trained model (.pth)")
+    parser.add_argument("--root", type=str, default=None,
+                        help="MRIData root_dir the manifest scan paths are relative to (default: current directory)")
+    parser.add_argument("--out", type=str, default="batch_predictions.csv", help="Output .csv or .parquet")
+    parser.add_argument("--batch-size", type=int, default=8, help="Scans per forward pass")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Preprocessing processes (default: cores not used by inference threads)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Torch intra-op threads for inference (default: half the cores)")
+    parser.add_argument("--device", type=str, default="cpu", help="cpu or cuda")
+    parser.add_argument("--no-resume", action="store_true", default=False,
+                        help="Overwrite the output instead of skipping scans already scored")
+    parser.add_argument("--log-level", type=str, default=None)
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    missing = missing_parquet_modules() if args.out.endswith(".parquet") else []
+    if missing:
+        log.error("Parquet output needs %s: pip install %s (or write a .csv)", " and ".join(missing), " ".join(missing))
+        return 1
+
+    cores = os.cpu_count() or 1
+    threads = args.threads or max(1, cores // 2)
+    workers = args.workers if args.workers is not None else max(1, cores - threads)
+
+    scans = collect_scans(args.inputs, args.root)
+    csv_path = partial_csv_path(args.out)
+    if args.no_resume:
+        for path in {csv_path, args.out}:
+            if os.path.exists(path):
+                os.remove(path)
+    done = completed_paths(args.out)
+    todo = [(path, label) for path, label in scans if path not in done]
+    log.info("%d scans found, %d already scored, %d to go (%d preprocess workers, %d inference threads)",
+             len(scans), len(scans) - len(todo), len(todo), workers, threads)
+
+    if todo:
+        import torch
+        from inference_engine import load_network, infer_batch
+        torch.set_num_threads(threads)
+        device = torch.device(args.device if torch.cuda.is_available() else "cpu")
+        model = load_network(args.model, device)
+
+        labels = dict(todo)
+        write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        start = time.time()
+        scored = 0
+        with open(csv_path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            if write_header:
+                writer.writeheader()
+
+            def flush(batch_paths, batch_volumes):
+                probs = infer_batch(model, batch_volumes, device=device)
+                for path, p in zip(batch_paths, probs):
+                    predicted = int(np.argmax(p))
+                    writer.writerow({"path": path, "label": labels.get(path), "prob_neg": float(p[0]),
+                                     "prob_pos": float(p[1]), "predicted_class": predicted,
+                                     "predicted_label": CLASSES[predicted], "status": "ok", "error": ""})
+                f.flush()
+
+            batch_paths, batch_volumes = [], []
+            window = max(args.batch_size * 2, workers * 2)
+            for path, volume, error in preprocessed([p for p, _ in todo], workers, window):
+                scored += 1
+                if error is not None:
+                    log.warning("Failed to preprocess %s: %s", path, error)
+                    writer.writerow({"path": path, "label": labels.get(path), "status": "error", "error": error})
+                    continue
+                batch_paths.append(path)
+                batch_volumes.append(volume)
+                if len(batch_volumes) == args.batch_size:
+                    flush(batch_paths, batch_volumes)
+                    batch_paths, batch_volumes = [], []
+                    elapsed = time.time() - start
+                    log.info("%d/%d scans (%.2f scans/s)", scored, len(todo), scored / max(elapsed, 1e-9))
+            if batch_volumes:
+                flush(batch_paths, batch_volumes)
+        log.info("Scored %d scans in %.1fs", scored, time.time() - start)
+
+    if args.out.endswith(".parquet") and os.path.exists(csv_path):
+        finalize_parquet(args.out)
+    log.info("Results written to %s", args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# architectures.py
+""" Parameters, FLOPs and CPU latency of Network architectures (model/network.py), to pick one that meets
+a latency budget before training it.
+
+    python benchmarks/architectures.py                               # every entry of ARCHITECTURES
+    python benchmarks/architectures.py default separable my_arch.yaml --sla-ms 250 --threads 4
+    python benchmarks/architectures.py --shape 176 192 128 --out archs.json
+
+FLOPs are counted from the shapes each layer actually produces on one scan (a multiply-add is 2 FLOPs;
+pooling counts one operation per window element), so they hold for any input shape. Latency is one scan
+through classify_scans with random weights, median over --repeat runs, on the torch thread count given
+by --threads. With --sla-ms the exit status is 1 when no architecture meets the budget. """
+
+import argparse
+import math
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+for path in (HERE, ROOT, os.path.join(ROOT, "model")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from harness import Results, measure
+
+
+def _conv_flops(conv, output):
+    per_output = conv.in_channels // conv.groups * math.prod(conv.kernel_size)
+    return output.numel() * (2 * per_output + (conv.bias is not None))
+
+
+def _window(size):
+    return math.prod(size) if isinstance(size, tuple) else size ** 3
+
+
+def count_flops(model, input_shape, input_channels=1):
+    """Per-layer parameters and FLOPs of one scan through model.classify_scans. Returns a list of
+    {"layer", "output", "params", "flops"} in execution order."""
+    import torch
+    from torch import nn
+
+    rows = {name: {"layer": name, "output": None, "params": sum(p.numel() for p in getattr(model, name).parameters()),
+                   "flops": 0} for name in model.layer_names}
+
+    def hook(owner):
+        def record(module, inputs, output):
+            if isinstance(output, tuple):  # LSTM: (output, (h, c))
+                output = output[0]
+            flops = 0
+            if isinstance(module, nn.Conv3d):
+                flops = _conv_flops(module, output)
+            elif isinstance(module, (nn.MaxPool3d, nn.AvgPool3d)):
+                flops = output.numel() * _window(module.kernel_size)
+            elif isinstance(module, (nn.AdaptiveAvgPool3d, nn.AdaptiveMaxPool3d)):
+                flops = inputs[0].numel()
+            elif isinstance(module, nn.LSTM):
+                steps = output.shape[0] * output.shape[1]
+                size, hidden = module.input_size, module.hidden_size
+                # Four gates per layer, each an input and a recurrent matrix product, plus the cell update
+                flops = steps * sum(4 * 2 * hidden * ((size if layer == 0 else hidden) + hidden) + 10 * hidden
+                                    for layer in range(module.num_layers))
+            elif isinstance(module, nn.Linear):
+                flops = output.numel() // module.out_features * 2 * module.in_features * module.out_features
+            rows[owner]["flops"] += flops
+            if module is getattr(model, owner):
+                rows[owner]["output"] = tuple(output.shape[1:])
+        return record
+
+    hooks = []
+    for name in model.layer_names:
+        for module in getattr(model, name).modules():
+            hooks.append(module.register_forward_hook(hook(name)))
+    try:
+        with torch.no_grad():
+            model.classify_scans(torch.zeros((1, input_channels) + tuple(input_shape)))
+    finally:
+        for handle in hooks:
+            handle.remove()
+    return list(rows.values())
+
+
+def profile(results, name, architecture, input_shape, repeat=5, batch_size=1, sla_ms=None):
+    """Adds one "architecture" entry: parameters, GFLOPs per scan and latency of `batch_size` scans."""
+    import numpy as np
+    import torch
+    from network import Network
+
+    from fixtures import synthetic_volume
+
+    torch.manual_seed(0)
+    try:
+        model = Network(1, tuple(input_shape), 2, architecture=architecture).eval()
+    except ValueError as e:
+        results.add("architecture", {"architecture": name, "shape": "x".join(map(str, input_shape))}, error=str(e))
+        return None
+    layers = count_flops(model, input_shape)
+    batch = torch.from_numpy(np.stack([synthetic_volume(input_shape, seed) for seed in range(batch_size)]))[:, None]
+    with torch.no_grad():
+        stats = measure(lambda: model.classify_scans(batch), repeat)
+    values = {"parameters": sum(p.numel() for p in model.parameters()),
+              "gflops": sum(row["flops"] for row in layers) / 1e9,
+              "scans_per_s": batch_size / stats["median"]}
+    if sla_ms is not None:
+        values["meets_sla"] = stats["median"] * 1000 <= sla_ms
+    entry = results.add("architecture", {"architecture": name, "shape": "x".join(map(str, input_shape)),
+                                         "batch_size": batch_size, "threads": torch.get_num_threads()},
+                        stats, **values)
+    entry["layers"] = layers
+    return entry
+
+
+def print_layers(entry):
+    print(f"    {'layer':22s} {'output':>22s} {'params':>12s} {'MFLOPs':>12s}")
+    for row in entry["layers"]:
+        output = "x".join(map(str, row["output"])) if row["output"] else "-"
+        print(f"    {row['layer']:22s} {output:>22s} {row['params']:>12,d} {row['flops'] / 1e6:>12.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parameters, FLOPs and CPU latency per Network architecture.")
+    parser.add_argument("architectures", nargs="*",
+                        help="Names in ARCHITECTURES or .json/.yaml spec files (default: every name)")
+    parser.add_argument("--shape", type=int, nargs=3, default=(200, 200, 150), metavar=("D", "H", "W"),
+                        help="Input shape (e.g. a brain crop shape from brain_boxes.py)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Scans per timed forward")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads (default: torch's choice)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sla-ms", type=float, default=None, help="Latency budget for --batch-size scans")
+    parser.add_argument("--layers", action="store_true", default=False, help="Print the per-layer breakdown")
+    parser.add_argument("--out", type=str, default=None, help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    import torch
+    from network import ARCHITECTURES
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = Results()
+    meeting = []
+    for name in args.architectures or list(ARCHITECTURES):
+        entry = profile(results, name, name, args.shape, args.repeat, args.batch_size, args.sla_ms)
+        if entry is None:
+            continue
+        if args.layers:
+            print_layers(entry)
+        if entry.get("meets_sla"):
+            meeting.append((entry["stats"]["median"], name))
+    if args.out:
+        results.write(args.out)
+        print(f"Results written to {args.out}")
+    if args.sla_ms is not None:
+        if not meeting:
+            print(f"No architecture meets {args.sla_ms:.0f} ms.")
+            return 1
+        print(f"Within {args.sla_ms:.0f} ms: " + ", ".join(f"{name} ({median * 1000:.0f} ms)"
+                                                          for median, name in sorted(meeting)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+# cold_start.py
+""" Import-time audit and cold-start budget check for the command-line entry points.
+
+For every entry point it runs `python -X importtime <script> --help` in a fresh interpreter, prints the
+slowest top-level imports, fails if a heavy dependency (torch, nibabel, scikit-image, ...) is imported
+just to print usage, and times `--help` against a budget. With --mri and --model it also times one cold
+predict.py run (interpreter start to printed result, the first-request latency of a one-shot process)
+and prints its stage breakdown.
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --mri data_sample/scan.nii.gz --model alzheimers_model.pth
+
+Exits with status 1 when a budget is exceeded or a forbidden import shows up. """
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from metrics import STAGE_LINE
+
+ENTRY_POINTS = ("predict.py", "batch_predict.py", "bulk_reports.py")
+# Nothing here is needed to print usage
+HEAVY = ("torch", "nibabel", "skimage", "scipy", "matplotlib", "reportlab", "cv2", "pytorch_grad_cam", "pandas")
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)")
+
+
+def run(args):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True)
+    return time.perf_counter() - start, proc
+
+
+def import_times(script):
+    """(cumulative seconds, module) for every top-level import of `script --help`, slowest first,
+    and the set of all modules it imported."""
+    _, proc = run(["-X", "importtime", script, "--help"])
+    if proc.returncode != 0:
+        raise RuntimeError(f"{script} --help failed: {proc.stderr.strip().splitlines()[-1:]}")
+    top, modules = [], set()
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, module = match.groups()
+        modules.add(module)
+        if len(indent) == 1:  # nested imports are indented further
+            top.append((int(cumulative) / 1e6, module))
+    return sorted(top, reverse=True), modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time audit and cold-start budgets.")
+    parser.add_argument("--scripts", nargs="+", default=list(ENTRY_POINTS), help="Entry points to audit")
+    parser.add_argument("--help-budget", type=float, default=0.5, help="Max median seconds for `--help`")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per `--help` timing")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to print per script")
+    parser.add_argument("--mri", type=str, default=None, help="Scan for the first-request timing")
+    parser.add_argument("--model", type=str, default="alzheimers_model.pth", help="Checkpoint for predict.py")
+    parser.add_argument("--first-request-budget", type=float, default=20.0,
+                        help="Max seconds for one cold predict.py run")
+    args = parser.parse_args(argv)
+
+    failures = []
+    for script in args.scripts:
+        try:
+            top, modules = import_times(script)
+        except RuntimeError as e:
+            failures.append(str(e))
+            continue
+        walls = [run([script, "--help"])[0] for _ in range(args.repeat)]
+        median = statistics.median(walls)
+        print(f"\n{script} --help: median {median * 1000:.0f} ms over {len(walls)} runs "
+              f"(budget {args.help_budget * 1000:.0f} ms)")
+        for seconds, module in top[:args.top]:
+            print(f"  {seconds * 1000:8.1f} ms  {module}")
+        heavy = sorted({m.split(".")[0] for m in modules} & set(HEAVY))
+        if heavy:
+            failures.append(f"{script} --help imports {', '.join(heavy)}")
+        if median > args.help_budget:
+            failures.append(f"{script} --help took {median:.3f}s (budget {args.help_budget}s)")
+
+    if args.mri:
+        seconds, proc = run(["predict.py", "--mri", args.mri, "--model", args.model])
+        print(f"\npredict.py first request: {seconds:.2f}s (budget {args.first_request_budget}s)")
+        if proc.returncode != 0:
+            failures.append(f"predict.py failed: {proc.stderr.strip().splitlines()[-1:]}")
+        match = STAGE_LINE.search(proc.stderr)
+        stages = json.loads(match.group(1)) if match else {}
+        for stage, stage_seconds in stages.items():
+            print(f"  {stage:12s} {stage_seconds:.3f}s")
+        # Interpreter start and imports are what the stage timings do not cover
+        if "end_to_end" in stages:
+            print(f"  {'startup':12s} {seconds - stages['end_to_end']:.3f}s")
+        if seconds > args.first_request_budget:
+            failures.append(f"predict.py first request took {seconds:.2f}s (budget {args.first_request_budget}s)")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("\nOK" if not failures else f"\n{len(failures)} budget failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# fixtures.py
+""" Synthetic NIfTI fixtures for the benchmarks, so they run offline and without ADNI data.
+
+Volumes are smooth random blobs (a brain-sized ellipsoid plus noise) generated from a fixed seed, so the
+same name always means the same bytes and timings are comparable across commits. Like most scanner
+output they are stored as int16 with a scale factor, so readers also pay for scaling. Files are written
+once under benchmarks/.fixtures/ and reused. """
+
+import os
+
+import numpy as np
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".fixtures")
+
+# (D, H, W) of the generated scans: smaller and larger than the model's 200x200x150 input, and exactly it
+SIZES = {
+    "small": (96, 96, 72),
+    "adni": (192, 192, 160),
+    "input": (200, 200, 150),
+    "large": (256, 256, 176),
+}
+
+
+def synthetic_volume(shape, seed=0):
+    """A float32 volume with an ellipsoidal "brain" of higher intensity and Gaussian noise."""
+    rng = np.random.default_rng(seed)
+    axes = [np.linspace(-1.0, 1.0, n, dtype=np.float32) for n in shape]
+    d, h, w = np.meshgrid(*axes, indexing="ij", sparse=True)
+    brain = (d / 0.8) ** 2 + (h / 0.9) ** 2 + (w / 0.75) ** 2 <= 1.0
+    volume = np.where(brain, 600.0, 40.0).astype(np.float32)
+    volume += rng.normal(0.0, 25.0, size=shape).astype(np.float32)
+    return volume
+
+
+def nifti(size, compressed=True, seed=0, directory=FIXTURE_DIR):
+    """Path of the fixture scan for `size` (a SIZES name), writing it on first use."""
+    import nibabel as nib
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{size}-{seed}.nii" + (".gz" if compressed else ""))
+    if not os.path.exists(path):
+        image = nib.Nifti1Image(np.round(synthetic_volume(SIZES[size], seed) * 4).astype(np.int16), affine=np.eye(4))
+        image.header.set_slope_inter(0.25, 0.0)
+        tmp = path + ".tmp" + (".nii.gz" if compressed else ".nii")
+        nib.save(image, tmp)
+        os.replace(tmp, path)
+    return path
+
+
+def bgzf_nifti(size, seed=0, directory=FIXTURE_DIR):
+    """The fixture scan for `size`, block-gzipped as recompress_nifti.py writes it."""
+    from inference_engine import bgzf
+    path = os.path.join(directory, f"{size}-{seed}.bgzf.nii.gz")
+    if not os.path.exists(path):
+        with open(nifti(size, compressed=False, seed=seed, directory=directory), "rb") as f:
+            bgzf.write(path, f.read())
+    return path
+
+
+def cohort(patients, scans_per_patient, size="small", directory=FIXTURE_DIR):
+    """MRIData-style entries [scan path..., label] for `patients` synthetic patients, relative to
+    `directory` (the dataset root), alternating labels 0 and 1."""
+    entries = []
+    for patient in range(patients):
+        paths = [os.path.basename(nifti(size, seed=patient * scans_per_patient + scan, directory=directory))
+                 for scan in range(scans_per_patient)]
+        entries.append(paths + [patient % 2])
+    return entries
@@ -0,0 +1,103 @@
+# harness.py
+""" Timing and result files shared by the micro and macro benchmarks.
+
+Every benchmark records one entry: a name, its parameters, and either timing statistics (from `measure`)
+or throughput numbers. A run is written as one JSON file together with the commit and the environment it
+ran in, and two such files can be compared with `compare`. """
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(fn, repeat=5, warmup=1, number=1):
+    """Calls fn() `warmup` times untimed, then `repeat` timed rounds of `number` calls each.
+    Returns per-call seconds: min, median, mean, max and stdev over the rounds."""
+    for _ in range(warmup):
+        fn()
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return {"min": min(rounds), "median": statistics.median(rounds), "mean": statistics.fmean(rounds),
+            "max": max(rounds), "stdev": statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+            "repeat": repeat, "number": number}
+
+
+def environment():
+    """Where the numbers came from: commit, interpreter, library versions and hardware."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    versions = {}
+    for name in ("numpy", "torch", "nibabel", "skimage", "scipy", "reportlab"):
+        module = sys.modules.get(name)
+        if module is not None:
+            versions[name] = getattr(module, "__version__", None)
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor(), "cpu_count": os.cpu_count(), "versions": versions,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+class Results:
+    """Benchmark entries of one run, keyed by name + parameters."""
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, name, params=None, stats=None, **values):
+        entry = {"name": name, "params": params or {}, **({"stats": stats} if stats else {}), **values}
+        self.entries.append(entry)
+        described = ", ".join(f"{k}={v}" for k, v in entry["params"].items())
+        summary = ", ".join(f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}" for k, v in values.items())
+        if stats:
+            summary = f"median {stats['median'] * 1000:.2f} ms (min {stats['min'] * 1000:.2f} ms) " + summary
+        print(f"{name:28s} {described:40s} {summary}", flush=True)
+        return entry
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump({"environment": environment(), "results": self.entries}, f, indent=2)
+
+
+def key(entry):
+    return entry["name"] + json.dumps(entry["params"], sort_keys=True)
+
+
+# Throughput values (higher is better); everything timed through `measure` is lower-is-better
+THROUGHPUT = ("requests_per_s", "scans_per_s", "patients_per_s", "reports_per_s")
+
+
+def compare(baseline_path, current_path, threshold=0.10):
+    """Entries of `current` that are more than `threshold` (relative) slower than in `baseline`.
+    Returns a list of (key, metric, baseline value, current value, relative change)."""
+    with open(baseline_path) as f:
+        baseline = {key(e): e for e in json.load(f)["results"]}
+    with open(current_path) as f:
+        current = json.load(f)["results"]
+    regressions = []
+    for entry in current:
+        old = baseline.get(key(entry))
+        if old is None:
+            continue
+        if "stats" in entry and "stats" in old:
+            before, after = old["stats"]["median"], entry["stats"]["median"]
+            change = (after - before) / before if before else 0.0
+            if change > threshold:
+                regressions.append((key(entry), "median", before, after, change))
+        for metric in THROUGHPUT:
+            if metric in entry and metric in old and old[metric]:
+                change = (old[metric] - entry[metric]) / old[metric]
+                if change > threshold:
+                    regressions.append((key(entry), metric, old[metric], entry[metric], -change))
+    return regressions
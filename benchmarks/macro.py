@@ -0,0 +1,175 @@
+# macro.py
+""" Macro-benchmarks: whole paths through the system.
+
+- mri_data_epoch: one pass of a DataLoader over a synthetic cohort through MRIData (decode + zoom to
+  200x200x150 + padding), cold, with the in-memory cache warm, and from a packed volume store.
+- api_load: a local uvicorn running api_server.py with a random-weight checkpoint, hammered by a
+  thread pool of HTTP clients at several concurrency levels on /health, /predict/tensor and /predict.
+"""
+
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from fixtures import FIXTURE_DIR, cohort, nifti, synthetic_volume
+from harness import ROOT
+
+MACRO = []
+
+
+def benchmark(fn):
+    MACRO.append(fn)
+    return fn
+
+
+# ----------------- TRAINING INPUT -----------------
+def _store(entries, name):
+    """The cohort packed as pack_volumes.py does it, written once under FIXTURE_DIR."""
+    from data_loader import STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3
+    from pack_volumes import load_subjects
+    from volume_store import VolumeStoreWriter
+    path = os.path.join(FIXTURE_DIR, f"{name}.vstore")
+    if not os.path.exists(path):
+        with VolumeStoreWriter(path, (STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3)) as writer:
+            for entry, volumes in zip(entries, load_subjects(entries, FIXTURE_DIR, 1)):
+                writer.add_subject(entry, volumes)
+    return path
+
+
+@benchmark
+def mri_data_epoch(results, quick):
+    from torch.utils.data import DataLoader
+    from data_loader import MRIData
+
+    patients, scans = (4, 2) if quick else (8, 3)
+    entries = cohort(patients, scans)
+    setups = [("cold", 0, False), ("cold", 2, False)] if not quick else [("cold", 0, False)]
+    setups += [("cached", 0, True), ("store", 0, False)]
+    for state, workers, cache in setups:
+        store = _store(entries, f"cohort-{patients}x{scans}") if state == "store" else None
+        dataset = MRIData(FIXTURE_DIR, entries, cache=cache, store=store)
+        loader = DataLoader(dataset, batch_size=1, num_workers=workers)
+        if state == "cached":
+            for _ in loader:  # fills the cache; the timed epoch below reads from it
+                pass
+        start = time.perf_counter()
+        decode = resize = 0.0
+        for batch in loader:
+            decode += float(batch["decode_time"].sum())
+            resize += float(batch["resize_time"].sum())
+        elapsed = time.perf_counter() - start
+        results.add("mri_data_epoch", {"state": state, "num_workers": workers, "patients": patients,
+                                       "scans_per_patient": scans},
+                    seconds=elapsed, patients_per_s=patients / elapsed, scans_per_s=patients * scans / elapsed,
+                    decode_s=decode, resize_s=resize)
+
+
+# ----------------- API UNDER LOAD -----------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(checkpoint, port):
+    env = dict(os.environ, MODELS=f"bench={checkpoint}", MODEL_DEFAULT="bench", WARMUP="0")
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(port),
+                               "--log-level", "warning"], cwd=os.path.join(ROOT, "backend"), env=env)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"api_server exited with status {server.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+            return server
+        except OSError:
+            time.sleep(0.25)
+    server.terminate()
+    raise RuntimeError("api_server did not come up within 120s")
+
+
+def _multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def _load(url, body, headers, concurrency, duration):
+    """`concurrency` client threads sending the same request back to back for `duration` seconds."""
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            request = urllib.request.Request(url, data=body, headers=headers, method="POST" if body else "GET")
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=300) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = "error"
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+@benchmark
+def api_load(results, quick):
+    import numpy as np
+    import torch
+    import uvicorn  # noqa: F401 -- the server runs in a subprocess, but without uvicorn there is nothing to load
+    from inference_engine import INPUT_SHAPE, build_network
+
+    torch.manual_seed(0)
+    checkpoint = os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench_model.pth")
+    torch.save(build_network(INPUT_SHAPE).state_dict(), checkpoint)
+    port = _free_port()
+    server = _start_server(checkpoint, port)
+    try:
+        volume = synthetic_volume(INPUT_SHAPE)
+        volume = (volume - volume.min()) / (volume.max() - volume.min())
+        with open(nifti("input"), "rb") as f:
+            upload = _multipart("file", "scan.nii.gz", f.read())
+        endpoints = {
+            "health": ("/health", None, {}),
+            "predict_tensor": ("/predict/tensor", np.ascontiguousarray(volume, dtype=np.float32).tobytes(),
+                               {"Content-Type": "application/octet-stream",
+                                "X-Tensor-Shape": ",".join(map(str, INPUT_SHAPE))}),
+            "predict": ("/predict",) + upload,
+        }
+        duration = 5.0 if quick else 20.0
+        for endpoint, (path, body, headers) in endpoints.items():
+            for concurrency in ((1, 4) if quick else (1, 4, 16)):
+                latencies, statuses, elapsed = _load(f"http://127.0.0.1:{port}{path}", body, headers,
+                                                     concurrency, duration)
+                latencies.sort()
+                results.add("api_load", {"endpoint": endpoint, "concurrency": concurrency},
+                            requests_per_s=len(latencies) / elapsed,
+                            p50_ms=statistics.median(latencies) * 1000 if latencies else None,
+                            p95_ms=latencies[int(0.95 * (len(latencies) - 1))] * 1000 if latencies else None,
+                            statuses={str(k): v for k, v in statuses.items()})
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
@@ -0,0 +1,180 @@
+# micro.py
+""" Micro-benchmarks: one pipeline step at a time, on synthetic fixtures (see fixtures.py).
+
+Each function takes (results, quick) and adds its entries to `results`; `quick` trims sizes and repeats
+for a smoke run. The model runs with random weights: timings do not depend on what the weights are. """
+
+import datetime
+
+import numpy as np
+
+from fixtures import SIZES, bgzf_nifti, nifti, synthetic_volume
+from harness import measure
+
+MICRO = []
+
+
+def benchmark(fn):
+    MICRO.append(fn)
+    return fn
+
+
+def _sizes(quick):
+    return ["small", "input"] if quick else list(SIZES)
+
+
+def _repeat(quick):
+    return 3 if quick else 7
+
+
+# ----------------- PREPROCESSING -----------------
+def _peak_mb(fn):
+    """Peak bytes numpy allocated while fn() ran (numpy reports its buffers to tracemalloc)."""
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def decode(results, quick):
+    """NIfTI read, gzip-compressed, block-gzipped and uncompressed: the engine's float32 slab reader
+    against nibabel's get_fdata (a cached float64 copy of the whole volume)."""
+    import nibabel as nib
+    from inference_engine.preprocessing import read_volume
+    readers = {"read_volume": read_volume, "get_fdata": lambda path: nib.load(path).get_fdata()}
+    for size in _sizes(quick):
+        paths = {"gzip": nifti(size), "bgzf": bgzf_nifti(size), "raw": nifti(size, compressed=False)}
+        for fmt, path in paths.items():
+            for reader, fn in readers.items():
+                results.add("decode", {"size": size, "format": fmt, "reader": reader},
+                            measure(lambda: fn(path), _repeat(quick)), peak_mb=_peak_mb(lambda: fn(path)))
+
+
+@benchmark
+def normalize(results, quick):
+    from inference_engine import normalize as min_max
+    for size in _sizes(quick):
+        volume = synthetic_volume(SIZES[size])  # float32, as load_volume returns it
+        results.add("normalize", {"size": size}, measure(lambda: min_max(volume), _repeat(quick)))
+
+
+@benchmark
+def resize(results, quick):
+    """Every resampler in the tree: the inference engine's anti-aliased scikit-image resize, MRIData's
+    scipy.ndimage.zoom and the cascade screener's trilinear torch.nn.functional.interpolate."""
+    import torch
+    from scipy import ndimage
+    from inference_engine import INPUT_SHAPE, resize_volume
+    from cascade import downsample
+
+    backends = {
+        "skimage": lambda volume: resize_volume(volume, INPUT_SHAPE),
+        "ndimage_zoom": lambda volume: ndimage.zoom(volume, [t / s for t, s in zip(INPUT_SHAPE, volume.shape)]),
+        "torch_trilinear": lambda volume: downsample(torch.from_numpy(volume)[None, None], INPUT_SHAPE),
+    }
+    for size in _sizes(quick):
+        if SIZES[size] == tuple(INPUT_SHAPE):
+            continue  # nothing to resample
+        volume = synthetic_volume(SIZES[size])
+        for backend, fn in backends.items():
+            results.add("resize", {"size": size, "backend": backend},
+                        measure(lambda: fn(volume), 3 if quick else 5))
+
+
+# ----------------- MODEL -----------------
+def _networks(count, shape):
+    import torch
+    from inference_engine import build_network
+    torch.manual_seed(0)
+    return [build_network(shape).eval() for _ in range(count)]
+
+
+def _model_shape(quick):
+    from cascade import SCREENER_SHAPE
+    from inference_engine import INPUT_SHAPE
+    return SCREENER_SHAPE if quick else INPUT_SHAPE
+
+
+@benchmark
+def forward(results, quick):
+    """Network.classify_scans (independent scans) per batch size."""
+    import torch
+    shape = _model_shape(quick)
+    model, = _networks(1, shape)
+    for batch_size in ((1, 2) if quick else (1, 2, 4, 8)):
+        batch = torch.from_numpy(np.stack([synthetic_volume(shape, seed) for seed in range(batch_size)]))[:, None]
+        with torch.no_grad():
+            stats = measure(lambda: model.classify_scans(batch), 3 if quick else 5)
+        results.add("forward", {"batch_size": batch_size, "shape": "x".join(map(str, shape))}, stats,
+                    scans_per_s=batch_size / stats["median"])
+
+
+@benchmark
+def brain_crop(results, quick):
+    """Finding the brain box of a 200x200x150 scan, and one forward over the full input against one over
+    its canonical crop (the network rebuilt for the smaller shape)."""
+    import torch
+    from inference_engine import INPUT_SHAPE
+    from inference_engine.brain_box import brain_box, crop_shape_for, crop_to_box
+    volume = synthetic_volume(INPUT_SHAPE)
+    results.add("brain_box", {"size": "input"}, measure(lambda: brain_box(volume), _repeat(quick)))
+    box = brain_box(volume)
+    for name, shape in (("full", INPUT_SHAPE), ("crop", crop_shape_for([box], INPUT_SHAPE))):
+        model, = _networks(1, shape)
+        batch = torch.from_numpy(np.ascontiguousarray(crop_to_box(volume, box, shape)))[None, None]
+        with torch.no_grad():
+            stats = measure(lambda: model.classify_scans(batch), 3 if quick else 5)
+        results.add("forward_crop", {"input": name, "shape": "x".join(map(str, shape))}, stats,
+                    scans_per_s=1.0 / stats["median"])
+
+
+@benchmark
+def architectures(results, quick):
+    """Every entry of model/network.py's ARCHITECTURES: parameters, GFLOPs and one-scan latency."""
+    from architectures import profile
+    from network import ARCHITECTURES
+    for name, architecture in ARCHITECTURES.items():
+        profile(results, name, architecture, _model_shape(quick), 3 if quick else 5)
+
+
+@benchmark
+def predict_with_models(results, quick):
+    """predict_utils.predict_with_models (ensemble averaging) with N models, one scan."""
+    import torch
+    from predict_utils import predict_with_models as ensemble
+    shape = _model_shape(quick)
+    scan = torch.from_numpy(synthetic_volume(shape))[None, None]
+    for count in ((1, 2) if quick else (1, 2, 4)):
+        models = _networks(count, shape)
+        results.add("predict_with_models", {"models": count, "shape": "x".join(map(str, shape))},
+                    measure(lambda: ensemble(models, scan), 3 if quick else 5))
+
+
+# ----------------- CALIBRATION -----------------
+@benchmark
+def find_temperature(results, quick):
+    from predict_utils import find_temperature as fit
+    rng = np.random.default_rng(0)
+    for n in ((1000,) if quick else (1000, 10000, 100000)):
+        labels = rng.integers(0, 2, size=n)
+        # Overconfident logits: the right class gets a large margin most of the time
+        logits = rng.normal(0.0, 1.0, size=(n, 2))
+        logits[np.arange(n), labels] += rng.normal(3.0, 2.0, size=n)
+        results.add("find_temperature", {"n": n}, measure(lambda: fit(logits, labels), _repeat(quick)))
+
+
+# ----------------- REPORTS -----------------
+@benchmark
+def pdf_build(results, quick):
+    from reports import render_report
+    patient = {"name": "Benchmark Patient", "id": "BENCH-0001", "age": 71, "contact": "N/A",
+               "date": datetime.date(2024, 1, 1), "notes": "Synthetic"}
+    cases = {"confident": ("No Alzheimer's", (0.96, 0.04), "96%"), "inconclusive": ("Inconclusive", None, None)}
+    for case, (label, probs, conf) in cases.items():
+        stats = measure(lambda: render_report(patient, "scan.nii.gz", "alzheimers_model.pth", label, probs, conf,
+                                              generated="2024-01-01 00:00:00"), _repeat(quick), number=5)
+        results.add("pdf_build", {"case": case}, stats, reports_per_s=1.0 / stats["median"])
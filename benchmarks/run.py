@@ -0,0 +1,79 @@
+# run.py
+""" Runs the benchmark suite and writes the results as JSON, or compares two result files.
+
+    python benchmarks/run.py                         # micro + macro, results to benchmarks/results/<commit>.json
+    python benchmarks/run.py micro --quick           # smoke run with small sizes
+    python benchmarks/run.py micro -k "decode|resize" --out decode.json
+    python benchmarks/run.py compare base.json new.json --threshold 0.1
+
+Everything runs offline on synthetic fixtures (benchmarks/fixtures.py) and random-weight models.
+`compare` lists every entry more than --threshold slower (or lower in throughput) than in the baseline
+and exits with status 1 if there is any, so it can gate a commit. Cold start lives in cold_start.py. """
+
+import argparse
+import os
+import re
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+for path in (HERE, ROOT, os.path.join(ROOT, "model")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from harness import Results, compare, environment
+
+RESULTS_DIR = os.path.join(HERE, "results")
+
+
+def run(suites, quick, pattern):
+    from micro import MICRO
+    from macro import MACRO
+    benchmarks = {"micro": MICRO, "macro": MACRO}
+    results = Results()
+    for suite in suites:
+        for fn in benchmarks[suite]:
+            if pattern and not re.search(pattern, fn.__name__):
+                continue
+            try:
+                fn(results, quick)
+            except ImportError as e:
+                # e.g. no uvicorn for api_load: skip that benchmark, keep the rest of the run
+                print(f"{fn.__name__:28s} skipped: {e}", flush=True)
+                results.add(fn.__name__, skipped=str(e))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark suite for the MRI pipeline.")
+    parser.add_argument("suite", nargs="?", default="all", choices=["all", "micro", "macro", "compare"])
+    parser.add_argument("files", nargs="*", help="compare: baseline.json current.json")
+    parser.add_argument("--quick", action="store_true", default=False, help="Small sizes and few repeats")
+    parser.add_argument("-k", dest="pattern", type=str, default=None, help="Only benchmarks matching this regex")
+    parser.add_argument("--out", type=str, default=None,
+                        help="Result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="compare: relative slowdown to report")
+    args = parser.parse_args(argv)
+
+    if args.suite == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs a baseline and a current result file")
+        regressions = compare(*args.files, threshold=args.threshold)
+        for name, metric, before, after, change in regressions:
+            print(f"{name}: {metric} {before:.4g} -> {after:.4g} ({change:+.0%})")
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    suites = ["micro", "macro"] if args.suite == "all" else [args.suite]
+    results = run(suites, args.quick, args.pattern)
+    out = args.out
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{environment()['commit'] or 'unknown'}{'-quick' if args.quick else ''}.json")
+    results.write(out)
+    print(f"Results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# brain_boxes.py
+""" Precomputes the brain bounding box of every scan in a training manifest (inference_engine/brain_box.py)
+and the canonical crop shape that holds them all, into one JSON file that MRIData crops with.
+
+    python brain_boxes.py Data/Combined_MRI_List.pkl --out Data/brain_boxes.json
+    python evaluate.py --boxes Data/brain_boxes.json      # Network rebuilt for the crop shape
+
+Boxes are found on the 200x200x150 volumes MRIData produces, read from a volume store (--store, see
+pack_volumes.py) or decoded and resized from the NIfTI files on --workers processes. --crop-shape fixes
+the canonical shape instead of deriving it; boxes larger than it lose their edges when cropped. """
+
+import argparse
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+
+from log_utils import configure_logging, get_logger
+
+log = get_logger("brain_boxes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute brain bounding boxes and a crop shape for a manifest.")
+    parser.add_argument("manifest", type=str, help="Combined_MRI_List.pkl-style manifest")
+    parser.add_argument("--out", type=str, required=True, help="Box file to write (.json)")
+    parser.add_argument("--root", type=str, default="./", help="MRIData root_dir the scan paths are relative to")
+    parser.add_argument("--store", type=str, default=None, help="Read the scans from this volume store")
+    parser.add_argument("--crop-shape", type=int, nargs=3, default=None, metavar=("D", "H", "W"),
+                        help="Canonical crop shape (default: the smallest one holding every box)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes decoding and resizing scans (without --store)")
+    parser.add_argument("--log-level", type=str, default=None)
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    import numpy as np
+    from data_loader import STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3
+    from inference_engine.brain_box import brain_box, crop_shape_for, save_boxes
+    from pack_volumes import load_subjects, scan_paths
+    from volume_store import VolumeStore
+
+    with open(args.manifest, "rb") as f:
+        entries = pickle.load(f)
+    if not entries:
+        log.error("No subjects in %s", args.manifest)
+        return 1
+    shape = (STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3)
+
+    if args.store:
+        store = VolumeStore(args.store)
+        subjects = ({path: store.read(path) for path in scan_paths(entry)} for entry in entries)
+    else:
+        subjects = load_subjects(entries, args.root, args.workers)
+
+    start = time.time()
+    boxes = {}
+    for count, volumes in enumerate(subjects, 1):
+        for path, volume in volumes.items():
+            boxes[path] = brain_box(volume)
+        if count % 50 == 0:
+            log.info("%d/%d subjects, %d scans (%.1f scans/s)", count, len(entries), len(boxes),
+                     len(boxes) / max(time.time() - start, 1e-9))
+    if not boxes:
+        log.error("No scans in %s", args.manifest)
+        return 1
+
+    crop_shape = tuple(args.crop_shape) if args.crop_shape else crop_shape_for(boxes.values(), shape)
+    extents = np.array([np.subtract(hi, lo) for lo, hi in boxes.values()])
+    clipped = int(np.sum(np.any(extents > np.array(crop_shape), axis=1)))
+    save_boxes(args.out, boxes, shape, crop_shape)
+    log.info("Boxes of %d scans written to %s in %.1fs; median box %s, largest %s", len(boxes), args.out,
+             time.time() - start, tuple(int(v) for v in np.median(extents, axis=0)),
+             tuple(int(v) for v in extents.max(axis=0)))
+    log.info("Crop shape %s: %.0f%% of the %s input voxels%s", crop_shape,
+             100 * np.prod(crop_shape) / np.prod(shape), shape,
+             f"; {clipped} boxes are larger and lose their edges" if clipped else "")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# bulk_reports.py
+""" Renders a PDF report for every subject of a scored cohort, without Streamlit. Reads a results table
+(batch_predict.py's output, or any .csv/.parquet with a subject id and probabilities) and optional patient
+metadata, renders the reports in worker processes (see reports.render_many) and streams them into a
+directory or a .zip. A restarted run skips every report already in the output. A .zip is committed every
+--commit-every reports, each commit copying the archive; for very long runs a directory output, where
+every report is final as soon as it is written, avoids that cost.
+
+    python bulk_reports.py cohort.csv --patients patients.csv --out reports/
+    python bulk_reports.py cohort.parquet --out reports.zip --workers 16
+
+Results columns: `subject_id` (or --id-column; without one, the scan file name is used), `prob_pos`
+(`prob_neg` defaults to 1 - prob_pos), and optionally `path`, `decision` (ALZHEIMER_PRESENT /
+ALZHEIMER_NOT_PRESENT / UNCERTAIN, overriding the triple-zone band) and `status` (rows other than "ok"
+are skipped). Patient columns: `id` plus any of name, age, contact, date and notes.
+"""
+
+import argparse
+import csv
+import datetime
+import hashlib
+import os
+import re
+import shutil
+import sys
+import time
+import zipfile
+
+from log_utils import configure_logging, get_logger
+
+PATIENT_FIELDS = ("name", "age", "contact", "date")
+NIFTI_SUFFIXES = (".nii.gz", ".nii")
+
+log = get_logger("bulk_reports")
+
+
+# ----------------- INPUTS -----------------
+def read_table(path):
+    """Rows of a .csv or .parquet file as dicts."""
+    if path.endswith(".parquet"):
+        import pandas as pd
+        frame = pd.read_parquet(path)
+        return frame.where(frame.notna(), None).to_dict("records")
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def subject_of(row, id_column):
+    if row.get(id_column):
+        return str(row[id_column])
+    name = os.path.basename(str(row.get("path") or ""))
+    for suffix in NIFTI_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def report_filename(subject):
+    # Subject ids become file names: keep them to one safe path component. A changed id gets a short hash of
+    # the original, so ids that sanitize alike ("A/1", "A 1") still get reports of their own
+    safe = re.sub(r'[^A-Za-z0-9._-]+', '_', subject)
+    if safe != subject:
+        safe += "_" + hashlib.sha1(subject.encode("utf-8")).hexdigest()[:8]
+    return f"Alzheimers_Report_{safe}.pdf"
+
+
+def build_reports(results, patients, id_column, model_name, generated):
+    """(file name, render_report kwargs) per scored subject, in table order. A subject listed more than
+    once keeps its last row."""
+    from reports import headline
+    reports = {}
+    for row in results:
+        if row.get("status", "ok") not in ("ok", None, ""):
+            continue
+        subject = subject_of(row, id_column)
+        if not subject or row.get("prob_pos") in (None, ""):
+            continue
+        prob_pos = float(row["prob_pos"])
+        prob_neg = float(row["prob_neg"]) if row.get("prob_neg") not in (None, "") else 1.0 - prob_pos
+        label, conf_text = headline(prob_pos, decision=row.get("decision") or None)
+        patient = patients.get(subject, {})
+        patient_info = {"id": subject, "notes": patient.get("notes") or ""}
+        for field in PATIENT_FIELDS:
+            patient_info[field] = patient.get(field) or "N/A"
+        reports[report_filename(subject)] = {
+            "patient_info": patient_info,
+            "mri_filename": os.path.basename(str(row.get("path") or "")) or "N/A",
+            "model_name": model_name,
+            "predicted_label": label,
+            # Inconclusive reports hide the numbers, as in app.py
+            "probs": None if conf_text is None else (prob_neg, prob_pos),
+            "conf_text": conf_text,
+            "generated": generated,
+        }
+    return list(reports.items())
+
+
+# ----------------- OUTPUTS -----------------
+class DirectorySink:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def existing(self):
+        return {name for name in os.listdir(self.path) if name.endswith(".pdf")}
+
+    def write(self, name, pdf):
+        # Written under a temporary name first, so an interrupted run never leaves a truncated report behind
+        tmp = os.path.join(self.path, name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(pdf)
+        os.replace(tmp, os.path.join(self.path, name))
+
+    def close(self):
+        pass
+
+
+class ZipSink:
+    """Appends to a copy of an existing archive and moves it over the original every `commit_every` reports
+    and on close, so the archive under `path` is always complete. close() also runs when a run fails or is
+    interrupted with Ctrl-C; a killed process leaves the archive of the last commit, and only the reports
+    written since are rendered again. PDFs are already compressed, so entries are stored."""
+
+    def __init__(self, path, commit_every=None):
+        self.path = path
+        self.commit_every = commit_every
+        self._tmp = path + ".tmp"
+        self._pending = 0
+        self._open()
+
+    def _open(self):
+        mode = "w"
+        if os.path.exists(self.path):
+            try:
+                zipfile.ZipFile(self.path).close()
+                shutil.copyfile(self.path, self._tmp)
+                mode = "a"
+            except zipfile.BadZipFile:
+                log.warning("%s is not a readable zip; starting it over", self.path)
+        self.archive = zipfile.ZipFile(self._tmp, mode, compression=zipfile.ZIP_STORED)
+
+    def existing(self):
+        return set(self.archive.namelist())
+
+    def write(self, name, pdf):
+        self.archive.writestr(name, pdf)
+        self._pending += 1
+        if self.commit_every and self._pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        """Moves the reports written so far into the archive under `path` and carries on in a new copy."""
+        self.close()
+        self._open()
+
+    def close(self):
+        self.archive.close()
+        os.replace(self._tmp, self.path)
+        self._pending = 0
+
+
+def open_sink(out, commit_every=None):
+    return ZipSink(out, commit_every) if out.endswith(".zip") else DirectorySink(out)
+
+
+# ----------------- MAIN -----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render PDF reports for a scored cohort.")
+    parser.add_argument("results", type=str, help="Results table (.csv or .parquet), e.g. from batch_predict.py")
+    parser.add_argument("--patients", type=str, default=None,
+                        help="Patient metadata (.csv or .parquet) with an `id` column")
+    parser.add_argument("--out", type=str, default="reports", help="Output directory, or a .zip file")
+    parser.add_argument("--id-column", type=str, default="subject_id", help="Subject id column of the results")
+    parser.add_argument("--model-name", type=str, default="alzheimers_model.pth", help="Model named in the reports")
+    parser.add_argument("--workers", type=int, default=None, help="Rendering processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=32, help="Reports sent to a worker at a time")
+    parser.add_argument("--commit-every", type=int, default=500,
+                        help="Reports between commits of a .zip output, i.e. the most a killed run loses "
+                             "(0: only at the end)")
+    parser.add_argument("--skip-inconclusive", action="store_true", default=False,
+                        help="Only render reports with a confident decision")
+    parser.add_argument("--no-resume", action="store_true", default=False,
+                        help="Re-render reports already in the output")
+    parser.add_argument("--log-level", type=str, default=None)
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    # reportlab is imported with reports.py, after the arguments are valid
+    from reports import render_many
+
+    patients = {}
+    if args.patients:
+        patients = {str(row["id"]): row for row in read_table(args.patients)}
+    # One "Generated" timestamp for the whole run
+    generated = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    reports = build_reports(read_table(args.results), patients, args.id_column, args.model_name, generated)
+    if args.skip_inconclusive:
+        reports = [(name, report) for name, report in reports if report["conf_text"] is not None]
+
+    if args.no_resume and os.path.exists(args.out) and args.out.endswith(".zip"):
+        os.remove(args.out)
+    sink = open_sink(args.out, args.commit_every)
+    try:
+        done = set() if args.no_resume else sink.existing()
+        todo = [(name, report) for name, report in reports if name not in done]
+        log.info("%d reports, %d already rendered, %d to go", len(reports), len(reports) - len(todo), len(todo))
+
+        start = time.time()
+        rendered = 0
+        for index, pdf in render_many((report for _, report in todo), args.workers, args.chunk_size):
+            sink.write(todo[index][0], pdf)
+            rendered += 1
+            if rendered % 500 == 0:
+                elapsed = time.time() - start
+                log.info("%d/%d reports (%.1f reports/s)", rendered, len(todo), rendered / max(elapsed, 1e-9))
+        log.info("Rendered %d reports in %.1fs", rendered, time.time() - start)
+    finally:
+        sink.close()
+    log.info("Reports written to %s", args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
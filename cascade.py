@@ -0,0 +1,112 @@
+# cascade.py
+""" Two-stage (early-exit) inference: a small screener Network scores a downsampled copy of every scan,
+and the full 200x200x150 Network only runs when the screener's probability falls inside the uncertain
+band. With the default band this is the UNCERTAIN zone of inference_engine.decide; app.py's
+triple-zone thresholds are available as APP_TRIPLE_ZONE_BAND.
+
+The screener is trained by distillation from the full model with train_screener.py. """
+
+import logging
+
+import torch
+import torch.nn.functional as F
+
+from inference_engine import INPUT_SHAPE, DECISION_THRESHOLD, TRIPLE_ZONE_BAND
+
+log = logging.getLogger(__name__)
+
+FULL_SHAPE = INPUT_SHAPE
+# Smallest convenient shape this architecture accepts (three kernel-4 convolutions and two 4x pools
+# need at least ~79 voxels per axis). It is ~5.6x fewer voxels than the full input.
+SCREENER_SHAPE = (100, 100, 80)
+
+# inference_engine.decide's default threshold: UNCERTAIN is (1 - 0.92, 0.92)
+DEFAULT_DECISION_THRESHOLD = DECISION_THRESHOLD
+# app.py's triple-zone display
+APP_TRIPLE_ZONE_BAND = TRIPLE_ZONE_BAND
+
+
+def band_from_decision_threshold(decision_threshold=DEFAULT_DECISION_THRESHOLD):
+    """The (low, high) probability band that decide reports as UNCERTAIN."""
+    return 1.0 - decision_threshold, decision_threshold
+
+
+def build_screener(input_channels=1, output_size=2, input_shape=SCREENER_SHAPE):
+    from inference_engine import build_network
+    return build_network(input_shape, input_channels, output_size)
+
+
+def downsample(mri_tensor, shape=SCREENER_SHAPE):
+    """Trilinear resize of a (N, C, D, H, W) batch to `shape`."""
+    if tuple(mri_tensor.shape[-3:]) == tuple(shape):
+        return mri_tensor
+    return F.interpolate(mri_tensor, size=tuple(shape), mode="trilinear", align_corners=False)
+
+
+def positive_probabilities(model, mri_tensor):
+    """P(Alzheimer's) for each scan of a (N, C, D, H, W) batch, scored independently."""
+    logits = model.classify_scans(mri_tensor)
+    return torch.softmax(logits.float(), dim=-1)[:, 1]
+
+
+class ScreenerCascade:
+    """ Early-exit wrapper around a screener and the full model. Specify:
+        + screener, a Network built for `screener_shape`
+        + full_model, a Network or a zero-argument callable returning one. A callable is only invoked the
+          first time a scan lands in the uncertain band, so clearly-decided batches never load the full model.
+        + band, (low, high) screener probabilities between which the full model is consulted"""
+
+    def __init__(self, screener, full_model, band=None, screener_shape=SCREENER_SHAPE, device="cpu"):
+        self.screener = screener.to(device).eval()
+        self._full_model = full_model
+        self.band = tuple(band) if band is not None else band_from_decision_threshold()
+        self.screener_shape = tuple(screener_shape)
+        self.device = torch.device(device)
+        self.scans = 0
+        self.short_circuited = 0
+
+    @property
+    def full_model(self):
+        if callable(self._full_model) and not isinstance(self._full_model, torch.nn.Module):
+            log.info("Loading full model for uncertain scans")
+            self._full_model = self._full_model()
+        return self._full_model.to(self.device).eval()
+
+    def is_uncertain(self, prob_pos):
+        low, high = self.band
+        return low < prob_pos < high
+
+    @torch.no_grad()
+    def predict(self, mri_tensor):
+        """mri_tensor: preprocessed scans (N, 1, 200, 200, 150). Returns one dict per scan with the final
+        `probs` [neg, pos], `stage` ("screener" or "full") and the screener's own `screener_prob`."""
+        mri_tensor = mri_tensor.to(self.device)
+        screener_probs = positive_probabilities(self.screener, downsample(mri_tensor, self.screener_shape))
+        results = []
+        uncertain = []
+        for i, prob in enumerate(screener_probs.tolist()):
+            if self.is_uncertain(prob):
+                uncertain.append(i)
+                results.append(None)
+            else:
+                results.append({"probs": [1.0 - prob, prob], "stage": "screener", "screener_prob": prob})
+
+        if uncertain:
+            full_probs = positive_probabilities(self.full_model, mri_tensor[uncertain])
+            for i, prob in zip(uncertain, full_probs.tolist()):
+                results[i] = {"probs": [1.0 - prob, prob], "stage": "full",
+                              "screener_prob": float(screener_probs[i])}
+
+        self.scans += len(results)
+        self.short_circuited += len(results) - len(uncertain)
+        return results
+
+    @property
+    def short_circuit_fraction(self):
+        return self.short_circuited / self.scans if self.scans else 0.0
+
+
+def load_network(checkpoint_path, input_shape, device="cpu"):
+    """Kept for train_screener.py's argument order; see inference_engine.load_network."""
+    from inference_engine import load_network
+    return load_network(checkpoint_path, device, input_shape)
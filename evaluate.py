@@ -8,6 +8,7 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torch.utils.data import DataLoader
 from torch.utils.data.sampler import SubsetRandomSampler
+from torch.utils.data.distributed import DistributedSampler
 
 # To unpack ADNI data
 import pickle
@@ -17,22 +18,61 @@ import random
 import sys
 sys.path.insert(1, './model')
 from network import Network
-from data_loader import MRIData
+from data_loader import MRIData, save_split, split_path
+from inference_engine.brain_box import load_boxes
+from distributed import (init_distributed, cleanup_distributed, is_main_process, broadcast_parameters,
+                         average_gradients, all_reduce_sum, shard_indices)
+from profiler import TrainingProfiler
+from log_utils import configure_logging, get_logger, MetricCounters
 import argparse
 
 
 parser = argparse.ArgumentParser(description='Train and validate network.')
 parser.add_argument('--disable-cuda', action='store_true', default=False,
                     help='Disable CUDA')
+parser.add_argument('--distributed', action='store_true', default=False,
+                    help='Data-parallel training over the gloo backend. Launch with '
+                         '`torchrun --standalone --nproc_per_node=N evaluate.py --distributed`.')
+parser.add_argument('--seed', type=int, default=1,
+                    help='Seed for the train/test split. Must match on every rank in distributed mode.')
+parser.add_argument('--profile', action='store_true', default=False,
+                    help='Record per-stage timings and print a profile table after every epoch.')
+parser.add_argument('--profile-log', type=str, default='training_profile.jsonl',
+                    help='JSONL file the per-step profile records are appended to (with --profile).')
+parser.add_argument('--tensorboard-dir', type=str, default=None,
+                    help='Also write the profile to TensorBoard in this directory (with --profile).')
+parser.add_argument('--architecture', type=str, default=None,
+                    help='Network architecture: a name in model/network.py\'s ARCHITECTURES or a .json/.yaml '
+                         'spec (default: the original network). benchmarks/architectures.py compares them.')
+parser.add_argument('--boxes', type=str, default=None,
+                    help='Brain box file written by brain_boxes.py: scans are cropped to its crop shape and '
+                         'the Network is built for that shape.')
+parser.add_argument('--store', type=str, default=None,
+                    help='Volume store written by pack_volumes.py; scans are read from it instead of '
+                         'decoded from NIfTI files.')
+parser.add_argument('--log-level', type=str, default=None,
+                    help='DEBUG, INFO, WARNING or ERROR (default: $AD_LOG_LEVEL or INFO). '
+                         'Per-patient predictions are only logged at DEBUG.')
 args = parser.parse_args()
 args.device = None
-print(args.disable_cuda)
-if torch.cuda.is_available():
-    print("Using CUDA. : )")
+
+configure_logging(args.log_level)
+log = get_logger("evaluate")
+# Per-patient numbers are aggregated here and logged every 30 seconds.
+metrics = MetricCounters(log, flush_interval=30.0)
+log.debug("disable_cuda=%s", args.disable_cuda)
+args.rank, args.world_size = 0, 1
+if args.distributed:
+    # gloo all-reduces CPU tensors; every rank trains on its own share of the cores.
+    args.rank, args.world_size = init_distributed("gloo")
+    args.device = torch.device('cpu')
+    log.info("Distributed training: rank %d of %d, %d threads.", args.rank, args.world_size, torch.get_num_threads())
+elif torch.cuda.is_available():
+    log.info("Using CUDA. : )")
     # torch.set_default_tensor_type('torch.cuda.FloatTensor')
     args.device = torch.device('cuda')
 else:
-    print("We aren't using CUDA.")
+    log.info("We aren't using CUDA.")
     args.device = torch.device('cpu')
 
 # For reproducibility for testing purposes. Delete during actual training.
@@ -55,11 +95,21 @@ learning_rate = 0.1
 training_epochs = 5
 # The size of images passed, as a tuple
 data_shape = (200,200,150)
+boxes = None
+if args.boxes:
+    # Train on brain crops: a smaller input, so proportionally fewer convolution FLOPs
+    boxes = load_boxes(args.boxes)
+    data_shape = boxes['crop_shape']
+    log.info("Cropping scans to %s around the brain (predict.py --crop-shape %s).", data_shape,
+             ' '.join(map(str, data_shape)))
 # Other hyperparameters unlisted: the depth of the model, the kernel size, the padding, the channel restriction.
 
 
 ## Import Data
 MRI_images_list = pickle.load(open("./Data/Combined_MRI_List.pkl", "rb"))
+if args.distributed:
+    # Every rank has to agree on the split, so the shuffle is seeded identically.
+    random.seed(args.seed)
 random.shuffle(MRI_images_list)
 
 train_size = int(0.7 * len(MRI_images_list))
@@ -69,23 +119,44 @@ training_list = MRI_images_list[:train_size]
 test_list =  MRI_images_list[train_size:]
 
 DATA_ROOT_DIR = './'
-train_dataset = MRIData(DATA_ROOT_DIR, training_list)
-test_dataset = MRIData(DATA_ROOT_DIR, test_list)
-
-train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=True)
+train_dataset = MRIData(DATA_ROOT_DIR, training_list, store=args.store, boxes=boxes)
+test_dataset = MRIData(DATA_ROOT_DIR, test_list, store=args.store, boxes=boxes)
+
+if args.distributed:
+    # Shard patients across ranks. The training sampler pads so every rank sees the same number of batches,
+    # which keeps the per-step gradient all-reduce in lockstep. Testing has no per-step collective, so its
+    # shards are not padded and no patient is counted twice in the all-reduced test loss.
+    train_sampler = DistributedSampler(train_dataset, num_replicas=args.world_size, rank=args.rank,
+                                       shuffle=True, seed=args.seed)
+    test_sampler = shard_indices(len(test_dataset), args.rank, args.world_size)
+    train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, sampler=train_sampler)
+    test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, sampler=test_sampler)
+else:
+    train_sampler = None
+    train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
+    test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=True)
 
 training_data = train_loader
 test_data = test_loader
 
 
 ## Define Model
-model = Network(input_size, data_shape, output_dimension).to(args.device)
+model = Network(input_size, data_shape, output_dimension, architecture=args.architecture).to(args.device)
+# Start every replica from rank 0's initial weights.
+broadcast_parameters(model)
 
 loss_function = nn.CrossEntropyLoss()
 
 optimizer = optim.SGD(model.parameters(), lr=learning_rate)
 
+## Profiling
+profile_log = args.profile_log
+if args.distributed:
+    profile_log = f"{profile_log}.rank{args.rank}"
+profiler = TrainingProfiler(profile_log, device=args.device, tensorboard_dir=args.tensorboard_dir,
+                            enabled=args.profile)
+profiler.attach(model)
+
 
 ## Training Function
 def train(model,training_data,optimizer,criterion):
@@ -95,11 +166,10 @@ def train(model,training_data,optimizer,criterion):
     # Initialize the per epoch loss
     epoch_loss = 0
     epoch_length = len(training_data)
-    for i, patient_data in enumerate(training_data):
-        if i % (math.floor(epoch_length / 5) + 1) == 0: print(f"\t\tTraining Progress:{i / len(training_data) * 100}%")
+    for i, patient_data in enumerate(profiler.iter_loader(training_data)):
+        if i % (math.floor(epoch_length / 5) + 1) == 0: log.info("Training Progress: %.1f%%", i / len(training_data) * 100)
         # Clear gradients
         model.zero_grad()
-        torch.cuda.empty_cache() # Clear CUDA memory
         batch_loss=torch.tensor(0.0).to(args.device)
 
         # Clear the LSTM hidden state after each patient
@@ -107,10 +177,11 @@ def train(model,training_data,optimizer,criterion):
 
         # Get the MRI's and classifications for the current patient
         patient_markers = patient_data['num_images']
-        patient_MRIs = patient_data["images"].to(args.device)
+        with profiler.stage("host_to_device"):
+            patient_MRIs = patient_data["images"].to(args.device)
 
         patient_classifications = patient_data["label"]
-        print("Patient batch classes ", patient_classifications)
+        log.debug("Patient batch classes %s", patient_classifications)
 
         for x in range(len(patient_MRIs)):
             try:
@@ -122,26 +193,41 @@ def train(model,training_data,optimizer,criterion):
                 patient_endstate = torch.ones(single_patient_MRIs.size(0)) * patient_diagnosis
                 patient_endstate = patient_endstate.long().to(args.device)
 
-                out = model(single_patient_MRIs)
+                with profiler.stage("forward"):
+                    out = model(single_patient_MRIs)
 
                 if len(out.shape)==1:
                     out = out[None,...] # In the case of a single input, we need padding
 
-                print("model predictions are ",out)
-                print("patient endstate is ",patient_endstate)
+                log.debug("model predictions are %s", out)
+                log.debug("patient endstate is %s", patient_endstate)
                 model_predictions = out
 
-                loss = criterion(model_predictions, patient_endstate)
+                with profiler.stage("loss"):
+                    loss = criterion(model_predictions, patient_endstate)
                 batch_loss += loss
+                metrics.add("train/patients")
 
             except Exception as e:
-                print("EXCEPTION CAUGHT:",e)
-
-        batch_loss.backward()
-        print("batch loss is",batch_loss)
-        optimizer.step()
+                metrics.add("train/exceptions")
+                log.warning("Exception caught while training on a patient: %s", e)
+
+        with profiler.stage("backward"):
+            if batch_loss.requires_grad:
+                batch_loss.backward()
+        # Average gradients over all ranks before stepping (no-op outside distributed mode).
+        with profiler.stage("gradient_sync"):
+            average_gradients(model)
+        metrics.add("train/batch_loss", batch_loss)
+        with profiler.stage("optimizer_step"):
+            optimizer.step()
         epoch_loss += batch_loss
+        profiler.end_step(int(patient_markers.sum()), patient_data)
+        metrics.maybe_flush()
 
+    metrics.flush()
+    if args.distributed:
+        epoch_loss, epoch_length = all_reduce_sum(epoch_loss, epoch_length)
     if epoch_length == 0: epoch_length = 0.000001
     return epoch_loss / epoch_length
 
@@ -152,20 +238,20 @@ def test(model, test_data, criterion):
     model.eval()
     epoch_loss = torch.tensor(0.0)
     epoch_length = len(test_data)
-    for i, patient_data in enumerate(test_data):
-        if i % (math.floor(epoch_length / 5) + 1) == 0: print(f"\t\tTesting Progress:{i / len(test_data) * 100}%")
+    for i, patient_data in enumerate(profiler.iter_loader(test_data)):
+        if i % (math.floor(epoch_length / 5) + 1) == 0: log.info("Testing Progress: %.1f%%", i / len(test_data) * 100)
         # Clear gradients
         model.zero_grad()
-        torch.cuda.empty_cache() # Clear CUDA memory
 
         # Clear the LSTM hidden state after each patient
         model.hidden = model.init_hidden()
         # Get the MRI's and classifications for the current patient
         patient_markers = patient_data['num_images']
-        patient_MRIs = patient_data["images"].to(args.device)
+        with profiler.stage("host_to_device"):
+            patient_MRIs = patient_data["images"].to(args.device)
 
         patient_classifications = patient_data["label"]
-        print("Patient batch classes ", patient_classifications)
+        log.debug("Patient batch classes %s", patient_classifications)
         for x in range(len(patient_MRIs)):
             try:
                 # Clear hidden states to give each patient a clean slate
@@ -177,20 +263,30 @@ def test(model, test_data, criterion):
                 patient_endstate = torch.ones(single_patient_MRIs.size(0)) * patient_diagnosis
                 patient_endstate = patient_endstate.long().to(args.device)
 
-                out = model(single_patient_MRIs)
+                with profiler.stage("forward"):
+                    out = model(single_patient_MRIs)
 
                 if len(out.shape)==1:
                     out = out[None,...] # In the case of a single input, we need padding
 
                 model_predictions = out
 
-                loss = criterion(model_predictions, patient_endstate)
+                with profiler.stage("loss"):
+                    loss = criterion(model_predictions, patient_endstate)
                 epoch_loss += loss
-                print("Current test loss ",loss)
+                # summed on the device by MetricCounters and read back once per flush, not once per patient
+                metrics.add("test/loss", loss)
             except Exception as e:
                 epoch_length -= 1
-                print("EXCEPTION CAUGHT:", e)
+                metrics.add("test/exceptions")
+                log.warning("Exception caught while testing on a patient: %s", e)
+        profiler.end_step(int(patient_markers.sum()), patient_data)
+        metrics.maybe_flush()
+
+    metrics.flush()
 
+    if args.distributed:
+        epoch_loss, epoch_length = all_reduce_sum(epoch_loss, epoch_length)
     if epoch_length == 0: epoch_length = 0.000001
     return epoch_loss / epoch_length
 
@@ -202,21 +298,37 @@ best_test_accuracy = float('inf')
 for epoch in range(training_epochs):
 
     start_time = time.time()
+    if train_sampler is not None:
+        train_sampler.set_epoch(epoch)
 
+    profiler.start_epoch(epoch + 1, "train")
     train_loss = train(model, training_data, optimizer, loss_function)
+    profiler.end_epoch()
+    profiler.start_epoch(epoch + 1, "test")
     test_loss = test(model, test_data, loss_function)
+    profiler.end_epoch()
 
     end_time = time.time()
 
     epoch_mins = math.floor((end_time-start_time)/60)
     epoch_secs = math.floor((end_time-start_time)%60)
 
-    print(f"Hurrah! Epoch {epoch + 1}/{training_epochs} concludes. | Time: {epoch_mins}m {epoch_secs}s")
-    print(f"\tTrain Loss: {train_loss:.3f}| Train Perplexity: {math.exp(train_loss):7.3f}")
-    print(f"\tTest Loss: {test_loss:.3f}| Test Perplexity: {math.exp(test_loss):7.3f}")
+    # Losses are already reduced across ranks, so only rank 0 reports and checkpoints.
+    if not is_main_process():
+        continue
+
+    log.info("Hurrah! Epoch %d/%d concludes. | Time: %dm %ds", epoch + 1, training_epochs, epoch_mins, epoch_secs)
+    log.info("Train Loss: %.3f | Train Perplexity: %7.3f", train_loss, math.exp(train_loss))
+    log.info("Test Loss: %.3f | Test Perplexity: %7.3f", test_loss, math.exp(test_loss))
 
 
     if test_loss<best_test_accuracy:
-        print("...that was our best test accuracy yet!")
+        log.info("...that was our best test accuracy yet!")
         best_test_accuracy=test_loss
         torch.save(model.state_dict(),'ad-model.pt')
+        # train_screener.py tests the cascade on the same held-out patients
+        save_split(split_path('ad-model.pt'), training_list, test_list, args.seed if args.distributed else None)
+
+profiler.close()
+cleanup_distributed()
+
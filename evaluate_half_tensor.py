@@ -1,4 +1,10 @@
-""" Unified home for training and evaluation. Imports model and dataloader. """
+""" Half-precision (AMP) training and evaluation. Imports model and dataloader.
+
+The data path stays in fp16 from the dataset (and its optional cache, --cache) to the device, forward
+and backward run under autocast (fp16 on CUDA, bf16 on CPU) and the optimizer updates the fp32 master
+weights held by the model. `--precision fp32` runs the same loop in plain fp32, and `--compare` runs
+both and prints epoch time and peak memory side by side. Intensities beyond the fp16 range are clamped
+to it rather than becoming inf. """
 
 import time
 import math
@@ -10,39 +16,137 @@ import pickle
 import random
 import argparse
 import sys
+import os
+import json
+import resource
+import subprocess
+import tempfile
 
 # Import network and data loader
 sys.path.insert(1, './model')
 from network import Network
-from data_loader import MRIData
+from data_loader import MRIData, save_split, split_path
+from inference_engine.brain_box import load_boxes
+from log_utils import configure_logging, get_logger, MetricCounters
 
 # ----------------- ARGUMENT PARSING -----------------
 parser = argparse.ArgumentParser(description='Train and validate network.')
 parser.add_argument('--disable-cuda', action='store_true', default=False,
                     help='Disable CUDA')
+parser.add_argument('--precision', choices=['amp', 'fp32'], default='amp',
+                    help='amp: fp16 data path with autocast (bf16 on CPU). fp32: full precision baseline.')
+parser.add_argument('--epochs', type=int, default=5, help='Number of training epochs')
+parser.add_argument('--compare', action='store_true', default=False,
+                    help='Run --epochs with both precisions in separate processes and compare them.')
+parser.add_argument('--summary-json', type=str, default=None,
+                    help='Write per-epoch time and peak memory to this JSON file.')
+parser.add_argument('--no-save', action='store_true', default=False,
+                    help='Do not write model checkpoints (used by --compare).')
+parser.add_argument('--architecture', type=str, default=None,
+                    help='Network architecture: a name in model/network.py\'s ARCHITECTURES or a .json/.yaml '
+                         'spec (default: the original network). benchmarks/architectures.py compares them.')
+parser.add_argument('--boxes', type=str, default=None,
+                    help='Brain box file written by brain_boxes.py: scans are cropped to its crop shape and '
+                         'the Network is built for that shape.')
+parser.add_argument('--store', type=str, default=None,
+                    help='Volume store written by pack_volumes.py; scans are read from it instead of '
+                         'decoded from NIfTI files.')
+parser.add_argument('--cache', type=int, default=0, metavar='PATIENTS',
+                    help='Keep up to this many patients\' scans in memory, in the data dtype, so later epochs '
+                         'skip decoding them (0: no cache, -1: the whole cohort).')
+parser.add_argument('--log-level', type=str, default=None,
+                    help='DEBUG, INFO, WARNING or ERROR (default: $AD_LOG_LEVEL or INFO).')
 args = parser.parse_args()
 args.device = None
 
-print(args.disable_cuda)
+configure_logging(args.log_level)
+log = get_logger("evaluate_half_tensor")
+metrics = MetricCounters(log, flush_interval=30.0)
+
+
+# ----------------- PRECISION COMPARISON -----------------
+def run_comparison():
+    """Runs each precision in its own process so that peak memory is measured independently."""
+    results = {}
+    for precision in ('fp32', 'amp'):
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+            summary_path = tmp.name
+        cmd = [sys.executable, os.path.abspath(__file__), '--precision', precision,
+               '--epochs', str(args.epochs), '--summary-json', summary_path, '--no-save']
+        if args.disable_cuda:
+            cmd.append('--disable-cuda')
+        if args.store:
+            cmd += ['--store', args.store]
+        if args.boxes:
+            cmd += ['--boxes', args.boxes]
+        if args.architecture:
+            cmd += ['--architecture', args.architecture]
+        if args.log_level:
+            cmd += ['--log-level', args.log_level]
+        if args.cache:
+            cmd += ['--cache', str(args.cache)]
+        log.info("Running %s trainer: %s", precision, ' '.join(cmd))
+        subprocess.run(cmd, check=True)
+        with open(summary_path) as f:
+            results[precision] = json.load(f)
+        os.remove(summary_path)
+
+    print("\nPrecision comparison (mean over epochs)")
+    print(f"{'precision':<10}{'epoch time (s)':>16}{'peak memory (MB)':>18}{'final test loss':>17}")
+    if any(e.get('peak_memory_scope') == 'process' for summary in results.values() for e in summary['epochs']):
+        print("(peak memory is the process high-water mark: it could not be reset per epoch here)")
+    for precision, summary in results.items():
+        epochs = summary['epochs']
+        mean_time = sum(e['epoch_seconds'] for e in epochs) / max(1, len(epochs))
+        peak = max((e['peak_memory_mb'] for e in epochs), default=0.0)
+        final_loss = epochs[-1]['test_loss'] if epochs else float('nan')
+        print(f"{precision:<10}{mean_time:>16.1f}{peak:>18.1f}{final_loss:>17.3f}")
+    if results['fp32']['epochs'] and results['amp']['epochs']:
+        fp32_time = sum(e['epoch_seconds'] for e in results['fp32']['epochs'])
+        amp_time = sum(e['epoch_seconds'] for e in results['amp']['epochs'])
+        print(f"AMP speed-up: {fp32_time / max(amp_time, 1e-9):.2f}x")
+
+
+if args.compare:
+    run_comparison()
+    sys.exit(0)
+
+log.debug("disable_cuda=%s", args.disable_cuda)
 if torch.cuda.is_available() and not args.disable_cuda:
-    print("Using CUDA. : )")
+    log.info("Using CUDA. : )")
     args.device = torch.device('cuda')
 else:
-    print("We aren't using CUDA.")
+    log.info("We aren't using CUDA.")
     args.device = torch.device('cpu')
 
 # Set random seeds for reproducibility
 torch.manual_seed(1)
 random.seed(1)
 
+# ----------------- PRECISION -----------------
+use_amp = args.precision == 'amp'
+# CUDA autocasts to fp16 and needs loss scaling to keep small gradients from underflowing.
+# CPU autocasts to bf16, which has the fp32 exponent range, so no scaling is applied there.
+amp_dtype = torch.float16 if args.device.type == 'cuda' else torch.bfloat16
+data_dtype = torch.float16 if use_amp else torch.float32
+scaler = torch.cuda.amp.GradScaler(enabled=use_amp and args.device.type == 'cuda')
+log.info("Precision: %s (data %s, autocast %s)", args.precision, data_dtype, amp_dtype if use_amp else 'off')
+
 # ----------------- HYPERPARAMETERS -----------------
 BATCH_SIZE = 10
 LSTM_output_size = 16
 input_size = 1
 output_dimension = 2
 learning_rate = 0.1
-training_epochs = 5
+training_epochs = args.epochs
 data_shape = (200, 200, 150)
+boxes = None
+if args.boxes:
+    # Train on brain crops: a smaller input, so proportionally fewer convolution FLOPs
+    boxes = load_boxes(args.boxes)
+    data_shape = boxes['crop_shape']
+    log.info("Cropping scans to %s around the brain (predict.py --crop-shape %s).", data_shape,
+             ' '.join(map(str, data_shape)))
 
 # ----------------- LOAD DATA -----------------
 MRI_images_list = pickle.load(open("./Data/Combined_MRI_List.pkl", "rb"))
@@ -53,17 +157,29 @@ training_list = MRI_images_list[:train_size]
 test_list = MRI_images_list[train_size:]
 
 DATA_ROOT_DIR = './'
-train_dataset = MRIData(DATA_ROOT_DIR, training_list)
-test_dataset = MRIData(DATA_ROOT_DIR, test_list)
+# With --cache, scans are cached in the data dtype, so after the first epoch the loader hands cached
+# patients out as fp16 tensors straight from memory (half the footprint of an fp32 cache). The limit is
+# shared between the two splits in proportion to their size.
+if args.cache < 0:
+    train_cache = test_cache = True
+else:
+    train_cache = int(args.cache * len(training_list) / max(1, len(MRI_images_list)))
+    test_cache = args.cache - train_cache
+train_dataset = MRIData(DATA_ROOT_DIR, training_list, dtype=data_dtype, cache=train_cache, store=args.store,
+                        boxes=boxes)
+test_dataset = MRIData(DATA_ROOT_DIR, test_list, dtype=data_dtype, cache=test_cache, store=args.store, boxes=boxes)
 
-train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=True)
+pin_memory = args.device.type == 'cuda'
+train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True, pin_memory=pin_memory)
+test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=True, pin_memory=pin_memory)
 
 training_data = train_loader
 test_data = test_loader
 
 # ----------------- MODEL, LOSS, OPTIMIZER -----------------
-model = Network(input_size, data_shape, output_dimension).to(args.device)
+# The model parameters stay in fp32 and act as the master copy; autocast only lowers the
+# precision of the activations and of the per-op weight casts.
+model = Network(input_size, data_shape, output_dimension, architecture=args.architecture).to(args.device)
 loss_function = nn.CrossEntropyLoss()
 optimizer = optim.SGD(model.parameters(), lr=learning_rate)
 
@@ -75,20 +191,19 @@ def train(model, training_data, optimizer, criterion):
 
     for i, patient_data in enumerate(training_data):
         if i % (max(1, math.floor(epoch_length / 5))) == 0:
-            print(f"\t\tTraining Progress:{i / len(training_data) * 100:.1f}%")
+            log.info("Training Progress: %.1f%%", i / len(training_data) * 100)
 
         optimizer.zero_grad()
-        torch.cuda.empty_cache()
 
-        # Keep as float32 to avoid type mismatch
-        patient_MRIs = patient_data["images"].to(args.device, dtype=torch.float32)
+        # fp16 in AMP mode; autocast casts the inputs for each op as needed.
+        patient_MRIs = patient_data["images"].to(args.device, dtype=data_dtype, non_blocking=True)
         patient_classifications = patient_data["label"]
         patient_markers = patient_data['num_images']
 
         model.hidden = model.init_hidden()
         batch_losses = []
 
-        print("Patient batch classes ", patient_classifications)
+        log.debug("Patient batch classes %s", patient_classifications)
 
         for x in range(len(patient_MRIs)):
             try:
@@ -101,22 +216,31 @@ def train(model, training_data, optimizer, criterion):
                 patient_endstate = torch.ones(single_patient_MRIs.size(0)) * patient_diagnosis
                 patient_endstate = patient_endstate.long().to(args.device)
 
-                out = model(single_patient_MRIs)
-                if len(out.shape) == 1:
-                    out = out[None, ...]
+                with torch.autocast(device_type=args.device.type, dtype=amp_dtype, enabled=use_amp):
+                    out = model(single_patient_MRIs)
+                    if len(out.shape) == 1:
+                        out = out[None, ...]
 
-                loss = criterion(out, patient_endstate)
+                    loss = criterion(out.float(), patient_endstate)
                 batch_losses.append(loss)
+                metrics.add("train/patients")
 
             except Exception as e:
-                print("EXCEPTION CAUGHT:", e)
+                metrics.add("train/exceptions")
+                log.warning("Exception caught while training on a patient: %s", e)
 
         if batch_losses:  # If we collected any loss
             batch_loss = torch.stack(batch_losses).mean()
-            batch_loss.backward()
-            optimizer.step()
-            epoch_loss += batch_loss.item()
-
+            # The scaler is a pass-through when disabled (CPU or fp32)
+            scaler.scale(batch_loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            batch_loss_value = batch_loss.item()
+            epoch_loss += batch_loss_value
+            metrics.add("train/batch_loss", batch_loss_value)
+        metrics.maybe_flush()
+
+    metrics.flush()
     if epoch_length == 0:
         epoch_length = 1e-6
     return epoch_loss / epoch_length
@@ -130,16 +254,16 @@ def test(model, test_data, criterion):
     with torch.no_grad():
         for i, patient_data in enumerate(test_data):
             if i % (max(1, math.floor(epoch_length / 5))) == 0:
-                print(f"\t\tTesting Progress:{i / len(test_data) * 100:.1f}%")
+                log.info("Testing Progress: %.1f%%", i / len(test_data) * 100)
 
-            patient_MRIs = patient_data["images"].to(args.device, dtype=torch.float32)
+            patient_MRIs = patient_data["images"].to(args.device, dtype=data_dtype, non_blocking=True)
             patient_classifications = patient_data["label"]
             patient_markers = patient_data['num_images']
 
             model.hidden = model.init_hidden()
             batch_losses = []
 
-            print("Patient batch classes ", patient_classifications)
+            log.debug("Patient batch classes %s", patient_classifications)
 
             for x in range(len(patient_MRIs)):
                 try:
@@ -152,51 +276,108 @@ def test(model, test_data, criterion):
                     patient_endstate = torch.ones(single_patient_MRIs.size(0)) * patient_diagnosis
                     patient_endstate = patient_endstate.long().to(args.device)
 
-                    out = model(single_patient_MRIs)
-                    if len(out.shape) == 1:
-                        out = out[None, ...]
+                    with torch.autocast(device_type=args.device.type, dtype=amp_dtype, enabled=use_amp):
+                        out = model(single_patient_MRIs)
+                        if len(out.shape) == 1:
+                            out = out[None, ...]
 
-                    loss = criterion(out, patient_endstate)
+                        loss = criterion(out.float(), patient_endstate)
                     batch_losses.append(loss)
 
                 except Exception as e:
                     epoch_length -= 1
-                    print("EXCEPTION CAUGHT:", e)
+                    metrics.add("test/exceptions")
+                    log.warning("Exception caught while testing on a patient: %s", e)
 
             if batch_losses:
-                epoch_loss += torch.stack(batch_losses).mean().item()
+                batch_loss = torch.stack(batch_losses).mean().item()
+                epoch_loss += batch_loss
+                metrics.add("test/batch_loss", batch_loss)
+            metrics.maybe_flush()
+
+    metrics.flush()
 
     if epoch_length == 0:
         epoch_length = 1e-6
     return epoch_loss / epoch_length
 
-import os
+# ----------------- MEMORY -----------------
+def reset_peak_memory():
+    """Starts a new peak measurement. Returns its scope: "epoch" when the peak was reset, "process" when
+    only the lifetime high-water mark of the process is available."""
+    if args.device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(args.device)
+        return 'epoch'
+    try:
+        # Linux: writing 5 resets the peak resident set size (VmHWM) to the current one
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return 'epoch'
+    except OSError:
+        return 'process'
+
+
+def peak_memory_mb():
+    """Peak device memory on CUDA, otherwise the peak resident set size of this process since
+    reset_peak_memory (or over its lifetime, where that cannot be reset)."""
+    if args.device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(args.device) / 2 ** 20
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
 
 # ----------------- TRAINING LOOP -----------------
 best_test_loss = float('inf')
+epoch_summaries = []
 
 for epoch in range(training_epochs):
+    memory_scope = reset_peak_memory()
     start_time = time.time()
 
     train_loss = train(model, training_data, optimizer, loss_function)
     test_loss = test(model, test_data, loss_function)
 
     end_time = time.time()
+    epoch_summaries.append({
+        'epoch': epoch + 1,
+        'epoch_seconds': end_time - start_time,
+        'peak_memory_mb': peak_memory_mb(),
+        'peak_memory_scope': memory_scope,
+        'train_loss': train_loss,
+        'test_loss': test_loss,
+    })
     epoch_mins = math.floor((end_time - start_time) / 60)
     epoch_secs = math.floor((end_time - start_time) % 60)
 
-    print(f"Hurrah! Epoch {epoch + 1}/{training_epochs} concludes. | Time: {epoch_mins}m {epoch_secs}s")
-    print(f"\tTrain Loss: {train_loss:.3f} | Train Perplexity: {math.exp(train_loss):7.3f}")
-    print(f"\tTest Loss: {test_loss:.3f} | Test Perplexity: {math.exp(test_loss):7.3f}")
+    log.info("Hurrah! Epoch %d/%d concludes. | Time: %dm %ds", epoch + 1, training_epochs, epoch_mins, epoch_secs)
+    log.info("Train Loss: %.3f | Train Perplexity: %7.3f", train_loss, math.exp(train_loss))
+    log.info("Test Loss: %.3f | Test Perplexity: %7.3f", test_loss, math.exp(test_loss))
+    log.info("Peak memory (%s): %.1f MB%s", args.precision, epoch_summaries[-1]['peak_memory_mb'],
+             "" if memory_scope == 'epoch' else " (process high-water mark, not this epoch's)")
 
-    if test_loss < best_test_loss:
-        print("...that was our best test loss yet! Saving model.")
+    if test_loss < best_test_loss and not args.no_save:
+        log.info("...that was our best test loss yet! Saving model.")
         best_test_loss = test_loss
         save_path = os.path.join(os.getcwd(), "alzheimers_model.pth")
         torch.save(model.state_dict(), save_path)
-        print(f"✅ Best model saved at: {save_path}")
+        # train_screener.py tests the cascade on the same held-out patients
+        save_split(split_path(save_path), training_list, test_list, seed=1)
+        log.info("✅ Best model saved at: %s", save_path)
 
 # Final save after training
-final_save_path = os.path.join(os.getcwd(), "alzheimers_model.pth")
-torch.save(model.state_dict(), final_save_path)
-print(f"✅ Final model saved at: {final_save_path}")
+if not args.no_save:
+    final_save_path = os.path.join(os.getcwd(), "alzheimers_model.pth")
+    torch.save(model.state_dict(), final_save_path)
+    save_split(split_path(final_save_path), training_list, test_list, seed=1)
+    log.info("✅ Final model saved at: %s", final_save_path)
+
+if args.summary_json:
+    with open(args.summary_json, 'w') as f:
+        json.dump({'precision': args.precision, 'device': str(args.device), 'epochs': epoch_summaries}, f, indent=2)
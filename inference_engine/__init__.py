@@ -0,0 +1,32 @@
+# inference_engine
+""" The one place where a scan becomes a prediction: preprocessing, model construction, batched
+inference and the decision rule, shared by predict.py, app.py, batch_predict.py, cascade.py and the API.
+
+    from inference_engine import preprocess_file, load_network, infer_batch, decide
+
+    model = load_network("alzheimers_model.pth")
+    probs = infer_batch(model, [preprocess_file("scan.nii.gz")])
+    label, reason = decide(float(probs[0, 1]))
+
+Preprocessing and decisions need no torch and are imported eagerly (worker processes use them);
+the torch-backed parts load on first use. """
+
+import importlib
+
+from .preprocessing import (INPUT_SHAPE, MAX_NUM_IMAGES, NORMALIZE_EPS, load_volume, normalize, resize_volume, crop,
+                            preprocess, preprocess_file, preprocess_file_timed)
+from .decision import (CLASSES, PRESENT, NOT_PRESENT, UNCERTAIN, DECISION_THRESHOLD, TRIPLE_ZONE_BAND, softmax,
+                       apply_temperature, binary_decision, decide_band, decide)
+
+_LAZY = {
+    "Backend": "backends", "BACKENDS": "backends", "register_backend": "backends", "get_backend": "backends",
+    "build_network": "backends",
+    "BufferPool": "engine", "buffers": "engine", "input_batch": "engine", "load_network": "engine",
+    "infer_batch": "engine", "Engine": "engine",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(importlib.import_module(f".{_LAZY[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
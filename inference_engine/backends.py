@@ -0,0 +1,90 @@
+# backends.py
+""" Pluggable model backends. A backend knows how to load a checkpoint and how to turn a preprocessed
+(N, 1, D, H, W) float32 batch into (N, C) logits; everything around it (preprocessing, input buffers,
+softmax, decisions) is shared. New execution strategies (quantized, compiled, exported) register here:
+
+    @register_backend("my-backend")
+    class MyBackend(Backend):
+        def load(self, checkpoint, device="cpu", input_shape=INPUT_SHAPE, **options): ...
+        def logits(self, model, batch, mode="independent"): ...
+"""
+
+import torch
+
+from model.network import Network
+from .preprocessing import INPUT_SHAPE
+
+BACKENDS = {}
+
+
+def register_backend(name):
+    def register(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return register
+
+
+def get_backend(name="torch"):
+    if isinstance(name, Backend):
+        return name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r} (available: {', '.join(sorted(BACKENDS))})")
+    return BACKENDS[name]()
+
+
+def build_network(input_shape=INPUT_SHAPE, input_channels=1, output_size=2, architecture=None):
+    """A Network for `input_shape`; `architecture` is anything model.network.load_architecture takes."""
+    return Network(input_channels, tuple(input_shape), output_size, architecture=architecture)
+
+
+class Backend:
+    name = None
+
+    def load(self, checkpoint, device="cpu", input_shape=INPUT_SHAPE, **options):
+        raise NotImplementedError
+
+    def logits(self, model, batch, mode="independent"):
+        """mode="independent": each scan on its own; mode="sequence": the batch is one patient's ordered
+        scans through the LSTM, row i having seen scans 0..i."""
+        raise NotImplementedError
+
+
+@register_backend("torch")
+class TorchBackend(Backend):
+    """Eager fp32 Network from a state_dict checkpoint. Options: architecture (for checkpoints of a
+    non-default architecture)."""
+
+    def load(self, checkpoint, device="cpu", input_shape=INPUT_SHAPE, architecture=None, **options):
+        model = build_network(input_shape, architecture=architecture)
+        model.load_state_dict(torch.load(checkpoint, map_location=device))
+        return model.to(device).eval()
+
+    def logits(self, model, batch, mode="independent"):
+        if mode == "sequence":
+            logits = model(batch)
+            return logits[None, ...] if logits.dim() == 1 else logits
+        return model.classify_scans(batch)
+
+
+@register_backend("cascade")
+class CascadeBackend(Backend):
+    """Screener / full-model early exit (see cascade.py). Options: screener (checkpoint path), band,
+    architecture (of the full model)."""
+
+    def load(self, checkpoint, device="cpu", input_shape=INPUT_SHAPE, screener=None, band=None, architecture=None,
+             **options):
+        from cascade import ScreenerCascade, SCREENER_SHAPE
+        if screener is None:
+            raise ValueError("The cascade backend needs a screener checkpoint")
+        torch_backend = TorchBackend()
+        return ScreenerCascade(torch_backend.load(screener, device, SCREENER_SHAPE),
+                               lambda: torch_backend.load(checkpoint, device, input_shape, architecture),
+                               band=band, device=device)
+
+    def logits(self, model, batch, mode="independent"):
+        if mode != "independent":
+            raise ValueError("The cascade backend scores scans independently only")
+        probs = torch.tensor([r["probs"] for r in model.predict(batch)], dtype=torch.float32)
+        # log-probabilities are valid logits: softmax gives the cascade's probabilities back
+        return torch.log(probs.clamp_min(1e-12))
@@ -0,0 +1,146 @@
+# bgzf.py
+""" Block-gzipped (BGZF) files: gzip made of independent members of at most 64 KB uncompressed each, every
+member recording its own compressed size in a "BC" extra field (the format of samtools' bgzip). Any gzip
+reader can still read them, but because block boundaries are known up front, the blocks can be inflated
+on several threads at once (zlib releases the GIL). recompress_nifti.py rewrites an archive this way.
+
+Configuration (environment):
+    DECOMPRESS_THREADS   threads per decompression (default: all cores, split evenly between the workers of
+                         a process pool that called share_cores, or of a DataLoader)
+"""
+
+import os
+import sys
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Uncompressed bytes per block, as bgzip uses: the compressed block must fit in 64 KB even when incompressible
+BLOCK_SIZE = 0xff00
+# Blocks inflated per thread task, so task overhead stays small next to the work
+BLOCKS_PER_TASK = 16
+# The empty block bgzip ends every file with
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+_HEADER = struct.Struct("<4BIBBH")  # ID1 ID2 CM FLG MTIME XFL OS XLEN
+# Processes reading at the same time on this machine, set in pool workers by share_cores
+_sharing = 1
+
+
+def share_cores(processes):
+    """Process pool initializer (initializer=share_cores, initargs=(workers,)): every worker inflates on its
+    share of the cores, instead of each starting one thread per core."""
+    global _sharing
+    _sharing = max(1, int(processes))
+
+
+def threads():
+    if os.environ.get("DECOMPRESS_THREADS"):
+        return int(os.environ["DECOMPRESS_THREADS"])
+    sharing = _sharing
+    # DataLoader workers are found without importing torch
+    torch_data = sys.modules.get("torch.utils.data")
+    info = torch_data.get_worker_info() if torch_data is not None else None
+    if info is not None:
+        sharing = max(sharing, info.num_workers)
+    return max(1, (os.cpu_count() or 1) // sharing)
+
+
+def _block_size(data, pos):
+    """Total size of the BGZF block at `pos`, or None when it is not one."""
+    if len(data) - pos < _HEADER.size:
+        return None
+    id1, id2, cm, flg, _, _, _, xlen = _HEADER.unpack_from(data, pos)
+    if (id1, id2, cm, flg) != (31, 139, 8, 4):
+        return None
+    extra = pos + _HEADER.size
+    end = extra + xlen
+    while extra + 4 <= end:
+        si1, si2, slen = data[extra], data[extra + 1], struct.unpack_from("<H", data, extra + 2)[0]
+        if (si1, si2, slen) == (66, 67, 2):  # "BC"
+            return struct.unpack_from("<H", data, extra + 4)[0] + 1
+        extra += 4 + slen
+    return None
+
+
+def is_bgzf(path):
+    with open(path, "rb") as f:
+        head = f.read(64)
+    return _block_size(head, 0) is not None
+
+
+def blocks(data):
+    """(compressed data start, end, uncompressed size, crc32) per block of a BGZF buffer."""
+    found = []
+    pos = 0
+    while pos < len(data):
+        size = _block_size(data, pos)
+        if size is None:
+            raise ValueError(f"Not a BGZF block at offset {pos}")
+        xlen = struct.unpack_from("<H", data, pos + 10)[0]
+        crc, isize = struct.unpack_from("<II", data, pos + size - 8)
+        found.append((pos + _HEADER.size + xlen, pos + size - 8, isize, crc))
+        pos += size
+    return found
+
+
+def decompress(path, n_threads=None):
+    """The uncompressed contents of a BGZF file as a bytearray, inflated on `n_threads` threads."""
+    with open(path, "rb") as f:
+        data = f.read()
+    index = blocks(data)
+    out = bytearray(sum(isize for _, _, isize, _ in index))
+    view, source = memoryview(out), memoryview(data)
+    offsets = []
+    offset = 0
+    for _, _, isize, _ in index:
+        offsets.append(offset)
+        offset += isize
+
+    def inflate(first):
+        for i in range(first, min(first + BLOCKS_PER_TASK, len(index))):
+            start, end, isize, crc = index[i]
+            chunk = zlib.decompress(source[start:end], -15, max(isize, 1))
+            if len(chunk) != isize or zlib.crc32(chunk) != crc:
+                raise ValueError(f"{path}: corrupt BGZF block {i}")
+            view[offsets[i]:offsets[i] + isize] = chunk
+
+    n_threads = n_threads or threads()
+    tasks = range(0, len(index), BLOCKS_PER_TASK)
+    if n_threads <= 1 or len(tasks) <= 1:
+        for first in tasks:
+            inflate(first)
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            list(pool.map(inflate, tasks))
+    return out
+
+
+def _block(chunk, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(chunk) + compressor.flush()
+    # BSIZE: total block size - 1 (header, the 6-byte BC field, deflate data, CRC32 and ISIZE)
+    bsize = _HEADER.size + 6 + len(cdata) + 8 - 1
+    header = _HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6) + b"BC" + struct.pack("<HH", 2, bsize)
+    return header + cdata + struct.pack("<II", zlib.crc32(chunk), len(chunk))
+
+
+def compress(data, level=6, n_threads=None):
+    """Yields the BGZF blocks of `data` in order (the EOF block last), deflated on `n_threads` threads."""
+    view = memoryview(data)
+    chunks = (view[i:i + BLOCK_SIZE] for i in range(0, len(view), BLOCK_SIZE))
+    n_threads = n_threads or threads()
+    if n_threads <= 1:
+        for chunk in chunks:
+            yield _block(chunk, level)
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            yield from pool.map(lambda chunk: _block(chunk, level), chunks)
+    yield EOF_BLOCK
+
+
+def write(path, data, level=6, n_threads=None):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for block in compress(data, level, n_threads):
+            f.write(block)
+    os.replace(tmp, path)
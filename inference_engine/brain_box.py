@@ -0,0 +1,86 @@
+# brain_box.py
+""" Brain bounding boxes, for cropping the background out of a volume before the network sees it.
+
+Most of a 200x200x150 input is air around the head, and every convolution runs over it. A box is found
+once per scan (intensity threshold, morphological opening, largest connected component) and the scan is
+then cut to a fixed canonical shape centred on it, so a network built for that smaller shape does
+proportionally less work. brain_boxes.py computes the boxes of a training manifest into one JSON file
+(together with the canonical shape that holds them all) which MRIData reads; inference computes the box
+on the fly (see preprocess's crop_shape).
+
+Boxes are ((d0, h0, w0), (d1, h1, w1)), half-open, in the coordinates of the resized volume. Only numpy
+and scipy.ndimage are needed (scipy is imported on first use). """
+
+import json
+import os
+
+import numpy as np
+
+# Fraction of the robust intensity range (1st to 99.5th percentile) above which a voxel counts as brain
+BRAIN_THRESHOLD = 0.1
+# Voxels added on every side of the detected brain
+BOX_MARGIN = 4
+# Boxes are found on the volume subsampled by this factor along every axis (the morphology is the slow part)
+BOX_STRIDE = 2
+# Canonical crop shapes are rounded up to a multiple of this
+SHAPE_MULTIPLE = 8
+
+
+def brain_box(volume, threshold=BRAIN_THRESHOLD, margin=BOX_MARGIN, stride=BOX_STRIDE):
+    """Bounding box of the largest bright connected component of `volume`, grown by `margin` voxels.
+    A volume with nothing above the threshold gets the full volume as its box."""
+    from scipy import ndimage
+
+    shape = volume.shape
+    coarse = np.asarray(volume[::stride, ::stride, ::stride], dtype=np.float32)
+    low, high = np.percentile(coarse, (1.0, 99.5))
+    mask = ndimage.binary_opening(coarse > low + threshold * (high - low), iterations=1)
+    labels, count = ndimage.label(mask)
+    if count == 0:
+        return (0, 0, 0), tuple(shape)
+    largest = int(np.argmax(np.bincount(labels.ravel())[1:])) + 1
+    found = ndimage.find_objects(labels, max_label=largest)[-1]
+    lo = tuple(max(0, s.start * stride - margin) for s in found)
+    hi = tuple(min(n, s.stop * stride + margin) for s, n in zip(found, shape))
+    return lo, hi
+
+
+def crop_shape_for(boxes, full_shape, multiple=SHAPE_MULTIPLE):
+    """The smallest shape, rounded up to `multiple` and at most `full_shape`, that holds every box."""
+    extents = np.max([np.subtract(hi, lo) for lo, hi in boxes], axis=0)
+    return tuple(int(min(n, -(-e // multiple) * multiple)) for e, n in zip(extents, full_shape))
+
+
+def crop_window(box, shape, volume_shape):
+    """Slices of a `shape` window centred on `box`, shifted inwards where it would leave a `volume_shape`
+    volume. A box larger than `shape` along an axis loses its edges there (the centre is kept)."""
+    lo, hi = box
+    window = []
+    for start, stop, size, n in zip(lo, hi, shape, volume_shape):
+        if size > n:
+            raise ValueError(f"Crop shape {tuple(shape)} does not fit in a {tuple(volume_shape)} volume")
+        first = min(max(0, (start + stop - size) // 2), n - size)
+        window.append(slice(first, first + size))
+    return tuple(window)
+
+
+def crop_to_box(volume, box, shape):
+    """The `shape` window of `volume` around `box` (see crop_window), as a view."""
+    return volume[crop_window(box, shape, volume.shape)]
+
+
+def load_boxes(path):
+    """A box file written by `save_boxes`: {"shape", "crop_shape", "boxes": {scan path: box}}, with the
+    shapes and boxes as tuples."""
+    with open(path) as f:
+        data = json.load(f)
+    return {"shape": tuple(data["shape"]), "crop_shape": tuple(data["crop_shape"]),
+            "boxes": {path: (tuple(lo), tuple(hi)) for path, (lo, hi) in data["boxes"].items()}}
+
+
+def save_boxes(path, boxes, shape, crop_shape):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"shape": list(shape), "crop_shape": list(crop_shape),
+                   "boxes": {key: [list(lo), list(hi)] for key, (lo, hi) in boxes.items()}}, f)
+    os.replace(tmp, path)
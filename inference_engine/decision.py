@@ -0,0 +1,59 @@
+# decision.py
+""" From class probabilities to a decision. Plain Python / numpy, no torch. """
+
+import math
+
+import numpy as np
+
+CLASSES = ["No Alzheimer's", "Alzheimer's Detected"]
+PRESENT, NOT_PRESENT, UNCERTAIN = "ALZHEIMER_PRESENT", "ALZHEIMER_NOT_PRESENT", "UNCERTAIN"
+
+# Probabilities strictly between 1 - 0.92 and 0.92 are uncertain (tune on validation for high precision)
+DECISION_THRESHOLD = 0.92
+# app.py's triple-zone display: HARD_NEG / HARD_POS
+TRIPLE_ZONE_BAND = (0.10, 0.90)
+
+
+def softmax(logits):
+    """Numerically stable softmax over the last axis (the class axis, for any batch shape)."""
+    logits = np.asarray(logits, dtype=np.float64)
+    ex = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return ex / ex.sum(axis=-1, keepdims=True)
+
+
+def apply_temperature(prob_pos, T):
+    """Temperature scaling on binary probability (fallback when logits are not available).
+    T=1.0 no change; T<1.0 sharpens; T>1.0 smooths. Use a T learned on validation for honesty."""
+    eps = 1e-8
+    p = max(min(float(prob_pos), 1 - eps), eps)
+    logit = math.log(p / (1.0 - p))
+    return 1.0 / (1.0 + math.exp(-logit / max(T, eps)))
+
+
+def binary_decision(prob_pos):
+    """The argmax class of a two-class prediction, as a decision label."""
+    return PRESENT if prob_pos >= 0.5 else NOT_PRESENT
+
+
+def decide_band(prob_pos, low, high):
+    """PRESENT at or above `high`, NOT_PRESENT at or below `low`, UNCERTAIN in between."""
+    if prob_pos >= high:
+        return PRESENT
+    if prob_pos <= low:
+        return NOT_PRESENT
+    return UNCERTAIN
+
+
+def decide(prob_pos, decision_threshold=DECISION_THRESHOLD, calibrate_note=""):
+    """
+    prob_pos: probability for positive class (Alzheimer present)
+    decision_threshold: e.g., 0.92 (tune on val to get high precision)
+    returns (label_str, reason_str)
+    """
+    # Use symmetric thresholds for confident negative vs positive
+    label = decide_band(prob_pos, 1.0 - decision_threshold, decision_threshold)
+    if label == PRESENT:
+        return label, f"High confidence (prob={prob_pos:.3f}). {calibrate_note}"
+    if label == NOT_PRESENT:
+        return label, f"High confidence negative (prob={prob_pos:.3f}). {calibrate_note}"
+    return label, f"Model uncertain (prob={prob_pos:.3f}). Recommend specialist review."
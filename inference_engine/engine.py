@@ -0,0 +1,141 @@
+# engine.py
+""" Model loading and batched inference on top of a backend. """
+
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+import metrics
+from .backends import build_network, get_backend
+from .decision import CLASSES, binary_decision
+from .preprocessing import INPUT_SHAPE, preprocess_file
+
+__all__ = ["BufferPool", "buffers", "input_batch", "build_network", "load_network", "infer_batch", "Engine"]
+
+
+class BufferPool:
+    """Reusable (N, 1, D, H, W) input tensors keyed by (N, device), so steady-state requests copy scans
+    into memory that already exists instead of allocating a new ~24 MB-per-scan batch every time.
+    A buffer is checked out for the duration of one forward; concurrent requests get separate buffers."""
+
+    def __init__(self, shape=INPUT_SHAPE):
+        self.shape = tuple(shape)
+        self._free = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+
+    def _new(self, n, device):
+        self.allocated += 1
+        return torch.empty((n, 1) + self.shape, dtype=torch.float32, device=device)
+
+    def acquire(self, n, device="cpu"):
+        key = (n, str(device))
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+            return self._new(n, device)
+
+    def release(self, buffer):
+        key = (buffer.shape[0], str(buffer.device))
+        with self._lock:
+            self._free.setdefault(key, []).append(buffer)
+
+    def preallocate(self, n, device="cpu", count=1):
+        """Makes sure at least `count` idle buffers of batch size `n` exist."""
+        key = (n, str(device))
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            while len(free) < count:
+                free.append(self._new(n, device))
+
+    def status(self):
+        with self._lock:
+            return {"allocated": self.allocated,
+                    "idle": {f"{n}@{device}": len(free) for (n, device), free in self._free.items()}}
+
+
+buffers = BufferPool()
+
+
+@contextmanager
+def input_batch(volumes, device="cpu"):
+    """Copies preprocessed volumes into a pooled (N, 1, D, H, W) float32 tensor on `device`.
+    A contiguous float32 (N, D, H, W) array bound for the CPU is wrapped as is, without a copy;
+    other dtypes (e.g. float16 tensor uploads) are converted while being copied into the pool.
+    Volumes of another shape than the pool's (e.g. a screener's) get a one-off tensor."""
+    if (isinstance(volumes, np.ndarray) and volumes.dtype == np.float32 and volumes.flags.c_contiguous
+            and volumes.flags.writeable and torch.device(device).type == "cpu"):
+        yield torch.from_numpy(volumes).unsqueeze(1)
+        return
+    if len(volumes) == 0:
+        raise ValueError("input_batch needs at least one volume")
+    if tuple(volumes[0].shape) != buffers.shape:
+        yield torch.from_numpy(np.stack(volumes).astype(np.float32, copy=False)).unsqueeze(1).to(device)
+        return
+    buffer = buffers.acquire(len(volumes), device)
+    try:
+        for i, volume in enumerate(volumes):
+            buffer[i, 0].copy_(torch.from_numpy(volume))
+        yield buffer
+    finally:
+        buffers.release(buffer)
+
+
+def load_network(checkpoint, device="cpu", input_shape=INPUT_SHAPE, backend="torch", **options):
+    """Loads a checkpoint through `backend`, ready for inference."""
+    return get_backend(backend).load(checkpoint, device=device, input_shape=input_shape, **options)
+
+
+@torch.no_grad()
+def infer_batch(model, volumes, mode="independent", device="cpu", backend="torch", batch_size=None, timings=None):
+    """Class probabilities (N, C) for N preprocessed volumes (a list of (D, H, W) arrays or one (N, D, H, W)
+    array). mode="independent" scores every scan on its own, `batch_size` scans per forward; mode="sequence"
+    runs them as one patient's ordered series, and row i has then seen scans 0..i. Softmax is always taken
+    over the class (last) axis. No volumes give an empty (0, C) array."""
+    backend = get_backend(backend)
+    if len(volumes) == 0:
+        return np.zeros((0, len(CLASSES)), dtype=np.float32)
+    chunk = len(volumes) if mode == "sequence" or not batch_size else batch_size
+    probs = []
+    for start in range(0, len(volumes), chunk):
+        with input_batch(volumes[start:start + chunk], device) as batch, metrics.timed("forward", timings):
+            logits = backend.logits(model, batch, mode)
+            probs.append(torch.softmax(logits.float(), dim=-1).cpu().numpy())
+    return np.concatenate(probs, axis=0)
+
+
+class Engine:
+    """ One loaded model and its backend, for scripts that just want answers. Specify:
+        + checkpoint, the model file
+        + device, where to run
+        + backend, a registered backend name (see backends.py)
+        + batch_size, scans per forward in independent mode
+        + crop_shape, the input shape of a network trained on brain crops (see brain_box.py); scans are
+          resized to input_shape and then cropped to it
+        + options, extra backend arguments (e.g. screener= for the cascade backend)"""
+
+    def __init__(self, checkpoint, device="cpu", backend="torch", input_shape=INPUT_SHAPE, batch_size=None,
+                 crop_shape=None, **options):
+        self.backend = get_backend(backend)
+        self.device = device
+        self.input_shape = tuple(input_shape)
+        self.crop_shape = tuple(crop_shape) if crop_shape else None
+        self.batch_size = batch_size
+        self.model = self.backend.load(checkpoint, device=device, input_shape=self.crop_shape or self.input_shape,
+                                       **options)
+
+    def predict_volumes(self, volumes, mode="independent", timings=None):
+        return infer_batch(self.model, volumes, mode, self.device, self.backend, self.batch_size, timings)
+
+    def predict_files(self, paths, mode="independent", timings=None):
+        volumes = [preprocess_file(path, self.input_shape, timings, self.crop_shape) for path in paths]
+        return self.predict_volumes(volumes, mode, timings)
+
+    @staticmethod
+    def label(probs):
+        """Class name and decision label for one row of probabilities."""
+        predicted = int(np.argmax(probs))
+        return CLASSES[predicted], binary_decision(float(probs[1]))
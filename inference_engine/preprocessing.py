@@ -0,0 +1,162 @@
+# preprocessing.py
+""" NIfTI loading and preprocessing shared by predict.py, app.py, batch_predict.py and the API.
+
+Only numpy / nibabel / scikit-image are needed here (no torch), so these functions are cheap to run in
+worker processes; nibabel and scikit-image are imported on first use. Each step is timed under the shared
+stage names of metrics.py (decode, normalize, resample).
+
+Volumes are read as float32 straight from the image's data object, a slab of slices at a time, instead
+of through get_fdata(), which materializes (and caches on the image) a float64 copy of the whole scan.
+Uncompressed files are memory-mapped; block-gzipped (BGZF) files are inflated on all cores (see bgzf.py);
+other .nii.gz files are decompressed as one forward stream (with python-isal's igzip when it is
+installed). Peak memory is the float32 result plus one slab (plus the raw voxels for BGZF). """
+
+import io
+
+import numpy as np
+
+from metrics import timed
+
+INPUT_SHAPE = (200, 200, 150)  # From training
+# Most scans per patient: MRIData pads every patient to this many, and it is the longest sequence the LSTM
+# was trained on
+MAX_NUM_IMAGES = 10
+# Keeps a constant (e.g. blank) volume at 0 instead of dividing by zero
+NORMALIZE_EPS = 1e-8
+# Scaled voxels converted per step while reading
+READ_CHUNK_BYTES = 8 * 1024 * 1024
+# sizeof_hdr of a NIfTI-1 header, either byte order
+NIFTI1_SIZEOF_HDR = (np.int32(348).tobytes(), np.int32(348).byteswap().tobytes())
+
+
+def _gzip_stream(path):
+    """A forward-only decompressing stream over a gzipped NIfTI-1 file, or None for anything else
+    (other formats go through nibabel's own opener)."""
+    try:
+        from isal import igzip as gzip
+    except ImportError:
+        import gzip
+    stream = gzip.open(path, "rb")
+    if stream.read(4) in NIFTI1_SIZEOF_HDR:
+        stream.seek(0)
+        return stream
+    stream.close()
+    return None
+
+
+def _fill(voxels, full_shape, dtype, scale=None):
+    """Converts `voxels` (an array proxy or an array of raw values, shaped `full_shape`) into a new `dtype`
+    array one slab at a time. NIfTI data is stored Fortran-ordered, so slabs along the last axis are
+    contiguous in the file: reading them in order touches each byte once and never seeks backwards in a
+    gzip stream. `scale` is (slope, intercept) for raw values; proxies scale themselves. Trailing
+    singleton axes (e.g. a 4D file holding one volume) are dropped."""
+    shape = tuple(full_shape)
+    while len(shape) > 3 and shape[-1] == 1:
+        shape = shape[:-1]
+    volume = np.empty(shape, dtype=dtype)
+    step = max(1, READ_CHUNK_BYTES // (int(np.prod(shape[:-1])) * 8))
+    trailing = (0,) * (len(full_shape) - len(shape))
+    for start in range(0, shape[-1], step):
+        slab = (slice(None),) * (len(shape) - 1) + (slice(start, start + step),)
+        values = voxels[slab + trailing]
+        if scale is not None:
+            values = values.astype(dtype)
+            slope, inter = scale
+            if slope != 1.0:
+                values *= slope
+            if inter != 0.0:
+                values += inter
+        volume[slab] = values
+    return volume
+
+
+def _read_bgzf(path, dtype):
+    """Inflates a BGZF NIfTI-1 file on all cores and converts the raw voxels in place of nibabel's
+    proxy. Returns None when the contents are not NIfTI-1."""
+    import nibabel as nib
+    from . import bgzf
+
+    data = bgzf.decompress(path)
+    if bytes(data[:4]) not in NIFTI1_SIZEOF_HDR:
+        return None
+    header = nib.Nifti1Header.from_fileobj(io.BytesIO(bytes(data[:348])))
+    shape = header.get_data_shape()
+    raw = np.frombuffer(data, dtype=header.get_data_dtype(), count=int(np.prod(shape)),
+                        offset=int(header["vox_offset"])).reshape(shape, order="F")
+    slope, inter = header.get_slope_inter()
+    return _fill(raw, shape, dtype, (1.0 if slope is None else float(slope), 0.0 if inter is None else float(inter)))
+
+
+def read_volume(path, dtype=np.float32):
+    """Reads a .nii / .nii.gz file into a `dtype` array with the NIfTI scaling applied."""
+    import nibabel as nib
+    from nibabel.fileholders import FileHolder
+    from . import bgzf
+
+    compressed = path.lower().endswith(".gz")
+    if compressed and bgzf.is_bgzf(path):
+        volume = _read_bgzf(path, dtype)
+        if volume is not None:
+            return volume
+    stream = _gzip_stream(path) if compressed else None
+    try:
+        if stream is None:
+            # keep_file_open: a gzipped file other than NIfTI-1 must not be reopened (and decompressed from
+            # the start again) for every slab
+            image = nib.load(path, mmap="r", keep_file_open=True)
+        else:
+            holder = FileHolder(filename=path, fileobj=stream)
+            image = nib.Nifti1Image.from_file_map({"header": holder, "image": holder})
+        return _fill(image.dataobj, image.shape, dtype)
+    finally:
+        if stream is not None:
+            stream.close()
+
+
+def load_volume(path, timings=None):
+    """Reads a .nii / .nii.gz file into a float32 numpy array."""
+    with timed("decode", timings):
+        return read_volume(path)
+
+
+def normalize(mri_data):
+    """Min-max scales intensities to [0, 1]."""
+    mri_min, mri_max = float(np.min(mri_data)), float(np.max(mri_data))
+    return (mri_data - mri_min) / (mri_max - mri_min + NORMALIZE_EPS)
+
+
+def resize_volume(mri_data, input_shape=INPUT_SHAPE):
+    from skimage.transform import resize
+    return resize(mri_data, input_shape, anti_aliasing=True, preserve_range=True)
+
+
+def crop(mri_data, crop_shape):
+    """Cuts a `crop_shape` window around the brain out of a resized volume (see brain_box.py)."""
+    from .brain_box import brain_box, crop_to_box
+    return np.ascontiguousarray(crop_to_box(mri_data, brain_box(mri_data), crop_shape))
+
+
+def preprocess(mri_data, input_shape=INPUT_SHAPE, timings=None, crop_shape=None):
+    """Normalizes and resizes a decoded volume to `input_shape`, then, for a network trained on brain
+    crops, cuts it to `crop_shape` around the brain. Returns float32."""
+    with timed("normalize", timings):
+        mri_data = normalize(mri_data)
+    if mri_data.shape != tuple(input_shape):
+        with timed("resample", timings):
+            mri_data = resize_volume(mri_data, input_shape)
+    if crop_shape is not None:
+        with timed("crop", timings):
+            mri_data = crop(mri_data, crop_shape)
+    return mri_data.astype(np.float32, copy=False)
+
+
+def preprocess_file(path, input_shape=INPUT_SHAPE, timings=None, crop_shape=None):
+    return preprocess(load_volume(path, timings), input_shape, timings, crop_shape)
+
+
+def preprocess_file_timed(path, input_shape=INPUT_SHAPE, crop_shape=None):
+    """Like preprocess_file, but also returns the stage timings so a parent process can record them
+    (observations made inside a worker process never reach the parent's metrics)."""
+    timings = {}
+    volume = preprocess_file(path, input_shape, timings, crop_shape)
+    return volume, timings
@@ -0,0 +1,118 @@
+# log_utils.py
+""" Leveled, rate-limited logging and in-memory metric counters shared by the training, prediction
+and serving scripts.
+
+Entry points call `configure_logging()` once; library modules just use `logging.getLogger(__name__)`.
+The level comes from the `--log-level` flag of a script or the AD_LOG_LEVEL environment variable
+(default INFO). Pass tensors as logging arguments (`log.debug("out %s", out)`) rather than f-strings,
+so they are only formatted when DEBUG is enabled. """
+
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+DATE_FORMAT = "%H:%M:%S"
+
+_configured = False
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most `burst` records with the same logger and message template through per `interval`
+    seconds. The number of suppressed records is appended to the next record that gets through.
+    DEBUG records are never limited, since they are only on when someone asked for them."""
+
+    def __init__(self, interval=10.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.interval:
+                window_start, count = now, 0
+            if count >= self.burst:
+                self._windows[key] = (window_start, count, suppressed + 1)
+                return False
+            self._windows[key] = (window_start, count + 1, 0)
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+        return True
+
+
+def configure_logging(level=None, interval=10.0, burst=5):
+    """Installs a single stderr handler on the root logger. Safe to call more than once."""
+    global _configured
+    level = level or os.environ.get("AD_LOG_LEVEL", "INFO")
+    if isinstance(level, str):
+        level = getattr(logging, level.upper(), logging.INFO)
+    root = logging.getLogger()
+    root.setLevel(level)
+    if not _configured:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+        handler.addFilter(RateLimitFilter(interval=interval, burst=burst))
+        root.addHandler(handler)
+        _configured = True
+    return root
+
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+
+class MetricCounters:
+    """Aggregates counts and sums in memory and logs them together every `flush_interval` seconds,
+    instead of printing one line per sample from inside a hot loop. Tensor values are summed where they
+    live and read back once per flush, so adding a GPU loss does not synchronise the device."""
+
+    def __init__(self, logger, flush_interval=30.0, level=logging.INFO):
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self.level = level
+        self._counts = defaultdict(int)
+        self._sums = defaultdict(float)
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, name, value=None):
+        """Counts one event under `name`; when `value` is given it is also summed (for means)."""
+        with self._lock:
+            self._counts[name] += 1
+            if value is not None:
+                # a tensor (anything with .detach()) stays a device-side sum until the flush
+                self._sums[name] += value.detach() if hasattr(value, "detach") else float(value)
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts), {name: float(total) for name, total in self._sums.items()}
+
+    def flush(self):
+        """Logs and resets the counters accumulated since the last flush."""
+        with self._lock:
+            counts, sums = dict(self._counts), {name: float(total) for name, total in self._sums.items()}
+            self._counts.clear()
+            self._sums.clear()
+            self._last_flush = time.monotonic()
+        if not counts or not self.logger.isEnabledFor(self.level):
+            return
+        parts = []
+        for name in sorted(counts):
+            if name in sums:
+                parts.append(f"{name}: n={counts[name]} mean={sums[name] / counts[name]:.4f}")
+            else:
+                parts.append(f"{name}: {counts[name]}")
+        self.logger.log(self.level, "metrics | %s", " | ".join(parts))
@@ -0,0 +1,230 @@
+# metrics.py
+""" Stage timing and counters shared by predict.py, app.py and the API, with a Prometheus text renderer.
+
+Every entry point wraps the same stages in `timed(stage)`: upload, decode, normalize, resample,
+crop (brain-cropped models only), forward and end_to_end. The API serves them at /metrics. predict.py runs as a subprocess of the API,
+so it also prints its timings as one "Stage timings: {...}" log line (see `format_stage_line`), and the
+API folds that line into its own histograms with `observe_stage_line`. """
+
+import json
+import os
+import re
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; scans take from milliseconds (forward on a warm model) to minutes (big uploads)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+STAGE_LINE = re.compile(r"Stage timings:\s*(\{.*\})")
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + escaped + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """A value that is either set directly or read from a callback at render time."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = float(value)
+
+    def set_function(self, fn, **labels):
+        with self._lock:
+            self._callbacks[_label_key(self.labelnames, labels)] = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = dict(self._values)
+            callbacks = dict(self._callbacks)
+        for key, fn in callbacks.items():
+            try:
+                values[key] = float(fn())
+            except Exception:
+                continue
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), [0.0, 0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            total[0] += value
+            total[1] += 1
+            self._series[key] = (counts, total)
+
+    def count(self, **labels):
+        series = self._series.get(_label_key(self.labelnames, labels))
+        return series[1][1] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(c), list(t)) for key, (c, t) in self._series.items()}
+        for key, (counts, (total, n)) in sorted(series.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': bound})} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': '+Inf'})} {n}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "alzheimer_stage_duration_seconds", "Time spent per pipeline stage.", ["stage"]))
+DECISIONS = REGISTRY.register(Counter(
+    "alzheimer_decisions_total", "Predictions by decision class.", ["decision"]))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "alzheimer_cache_requests_total", "Cache lookups by cache and result (hit/miss).", ["cache", "result"]))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "alzheimer_queue_depth", "Work waiting to be processed.", ["queue"]))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "alzheimer_in_flight", "Requests currently being processed.", ["kind"]))
+RSS_BYTES = REGISTRY.register(Gauge(
+    "process_resident_memory_bytes", "Resident set size of this process."))
+PEAK_RSS_BYTES = REGISTRY.register(Gauge(
+    "process_peak_resident_memory_bytes", "Peak resident set size of this process."))
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+RSS_BYTES.set_function(current_rss_bytes)
+PEAK_RSS_BYTES.set_function(peak_rss_bytes)
+
+
+# ----------------- INSTRUMENTATION HOOKS -----------------
+@contextmanager
+def timed(stage, timings=None):
+    """Observes the duration of the block under `stage`; also stores it in `timings` if a dict is given."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def observe_timings(timings):
+    """Records stage timings measured elsewhere (a worker process or a predict.py subprocess)."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(float(seconds), stage=stage)
+
+
+def decision_class(prob_pos, decision_threshold=None):
+    """The decision bucket of a probability; the threshold defaults to inference_engine.DECISION_THRESHOLD."""
+    # inference_engine.preprocessing imports this module, so the decision rule is imported on use
+    from inference_engine.decision import DECISION_THRESHOLD, decide_band
+    if decision_threshold is None:
+        decision_threshold = DECISION_THRESHOLD
+    return decide_band(prob_pos, 1.0 - decision_threshold, decision_threshold)
+
+
+def record_decision(prob_pos):
+    DECISIONS.inc(decision=decision_class(prob_pos))
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def format_stage_line(timings):
+    return "Stage timings: " + json.dumps({k: round(v, 6) for k, v in timings.items()})
+
+
+def observe_stage_line(text, exclude=("end_to_end",)):
+    """Finds a "Stage timings: {...}" line in predict.py output and records it. Returns the timings.
+    The subprocess's own end_to_end is skipped by default, since the caller measures its own."""
+    match = STAGE_LINE.search(text or "")
+    if not match:
+        return {}
+    try:
+        timings = json.loads(match.group(1))
+    except ValueError:
+        return {}
+    observe_timings({k: v for k, v in timings.items() if k not in exclude})
+    return timings
+
+
+def render():
+    return REGISTRY.render()
@@ -1,19 +1,58 @@
 import os
+import json
+import time
+import logging
 import numpy as np
 
 import torch
 from torch.utils.data import Dataset
 
-import nibabel as nib
 from scipy import ndimage
 
+from inference_engine.brain_box import brain_box, crop_window, load_boxes
+from inference_engine.preprocessing import MAX_NUM_IMAGES, read_volume
+from volume_store import VolumeStore, clamp_float16
+
 # Dimensions of neuroimages after resizing
 STANDARD_DIM1 = 200
 STANDARD_DIM2 = 200
 STANDARD_DIM3 = 150
 
-# Maximum number of images per patient
-MAX_NUM_IMAGES = 10
+log = logging.getLogger(__name__)
+
+
+def resize_to_standard(image_data):
+    """Resizes a scan to STANDARD_DIM1 x STANDARD_DIM2 x STANDARD_DIM3 (spline zoom)."""
+    current_dim1, current_dim2, current_dim3 = image_data.shape
+    scale_factor1 = STANDARD_DIM1 / float(current_dim1)
+    scale_factor2 = STANDARD_DIM2 / float(current_dim2)
+    scale_factor3 = STANDARD_DIM3 / float(current_dim3)
+    return ndimage.zoom(image_data, (scale_factor1, scale_factor2, scale_factor3))
+
+
+def split_path(checkpoint):
+    """The split file saved next to a checkpoint: ad-model.pt -> ad-model.split.json."""
+    return os.path.splitext(checkpoint)[0] + ".split.json"
+
+
+def save_split(path, training_list, test_list, seed=None):
+    """Records the train/test patients a checkpoint was trained and tested on, so models evaluated
+    against it later (e.g. the cascade screener) test on the same held-out patients."""
+    def plain(entry):
+        return [item.item() if isinstance(item, np.generic) else item for item in entry]
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"seed": seed, "train": [plain(e) for e in training_list], "test": [plain(e) for e in test_list]},
+                  f)
+    os.replace(tmp, path)
+
+
+def load_split(path):
+    """(training list, test list) from a file written by save_split."""
+    with open(path) as f:
+        split = json.load(f)
+    return split["train"], split["test"]
+
 
 class MRIData(Dataset):
     """
@@ -26,7 +65,7 @@ class MRIData(Dataset):
     where the paths will be accessed and their neuroimages processed into tensors.
     """
 
-    def __init__(self, root_dir, data_array):
+    def __init__(self, root_dir, data_array, dtype=torch.float32, cache=False, store=None, boxes=None):
         """
         Args:
             root_dir (string): directory of all the images
@@ -34,9 +73,35 @@ class MRIData(Dataset):
                                where key:       subject ID
                                      value:     paths to patient's MRI .nii neuroimages
                                      label:     class label (AD or MCI)
+            dtype (torch.dtype): dtype of the returned image tensors, e.g. torch.float16 for the
+                                 half-precision trainer
+            cache (bool or int): keep each patient's resized scans in memory (in `dtype`) after the
+                          first load, so later epochs skip decoding and resizing. An int caches at most
+                          that many patients (the first ones loaded; with shuffled epochs any subset
+                          saves as much), so memory stays bounded on large cohorts. The cache lives in
+                          the process that owns the dataset, so use it with num_workers=0.
+            store (VolumeStore or string): store written by pack_volumes.py (or its path). Scans are
+                          then read, already resized, from the store under their manifest path instead
+                          of being decoded from root_dir.
+            boxes (dict or string): brain boxes written by brain_boxes.py (or their path). Every scan is
+                          then cropped to the file's crop_shape around its brain (boxes missing from the
+                          file are computed on the fly), and tensors have that shape. With a store, only
+                          the chunks under the crop are read.
         """
         self.root_dir = root_dir
         self.data_array = data_array
+        self.dtype = dtype
+        self.cache = {} if cache else None
+        # cache=True: no limit
+        self.cache_limit = None if cache is True else int(cache)
+        self.store = VolumeStore(store) if isinstance(store, str) else store
+        if self.store is not None and self.store.shape != (STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3):
+            raise ValueError(f"{self.store.path} holds {self.store.shape} volumes, expected "
+                             f"{(STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3)}")
+        self.boxes = load_boxes(boxes) if isinstance(boxes, str) else boxes
+        # Shape of every returned scan
+        self.image_shape = (self.boxes['crop_shape'] if self.boxes is not None
+                            else (STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3))
 
     def __len__(self):
         """Returns length of dataset"""
@@ -53,33 +118,26 @@ class MRIData(Dataset):
         patient_label = current_patient[-1]
         image_paths = current_patient[:-1]
 
-        images_list = []
-
-        # Load and process each MRI scan
-        for image_path in image_paths:
-            file_name = os.path.join(self.root_dir, image_path)
-            neuroimage = nib.load(file_name)  # Load MRI
-            image_data = neuroimage.get_fdata()  # Convert to numpy array
+        # Time spent reading and resizing scans, reported to the training profiler
+        timings = {'decode_time': 0.0, 'resize_time': 0.0}
 
-            # Resize MRI to standard dimensions
-            current_dim1, current_dim2, current_dim3 = image_data.shape
-            scale_factor1 = STANDARD_DIM1 / float(current_dim1)
-            scale_factor2 = STANDARD_DIM2 / float(current_dim2)
-            scale_factor3 = STANDARD_DIM3 / float(current_dim3)
-            image_data = ndimage.zoom(image_data, (scale_factor1, scale_factor2, scale_factor3))
-
-            # Convert to tensor
-            image_data_tensor = torch.Tensor(image_data)
-            images_list.append(image_data_tensor)
+        if self.cache is not None and index in self.cache:
+            images_list = list(self.cache[index])
+        else:
+            images_list = self._load_images(image_paths, timings)
+            if self.cache is not None and images_list and (self.cache_limit is None
+                                                           or len(self.cache) < self.cache_limit):
+                # Only the real scans are cached; padding is rebuilt on every access.
+                self.cache[index] = torch.stack(images_list, dim=0)
 
         # Pad with zero-tensors if fewer than MAX_NUM_IMAGES
         num_images = len(images_list)
         while len(images_list) < MAX_NUM_IMAGES:
-            padding_tensor = torch.zeros((STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3))
+            padding_tensor = torch.zeros(self.image_shape, dtype=self.dtype)
             images_list.append(padding_tensor)
 
         if len(images_list) > MAX_NUM_IMAGES:
-            print("Error: More than 10 images for one patient. Update MAX_NUM_IMAGES if needed.")
+            log.error("More than %d images for one patient. Update MAX_NUM_IMAGES if needed.", MAX_NUM_IMAGES)
 
         # Stack into a single tensor
         images_tensor = torch.stack(images_list, dim=0)
@@ -88,5 +146,59 @@ class MRIData(Dataset):
         return {
             'images': images_tensor,
             'label': torch.tensor(patient_label, dtype=torch.long),
-            'num_images': num_images
+            'num_images': num_images,
+            'decode_time': timings['decode_time'],
+            'resize_time': timings['resize_time']
         }
+
+    def _crop_window(self, image_path, image_data=None):
+        """Slices of the crop around the scan's brain box; the box is computed from `image_data` (the
+        resized scan) when the box file has none for this path."""
+        box = self.boxes['boxes'].get(image_path)
+        if box is None:
+            if image_data is None:
+                return None
+            box = brain_box(image_data)
+        return crop_window(box, self.image_shape, (STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3))
+
+    def _load_images(self, image_paths, timings):
+        """Loads and resizes (and, with boxes, crops) every scan of one patient into a list of tensors
+        of dtype `self.dtype`, adding the time spent decoding and resizing to `timings`."""
+        images_list = []
+
+        # Load and process each MRI scan
+        for image_path in image_paths:
+            if self.store is not None:
+                window = self._crop_window(image_path) if self.boxes is not None else None
+                start = time.perf_counter()
+                image_data = self.store.read(image_path, window)  # Already resized when the store was packed
+                timings['decode_time'] += time.perf_counter() - start
+                if self.boxes is not None and window is None:
+                    start = time.perf_counter()
+                    image_data = image_data[self._crop_window(image_path, image_data)]
+                    timings['resize_time'] += time.perf_counter() - start
+                images_list.append(self._as_tensor(image_data, image_path))
+                continue
+
+            file_name = os.path.join(self.root_dir, image_path)
+            start = time.perf_counter()
+            image_data = read_volume(file_name)  # Load MRI as float32, without a cached float64 copy
+            timings['decode_time'] += time.perf_counter() - start
+
+            # Resize MRI to standard dimensions
+            start = time.perf_counter()
+            image_data = resize_to_standard(image_data)
+            if self.boxes is not None:
+                image_data = np.ascontiguousarray(image_data[self._crop_window(image_path, image_data)])
+            timings['resize_time'] += time.perf_counter() - start
+
+            # Convert to tensor
+            images_list.append(self._as_tensor(image_data, image_path))
+
+        return images_list
+
+    def _as_tensor(self, image_data, image_path):
+        """The scan as a `self.dtype` tensor; fp16 intensities beyond its range are clamped, not inf."""
+        if self.dtype == torch.float16:
+            image_data = clamp_float16(image_data, image_path)
+        return torch.as_tensor(image_data, dtype=self.dtype)
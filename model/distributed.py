@@ -0,0 +1,87 @@
+""" Helpers for data-parallel training on the gloo backend.
+
+Launch N local processes with torchrun, e.g.
+    torchrun --standalone --nproc_per_node=4 evaluate.py --distributed
+torchrun sets RANK, WORLD_SIZE, LOCAL_WORLD_SIZE, MASTER_ADDR and MASTER_PORT for every process."""
+
+import os
+
+import torch
+import torch.distributed as dist
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+
+def init_distributed(backend="gloo"):
+    """Joins the process group described by the torchrun environment. Returns (rank, world_size)."""
+    if not dist.is_available():
+        raise RuntimeError("torch.distributed is not available in this build of PyTorch.")
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    rank = dist.get_rank()
+    world_size = dist.get_world_size()
+
+    # Each process gets an equal share of the cores, otherwise N processes each spin up
+    # a full-size intra-op pool and fight over the same cores.
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    threads = max(1, (os.cpu_count() or 1) // local_world_size)
+    torch.set_num_threads(threads)
+    return rank, world_size
+
+
+def cleanup_distributed():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def is_main_process():
+    return not is_distributed() or dist.get_rank() == 0
+
+
+def broadcast_parameters(model, src=0):
+    """Copies the parameters of rank `src` to every other rank so all replicas start identical."""
+    if not is_distributed():
+        return
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        dist.broadcast(tensor.data, src=src)
+
+
+def average_gradients(model):
+    """All-reduces and averages the gradients of `model` in one flattened bucket.
+
+    Every rank must call this once per optimizer step. Parameters without a gradient (e.g. when
+    every patient in a rank's batch raised) contribute zeros, so ranks never block on each other."""
+    if not is_distributed():
+        return
+    world_size = dist.get_world_size()
+    params = [p for p in model.parameters() if p.requires_grad]
+    for p in params:
+        if p.grad is None:
+            p.grad = torch.zeros_like(p.data)
+    grads = [p.grad.data for p in params]
+    flat = _flatten_dense_tensors(grads)
+    dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+    flat.div_(world_size)
+    for grad, synced in zip(grads, _unflatten_dense_tensors(flat, grads)):
+        grad.copy_(synced)
+
+
+def shard_indices(length, rank, world_size):
+    """Dataset indices rank, rank + world_size, ... as a DataLoader sampler, for evaluation.
+
+    Unlike DistributedSampler this does not pad ranks to equal length with repeated samples, so every
+    sample is counted exactly once when per-rank sums are all-reduced. Ranks may then run a different
+    number of batches, which is fine as long as no collective runs per batch."""
+    return list(range(rank, length, world_size))
+
+
+def all_reduce_sum(*values):
+    """Sums python scalars across ranks and returns them as floats."""
+    if not is_distributed():
+        return [float(v) for v in values]
+    tensor = torch.tensor([float(v) for v in values], dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
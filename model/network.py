@@ -5,68 +5,189 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+import json
 import math
+import logging
+
+log = logging.getLogger(__name__)
 
 # For reproducibility for testing purposes. Delete during actual training.
 # torch.manual_seed(1) 
 
+# The original network: three 4x4x4 convolutions (10, 5 and 1 channels) with 4x4x4 max pooling in between,
+# feeding a square LSTM (hidden size = flattened feature map). Checkpoints trained before architectures
+# became configurable load into this spec unchanged.
+DEFAULT_ARCHITECTURE = {
+    "layers": [
+        {"type": "conv", "channels": 10, "kernel": 4},
+        {"type": "maxpool", "kernel": 4},
+        {"type": "conv", "channels": 5, "kernel": 4},
+        {"type": "maxpool", "kernel": 4},
+        {"type": "conv", "channels": 1, "kernel": 4},
+    ],
+    "lstm_hidden": None,
+}
+
+# Named alternatives, selectable wherever an architecture is accepted (--architecture on the command line)
+ARCHITECTURES = {
+    "default": DEFAULT_ARCHITECTURE,
+    # Strided convolutions instead of conv + pool: the first layers never run at full resolution
+    "strided": {
+        "layers": [
+            {"type": "conv", "channels": 8, "kernel": 4, "stride": 4, "activation": "relu"},
+            {"type": "conv", "channels": 16, "kernel": 3, "stride": 2, "padding": 1, "activation": "relu"},
+            {"type": "conv", "channels": 16, "kernel": 3, "stride": 2, "padding": 1, "activation": "relu"},
+            {"type": "conv", "channels": 1, "kernel": 3},
+        ],
+        "lstm_hidden": 64,
+    },
+    # Depthwise-separable blocks and global pooling: a small channel vector per scan goes to the LSTM
+    "separable": {
+        "layers": [
+            {"type": "conv", "channels": 8, "kernel": 4, "stride": 4, "activation": "relu"},
+            {"type": "separable", "channels": 16, "kernel": 3, "stride": 2, "padding": 1, "activation": "relu"},
+            {"type": "separable", "channels": 32, "kernel": 3, "stride": 2, "padding": 1, "activation": "relu"},
+            {"type": "separable", "channels": 64, "kernel": 3, "stride": 2, "padding": 1, "activation": "relu"},
+            {"type": "global_avgpool"},
+        ],
+        "lstm_hidden": 32,
+    },
+}
+
+LAYER_TYPES = ("conv", "separable", "maxpool", "avgpool", "global_avgpool", "global_maxpool")
+ACTIVATIONS = {"relu": F.relu, "gelu": F.gelu}
+
+
+def load_architecture(architecture=None):
+    """An architecture spec from None (the default), a name in ARCHITECTURES, a spec dict, or the path of
+    a .json / .yaml file holding one (YAML needs PyYAML). Specs look like DEFAULT_ARCHITECTURE:
+        layers:       conv / separable {channels, kernel, stride=1, padding=0, activation=None},
+                      maxpool / avgpool {kernel, stride=kernel}, global_avgpool / global_maxpool
+        lstm_hidden:  LSTM hidden size, or null for the flattened feature size (the original square LSTM)"""
+    if architecture is None:
+        return DEFAULT_ARCHITECTURE
+    if isinstance(architecture, str):
+        if architecture in ARCHITECTURES:
+            return ARCHITECTURES[architecture]
+        with open(architecture) as f:
+            if architecture.endswith((".yaml", ".yml")):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError(f"Reading {architecture} needs PyYAML (pip install pyyaml)") from None
+                architecture = yaml.safe_load(f)
+            else:
+                architecture = json.load(f)
+    for layer in architecture.get("layers", []):
+        if layer.get("type") not in LAYER_TYPES:
+            raise ValueError(f"Unknown layer type {layer.get('type')!r} (available: {', '.join(LAYER_TYPES)})")
+        if layer.get("activation") not in (None, *ACTIVATIONS):
+            raise ValueError(f"Unknown activation {layer['activation']!r}")
+    return architecture
+
+
+def dimensions_after_convolution(kernel, stride, padding, input_shape):
+    # Output shape of a convolution or pooling layer (the same rule PyTorch applies)
+    return tuple(math.floor((n + 2 * padding - kernel) / stride) + 1 for n in input_shape)
+
+
+class SeparableConv3d(nn.Module):
+    """ Depthwise-separable 3D convolution: a per-channel (grouped) kxkxk convolution followed by a 1x1x1
+    convolution that mixes channels, for roughly 1/out_channels + 1/k^3 of a full convolution's cost."""
+
+    def __init__(self, in_channels, out_channels, kernel_size, stride=1, padding=0):
+        super(SeparableConv3d, self).__init__()
+        self.depthwise = nn.Conv3d(in_channels, in_channels, kernel_size, stride=stride, padding=padding,
+                                   groups=in_channels)
+        self.pointwise = nn.Conv3d(in_channels, out_channels, 1)
+
+    def forward(self, x):
+        return self.pointwise(self.depthwise(x))
+
+
 class Network(nn.Module):
     """ CNN LSTM to classify ADNI data. Specify:
         + embedding dimension, the number of channels each input image has (likely 1).
         + input_size, the shape of the input in a tuple: (Depth, Height, Width)
-        + output_size, a scalar (like 4) that specifies the number of predictions the network should make."""
+        + output_size, a scalar (like 4) that specifies the number of predictions the network should make.
+        + architecture, the CNN layers and LSTM size (see load_architecture); the original network by default."""
 
-    def __init__(self, input_channels, input_shape, output_size, lstm_layers=1):
+    def __init__(self, input_channels, input_shape, output_size, lstm_layers=1, architecture=None):
         super(Network, self).__init__()
 
-        print("Initializing hyperparameters...")
-
-        def dimensions_after_convolution(kernel, stride, padding, input_shape):
-            # helper function for automatic calculation of hyperparameters
-            output_depth = math.floor((input_shape[0] + 2 * padding - kernel + 1) / stride + (
-                    stride - 1) / stride)
-            output_height = math.floor((input_shape[1] + 2 * padding - kernel + 1) / stride + (
-                    stride - 1) / stride)  # the total height is the input plus twice the padding
-            output_width = math.floor((input_shape[2] + 2 * padding - kernel + 1) / stride + (stride - 1) / stride)
-            return output_depth, output_height, output_width
-
-        # CNN for feature selection and encoding
-        # CNN-specific hyperparameters
-        kernel_size = 4
-        padding = 0
-
-        # The input and output
-        self.convolution1 = nn.Conv3d(input_channels, 10,kernel_size,padding=padding)
-        current_shape = dimensions_after_convolution(kernel_size,1,padding,input_shape)
-        self.pool1 = nn.MaxPool3d(kernel_size)
-        current_shape = dimensions_after_convolution(kernel_size,kernel_size,padding,current_shape)
-        self.convolution2 = nn.Conv3d(10, 5,kernel_size,padding=padding)
-        current_shape = dimensions_after_convolution(kernel_size, 1, padding, current_shape)
-        self.pool2 = nn.MaxPool3d(kernel_size)
-        current_shape = dimensions_after_convolution(kernel_size, kernel_size, padding, current_shape)
-        self.convolution3 = nn.Conv3d(5, 1, kernel_size, padding=padding)
-        current_shape = dimensions_after_convolution(kernel_size, 1, padding, current_shape)
+        log.debug("Initializing hyperparameters...")
+        self.architecture = load_architecture(architecture)
+
+        # CNN for feature selection and encoding. Layers are named convolution1, pool1, convolution2, ... in
+        # order, so the default architecture keeps the state_dict keys of the original network.
+        current_shape, channels = tuple(input_shape), input_channels
+        encoder, self.activations = [], {}
+        counts = {"convolution": 0, "pool": 0}
+        for layer in self.architecture["layers"]:
+            kind = layer["type"]
+            if kind in ("conv", "separable"):
+                kernel, stride, padding = layer["kernel"], layer.get("stride", 1), layer.get("padding", 0)
+                conv = nn.Conv3d if kind == "conv" else SeparableConv3d
+                module = conv(channels, layer["channels"], kernel, stride=stride, padding=padding)
+                current_shape = dimensions_after_convolution(kernel, stride, padding, current_shape)
+                channels = layer["channels"]
+                prefix = "convolution"
+            elif kind in ("maxpool", "avgpool"):
+                kernel, stride = layer["kernel"], layer.get("stride", layer["kernel"])
+                pool = nn.MaxPool3d if kind == "maxpool" else nn.AvgPool3d
+                # MaxPool3d(k) is what the original network used; keep its form when stride is the default
+                module = pool(kernel) if stride == kernel else pool(kernel, stride=stride)
+                current_shape = dimensions_after_convolution(kernel, stride, 0, current_shape)
+                prefix = "pool"
+            else:
+                module = nn.AdaptiveAvgPool3d(1) if kind == "global_avgpool" else nn.AdaptiveMaxPool3d(1)
+                current_shape = (1, 1, 1)
+                prefix = "pool"
+            counts[prefix] += 1
+            name = f"{prefix}{counts[prefix]}"
+            self.add_module(name, module)
+            encoder.append(name)
+            if layer.get("activation"):
+                self.activations[name] = ACTIVATIONS[layer["activation"]]
+            if min(current_shape) < 1:
+                raise ValueError(f"Input shape {tuple(input_shape)} is too small for this network: the feature "
+                                 f"map after {name} would be {current_shape}.")
 
         # LSTM to combine feature encoding from above with feature encodings from past networks
         # The input dimension is the volume of the remaining 3d image after convolution and pooling.
-        lstm_input_dimensions = current_shape[0]*current_shape[1]*current_shape[2]
-        print(f"For the specified shape, the LSTM input dimension has been calculated at {lstm_input_dimensions}.")
-        if lstm_input_dimensions>1000: print("This seems very large. Perhaps you should add some more layers to your network, or increase the kernel size.")
-        self.lstm = nn.LSTM(lstm_input_dimensions, lstm_input_dimensions,lstm_layers)
+        lstm_input_dimensions = channels * current_shape[0] * current_shape[1] * current_shape[2]
+        log.debug("For the specified shape, the LSTM input dimension has been calculated at %d.", lstm_input_dimensions)
+        hidden_dimensions = self.architecture.get("lstm_hidden") or lstm_input_dimensions
+        if hidden_dimensions > 1000:
+            log.warning("LSTM size %d seems very large (%d x %d weights per gate). Perhaps use strided "
+                        "convolutions, global pooling or a smaller lstm_hidden (see ARCHITECTURES).",
+                        hidden_dimensions, hidden_dimensions, lstm_input_dimensions + hidden_dimensions)
+        self.lstm = nn.LSTM(lstm_input_dimensions, hidden_dimensions, lstm_layers)
         # The linear layer that maps from hidden state space to prediction space
-        self.prediction_converter = nn.Linear(lstm_input_dimensions, output_size)
+        self.prediction_converter = nn.Linear(hidden_dimensions, output_size)
         self.num_layers = lstm_layers
-        self.hidden_dimensions = lstm_input_dimensions
+        self.hidden_dimensions = hidden_dimensions
+        self.encoder_layers = tuple(encoder)
+        # Every submodule, in execution order (the profiler times each of them)
+        self.layer_names = self.encoder_layers + ("lstm", "prediction_converter")
 
     def init_hidden(self,batch_size=1):
         # Used for initializing LSTM weights between patients.
         return (torch.zeros(self.num_layers,batch_size, self.hidden_dimensions),
                 torch.zeros(self.num_layers,batch_size, self.hidden_dimensions))
 
+    def encode(self, MRI):
+        # CNN feature encoding of a stack of scans shaped (N, C, D, H, W)
+        for name in self.encoder_layers:
+            MRI = getattr(self, name)(MRI)
+            if name in self.activations:
+                MRI = self.activations[name](MRI)
+        return MRI
+
     def forward(self, MRI):
-        feature_space = self.convolution3(self.pool2(self.convolution2(self.pool1(self.convolution1(MRI)))))
-        # Flatten the output layers from the CNN into a 1d tensor
-        lstm_in = torch.cat([torch.flatten(image[0])[...,None] for image in feature_space],axis=0).view(feature_space.shape[0],1,-1) # This assumes one output channel from CNN
+        feature_space = self.encode(MRI)
+        # Flatten every scan's feature maps (all channels) into one 1d LSTM input per time step
+        lstm_in = torch.flatten(feature_space, start_dim=1).view(feature_space.shape[0], 1, -1)
         lstm_out, self.hidden = self.lstm(lstm_in) # assuming mini-batch of 1
         # To feed the final LSTM layer through the last layer, we need to convert the multidimensional output to
         # a single dimensional tensor.
@@ -75,6 +196,15 @@ class Network(nn.Module):
 
         return dense_conversion
 
+    def classify_scans(self, MRI):
+        """ Scores every scan in MRI (N, C, D, H, W) independently and returns logits shaped (N, output_size).
+        Each scan is fed to the LSTM as its own length-1 sequence (the scans form the LSTM batch), so this
+        matches N separate single-scan forward calls while running the convolutions as one batch."""
+        feature_space = self.encode(MRI)
+        lstm_in = torch.flatten(feature_space, start_dim=1).view(1, feature_space.shape[0], -1)
+        lstm_out, _ = self.lstm(lstm_in)
+        return self.prediction_converter(lstm_out[0])
+
 # Testing. Run random data through network to ensure that everything checks out.
 if __name__ == "__main__":
     big_net = Network(1,(100,100,100),3)
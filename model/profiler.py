@@ -0,0 +1,226 @@
+""" Per-stage instrumentation for the training loops.
+
+Records, for every optimizer step, the time spent waiting on the data loader, decoding and resizing
+scans inside MRIData, copying to the device, running each Network layer forward, backward, gradient
+sync and the optimizer step, together with scans/sec and peak RSS. Steps are appended to a JSONL file
+(one JSON object per line, `"type": "step"` or `"type": "epoch"`), optionally mirrored to TensorBoard,
+and a summary table is logged at the end of every epoch. The `dataset/*` stages come from MRIData
+itself and are a breakdown of `loader_wait` (with worker processes they overlap with training). """
+
+import json
+import logging
+import resource
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+import torch
+
+log = logging.getLogger(__name__)
+
+# Network submodules that get their own forward timer, in execution order (default architecture).
+NETWORK_LAYERS = ("convolution1", "pool1", "convolution2", "pool2", "convolution3", "lstm", "prediction_converter")
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class TrainingProfiler:
+    """ Collects stage timings. Specify:
+        + log_path, the JSONL file to append records to (None keeps results in memory only)
+        + device, the torch device the model runs on; CUDA stages are synchronized before timing
+        + tensorboard_dir, optional directory for a TensorBoard SummaryWriter
+        + enabled, when False every method is a cheap no-op so the loops can call it unconditionally"""
+
+    def __init__(self, log_path=None, device=None, tensorboard_dir=None, enabled=True):
+        self.enabled = enabled
+        self.device = device if device is not None else torch.device("cpu")
+        self.log_file = open(log_path, "a") if (enabled and log_path) else None
+        self.writer = None
+        if enabled and tensorboard_dir:
+            try:
+                from torch.utils.tensorboard import SummaryWriter
+                self.writer = SummaryWriter(tensorboard_dir)
+            except ImportError:
+                log.warning("TensorBoard is not installed; profiling results go to the JSONL log only.")
+        self.phase = "train"
+        self.epoch = 0
+        self.global_step = 0
+        self._hooks = []
+        self._layer_start = {}
+        self._step = defaultdict(float)
+        self._step_start = None
+        self._epoch_steps = []
+
+    # ----------------- TIMING PRIMITIVES -----------------
+    def _sync(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+    def _record(self, name, seconds):
+        self._step[name] += seconds
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block and adds it to the current step under `name`."""
+        if not self.enabled:
+            yield
+            return
+        self._sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sync()
+            self._record(name, time.perf_counter() - start)
+
+    def iter_loader(self, loader):
+        """Wraps a DataLoader and records how long each `next()` blocks as `loader_wait`."""
+        iterator = iter(loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            if self.enabled:
+                if self._step_start is None:
+                    self._step_start = start
+                self._record("loader_wait", time.perf_counter() - start)
+            yield batch
+
+    # ----------------- LAYER HOOKS -----------------
+    def attach(self, model, layers=None):
+        """Registers forward hooks that time each named submodule as `forward/<name>` (by default every
+        layer of the model's architecture)."""
+        if not self.enabled:
+            return
+        if layers is None:
+            layers = getattr(model, "layer_names", NETWORK_LAYERS)
+        modules = dict(model.named_children())
+        for name in layers:
+            module = modules.get(name)
+            if module is None:
+                continue
+            self._hooks.append(module.register_forward_pre_hook(self._make_pre_hook(name)))
+            self._hooks.append(module.register_forward_hook(self._make_post_hook(name)))
+
+    def detach(self):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+
+    def _make_pre_hook(self, name):
+        def pre_hook(module, inputs):
+            self._sync()
+            self._layer_start[name] = time.perf_counter()
+        return pre_hook
+
+    def _make_post_hook(self, name):
+        def post_hook(module, inputs, output):
+            self._sync()
+            start = self._layer_start.pop(name, None)
+            if start is not None:
+                self._record("forward/" + name, time.perf_counter() - start)
+        return post_hook
+
+    # ----------------- STEP / EPOCH BOUNDARIES -----------------
+    def start_epoch(self, epoch, phase="train"):
+        self.epoch = epoch
+        self.phase = phase
+        self._epoch_steps = []
+        self._step = defaultdict(float)
+        self._step_start = None
+
+    def end_step(self, scans, batch=None):
+        """Closes the current step. `scans` is the number of real (unpadded) scans processed and
+        `batch` the loader output, whose MRIData timing fields are folded into the record."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        wall = now - self._step_start if self._step_start is not None else 0.0
+        if batch is not None:
+            for key in ("decode_time", "resize_time"):
+                if key in batch:
+                    self._record("dataset/" + key, float(torch.as_tensor(batch[key]).sum()))
+        record = OrderedDict(
+            type="step",
+            phase=self.phase,
+            epoch=self.epoch,
+            step=self.global_step,
+            wall_seconds=wall,
+            scans=int(scans),
+            scans_per_sec=(scans / wall) if wall > 0 else 0.0,
+            peak_rss_mb=peak_rss_mb(),
+            stages=dict(self._step),
+        )
+        self._write(record)
+        if self.writer is not None:
+            for name, seconds in record["stages"].items():
+                self.writer.add_scalar(f"{self.phase}/stage/{name}", seconds, self.global_step)
+            self.writer.add_scalar(f"{self.phase}/scans_per_sec", record["scans_per_sec"], self.global_step)
+            self.writer.add_scalar(f"{self.phase}/peak_rss_mb", record["peak_rss_mb"], self.global_step)
+        self._epoch_steps.append(record)
+        self.global_step += 1
+        self._step = defaultdict(float)
+        # The next step starts as soon as this one ends, so loader wait is attributed correctly.
+        self._step_start = now
+
+    def end_epoch(self):
+        """Writes an epoch record and logs a per-stage summary table."""
+        if not self.enabled or not self._epoch_steps:
+            return None
+        totals = defaultdict(float)
+        for record in self._epoch_steps:
+            for name, seconds in record["stages"].items():
+                totals[name] += seconds
+        wall = sum(record["wall_seconds"] for record in self._epoch_steps)
+        scans = sum(record["scans"] for record in self._epoch_steps)
+        summary = OrderedDict(
+            type="epoch",
+            phase=self.phase,
+            epoch=self.epoch,
+            steps=len(self._epoch_steps),
+            wall_seconds=wall,
+            scans=scans,
+            scans_per_sec=(scans / wall) if wall > 0 else 0.0,
+            peak_rss_mb=peak_rss_mb(),
+            stages=dict(totals),
+        )
+        self._write(summary)
+        if self.writer is not None:
+            for name, seconds in totals.items():
+                self.writer.add_scalar(f"{self.phase}/epoch_stage/{name}", seconds, self.epoch)
+            self.writer.add_scalar(f"{self.phase}/epoch_scans_per_sec", summary["scans_per_sec"], self.epoch)
+            self.writer.flush()
+        log.info("\n%s", format_summary(summary))
+        return summary
+
+    def _write(self, record):
+        if self.log_file is not None:
+            self.log_file.write(json.dumps(record) + "\n")
+            self.log_file.flush()
+
+    def close(self):
+        self.detach()
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def format_summary(summary):
+    """Renders an epoch record as a table of stages sorted by time spent."""
+    wall = summary["wall_seconds"] or 1e-9
+    lines = [
+        f"\t{summary['phase'].capitalize()} profile, epoch {summary['epoch']}: {summary['steps']} steps, "
+        f"{summary['scans']} scans, {summary['scans_per_sec']:.2f} scans/s, peak RSS {summary['peak_rss_mb']:.0f} MB",
+        f"\t\t{'stage':<34}{'seconds':>10}{'% of wall':>11}",
+    ]
+    for name, seconds in sorted(summary["stages"].items(), key=lambda item: -item[1]):
+        lines.append(f"\t\t{name:<34}{seconds:>10.3f}{100 * seconds / wall:>10.1f}%")
+    return "\n".join(lines)
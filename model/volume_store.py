@@ -0,0 +1,246 @@
+# volume_store.py
+""" A chunked, compressed store holding a whole preprocessed training corpus in one file (the layout of a
+Zarr or HDF5 chunked dataset, without either dependency). pack_volumes.py writes it and MRIData reads
+from it instead of opening one NIfTI file per scan.
+
+Every volume has the same shape (200x200x150 after MRIData's resize) and is cut into a regular grid of
+chunks. Each chunk is byte-shuffled (the high bytes of neighbouring voxels compress together) and
+deflated on its own, so a read only touches the chunks it needs, and the chunks of one read are
+inflated on several threads at once (zlib releases the GIL).
+
+File layout:
+    MAGIC | chunk data ... | index (JSON) | chunk table (uint64 offset, length per volume x chunk) | trailer
+The index holds the volume shape, dtype, chunk shape, the scan path of every volume and one record per
+subject: its manifest entry, label and the range of volumes that are its scans. The trailer (the JSON and
+table lengths, then MAGIC) is at the end of the file, so the index is written once, after the data.
+
+Configuration (environment):
+    DECOMPRESS_THREADS   threads per read (default: all cores, or a worker's share of them; see bgzf.threads)
+"""
+
+import itertools
+import json
+import logging
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference_engine.bgzf import threads
+
+MAGIC = b"ADVSTOR1"
+_TRAILER = struct.Struct("<QQ8s")  # JSON length, chunk table length, MAGIC
+# Chunk edge lengths: 4x4x3 chunks of ~0.5 MB (float32) per 200x200x150 volume
+DEFAULT_CHUNKS = (50, 50, 50)
+# Largest finite float16; raw scanner intensities can exceed it
+FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+log = logging.getLogger(__name__)
+
+
+def _grid(shape, chunks):
+    return tuple(-(-n // c) for n, c in zip(shape, chunks))
+
+
+def clamp_float16(volume, name=""):
+    """`volume` with values beyond float16's range clamped to +-FLOAT16_MAX, so casting it to float16 gives
+    no inf (scans are stored and cached unnormalised). Returned unchanged when everything fits."""
+    volume = np.asarray(volume)
+    if volume.size and (float(np.max(volume)) > FLOAT16_MAX or float(np.min(volume)) < -FLOAT16_MAX):
+        log.warning("%s: intensities beyond the float16 range, clamped to +-%g.", name, FLOAT16_MAX)
+        volume = np.clip(volume, -FLOAT16_MAX, FLOAT16_MAX)
+    return volume
+
+
+def _shuffle(chunk):
+    """Byte-shuffles an array: all first bytes of its elements, then all second bytes, ..."""
+    raw = np.ascontiguousarray(chunk).view(np.uint8).reshape(-1, chunk.dtype.itemsize)
+    return raw.T.tobytes()
+
+
+def _unshuffle(data, dtype, shape):
+    return np.frombuffer(data, np.uint8).reshape(dtype.itemsize, -1).T.copy().view(dtype).reshape(shape)
+
+
+def _plain(value):
+    """JSON-serialisable form of a manifest item (labels are often numpy integers)."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class VolumeStore:
+    """Read access to a store file. Safe to hand to DataLoader workers: the file descriptor and the
+    thread pool are opened per process, on first use."""
+
+    def __init__(self, path, n_threads=None):
+        self.path = path
+        self.n_threads = n_threads or threads()
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a volume store")
+            f.seek(-_TRAILER.size, os.SEEK_END)
+            json_length, table_length, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path}: truncated volume store (no trailer)")
+            f.seek(-(_TRAILER.size + json_length + table_length), os.SEEK_END)
+            index = json.loads(f.read(json_length))
+            table = f.read(table_length)
+        self.shape = tuple(index["shape"])
+        self.dtype = np.dtype(index["dtype"])
+        self.chunks = tuple(index["chunks"])
+        self.level = index["level"]
+        self.paths = index["paths"]
+        self.subjects = index["subjects"]
+        self.grid = _grid(self.shape, self.chunks)
+        self.table = np.frombuffer(table, np.uint64).reshape(len(self.paths), int(np.prod(self.grid)), 2)
+        self._volume_of = {path: i for i, path in enumerate(self.paths)}
+        self._fd = self._pool = self._pid = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_fd"] = state["_pool"] = state["_pid"] = None
+        return state
+
+    def _open(self):
+        if self._pid != os.getpid():  # first use, or a forked DataLoader worker
+            self._fd = os.open(self.path, os.O_RDONLY)
+            self._pool = ThreadPoolExecutor(max_workers=self.n_threads) if self.n_threads > 1 else None
+            self._pid = os.getpid()
+
+    def close(self):
+        if self._pid == os.getpid():
+            os.close(self._fd)
+            if self._pool is not None:
+                self._pool.shutdown()
+        self._fd = self._pool = self._pid = None
+
+    def index(self, path):
+        """Volume index of the scan stored under manifest path `path`."""
+        try:
+            return self._volume_of[path]
+        except KeyError:
+            raise KeyError(f"{path} is not in {self.path}") from None
+
+    def entries(self):
+        """The manifest the store was packed from: one [item..., label] entry per subject."""
+        return [list(subject["entry"]) for subject in self.subjects]
+
+    def read(self, volume, region=None):
+        """Volume `volume` (an index, or a manifest path) as an array of the store's dtype, or only
+        `region` of it: a tuple of slices (step 1), one per axis. Only the chunks that overlap the
+        region are read and inflated."""
+        if isinstance(volume, str):
+            volume = self.index(volume)
+        region = tuple(slice(*s.indices(n)[:2]) for s, n in zip(region or (slice(None),) * 3, self.shape))
+        out = np.empty([s.stop - s.start for s in region], dtype=self.dtype)
+        ranges = [range(s.start // c, -(-s.stop // c)) for s, c in zip(region, self.chunks)]
+        wanted = [(np.ravel_multi_index(position, self.grid), position) for position in itertools.product(*ranges)]
+        if not wanted or out.size == 0:
+            return out
+        self._open()
+        rows = self.table[volume]
+        # Chunks are stored in grid order, so one read covers every chunk the region needs
+        first = int(rows[wanted[0][0], 0])
+        last = int(rows[wanted[-1][0], 0] + rows[wanted[-1][0], 1])
+        data = memoryview(os.pread(self._fd, last - first, first))
+
+        def inflate(item):
+            number, position = item
+            offset, length = (int(v) for v in rows[number])
+            starts = [p * c for p, c in zip(position, self.chunks)]
+            shape = [min(c, n - s) for c, n, s in zip(self.chunks, self.shape, starts)]
+            chunk = _unshuffle(zlib.decompress(data[offset - first:offset - first + length]), self.dtype, shape)
+            # Overlap of the chunk and the region, in chunk and in output coordinates
+            source, target = [], []
+            for s, start, n in zip(region, starts, shape):
+                lo, hi = max(s.start, start), min(s.stop, start + n)
+                source.append(slice(lo - start, hi - start))
+                target.append(slice(lo - s.start, hi - s.start))
+            out[tuple(target)] = chunk[tuple(source)]
+
+        if self._pool is None or len(wanted) == 1:
+            for item in wanted:
+                inflate(item)
+        else:
+            list(self._pool.map(inflate, wanted))
+        return out
+
+
+class VolumeStoreWriter:
+    """Writes a store subject by subject; the file only appears under `path` once `close()` succeeds.
+
+        with VolumeStoreWriter("corpus.vstore", (200, 200, 150)) as writer:
+            writer.add_subject(entry, volumes)   # entry: [item..., label], one volume per scan path
+    """
+
+    def __init__(self, path, shape, dtype=np.float32, chunks=DEFAULT_CHUNKS, level=6, n_threads=None):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunks = tuple(chunks)
+        self.level = level
+        self.paths, self.subjects, self.table = [], [], []
+        self._pool = ThreadPoolExecutor(max_workers=n_threads or threads())
+        self._tmp = path + ".tmp"
+        self._file = open(self._tmp, "wb")
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _compress(self, chunk):
+        return zlib.compress(_shuffle(chunk), self.level)
+
+    def add(self, path, volume):
+        """Appends one volume, stored under manifest path `path`. Returns its index."""
+        if self.dtype == np.float16:
+            volume = clamp_float16(volume, path)
+        volume = np.asarray(volume, dtype=self.dtype)
+        if volume.shape != self.shape:
+            raise ValueError(f"{path}: shape {volume.shape}, the store holds {self.shape}")
+        pieces = (volume[tuple(slice(p * c, (p + 1) * c) for p, c in zip(position, self.chunks))]
+                  for position in itertools.product(*map(range, _grid(self.shape, self.chunks))))
+        rows = []
+        for data in self._pool.map(self._compress, pieces):
+            rows.append((self._file.tell(), len(data)))
+            self._file.write(data)
+        self.table.append(rows)
+        self.paths.append(path)
+        return len(self.paths) - 1
+
+    def add_subject(self, entry, volumes):
+        """Appends a subject: its manifest entry ([item..., label]) and the volumes of its scan paths,
+        in the order they appear in the entry."""
+        *items, label = entry
+        paths = [item for item in items if isinstance(item, str) and item in volumes]
+        first = len(self.paths)
+        for path in paths:
+            self.add(path, volumes[path])
+        self.subjects.append({"entry": [_plain(item) for item in entry], "label": _plain(label),
+                              "first": first, "count": len(paths)})
+
+    def close(self):
+        index = json.dumps({"shape": self.shape, "dtype": self.dtype.str, "chunks": self.chunks,
+                            "level": self.level, "paths": self.paths, "subjects": self.subjects}).encode()
+        table = np.asarray(self.table, dtype=np.uint64).tobytes()
+        self._file.write(index)
+        self._file.write(table)
+        self._file.write(_TRAILER.pack(len(index), len(table), MAGIC))
+        self._file.close()
+        self._pool.shutdown()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._file.close()
+        self._pool.shutdown()
+        os.remove(self._tmp)
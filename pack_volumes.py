@@ -0,0 +1,104 @@
+# pack_volumes.py
+""" Packs a training manifest into a single chunked volume store (model/volume_store.py): every scan is
+decoded and resized to 200x200x150 exactly as MRIData does it, once, and written with its subject's
+manifest entry and label.
+
+    python pack_volumes.py Data/Combined_MRI_List.pkl --out Data/corpus.vstore
+    python evaluate.py --store Data/corpus.vstore
+
+Training then opens one file instead of one per scan, skips the decode and resize on every epoch, and
+reads each scan's chunks on several threads. Scans are decoded and resized on `--workers` processes;
+subjects are written in manifest order. Scan paths are stored as they appear in the manifest, so the
+split of evaluate.py and friends finds them unchanged. """
+
+import argparse
+import os
+import pickle
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+
+from inference_engine.bgzf import share_cores
+from log_utils import configure_logging, get_logger
+
+log = get_logger("pack_volumes")
+
+
+def scan_paths(entry):
+    """The scan paths of a manifest entry ([item..., label]), as MRIData reads them."""
+    return [item for item in entry[:-1] if isinstance(item, str)]
+
+
+def load_subject(root, entry):
+    """{scan path: resized float32 volume} for one manifest entry."""
+    from data_loader import resize_to_standard
+    from inference_engine.preprocessing import read_volume
+    return {path: resize_to_standard(read_volume(os.path.join(root, path))) for path in scan_paths(entry)}
+
+
+def load_subjects(entries, root, workers):
+    """Yields load_subject(root, entry) per entry, in order, at most two subjects per worker in flight."""
+    if workers <= 1:
+        for entry in entries:
+            yield load_subject(root, entry)
+        return
+    entries = iter(entries)
+    with ProcessPoolExecutor(max_workers=workers, initializer=share_cores, initargs=(workers,)) as pool:
+        pending = deque()
+        while True:
+            for entry in entries:
+                pending.append(pool.submit(load_subject, root, entry))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack a NIfTI training manifest into one chunked volume store.")
+    parser.add_argument("manifest", type=str, help="Combined_MRI_List.pkl-style manifest")
+    parser.add_argument("--out", type=str, required=True, help="Store file to write")
+    parser.add_argument("--root", type=str, default="./", help="MRIData root_dir the scan paths are relative to")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "float16"],
+                        help="float16 halves the store, for the half-precision trainer")
+    parser.add_argument("--chunks", type=int, nargs=3, default=None, metavar=("D", "H", "W"),
+                        help="Chunk shape (default 50 50 50)")
+    parser.add_argument("--level", type=int, default=6, help="Deflate level (1 fastest .. 9 smallest)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes decoding and resizing scans")
+    parser.add_argument("--log-level", type=str, default=None)
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    import numpy as np
+    from data_loader import STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3
+    from volume_store import DEFAULT_CHUNKS, VolumeStoreWriter
+
+    with open(args.manifest, "rb") as f:
+        entries = pickle.load(f)
+    if not entries:
+        log.error("No subjects in %s", args.manifest)
+        return 1
+
+    start = time.time()
+    scans = 0
+    shape = (STANDARD_DIM1, STANDARD_DIM2, STANDARD_DIM3)
+    with VolumeStoreWriter(args.out, shape, np.dtype(args.dtype), tuple(args.chunks or DEFAULT_CHUNKS),
+                           args.level) as writer:
+        for count, (entry, volumes) in enumerate(zip(entries, load_subjects(entries, args.root, args.workers)), 1):
+            writer.add_subject(entry, volumes)
+            scans += len(volumes)
+            if count % 50 == 0:
+                log.info("%d/%d subjects, %d scans (%.1f scans/s)", count, len(entries), scans,
+                         scans / max(time.time() - start, 1e-9))
+    log.info("Packed %d subjects, %d scans into %s in %.1fs (%.0f MB)", len(entries), scans, args.out,
+             time.time() - start, os.path.getsize(args.out) / 2 ** 20)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
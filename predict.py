@@ -1,55 +1,89 @@
 import argparse
-import torch
-import nibabel as nib
-import numpy as np
-from model.network import Network  # Correct class name
+import time
+from log_utils import configure_logging, get_logger
 
 # ----------------- ARGUMENT PARSER -----------------
 parser = argparse.ArgumentParser(description="Predict Alzheimer's from MRI")
 parser.add_argument("--mri", type=str, required=True, help="Path to MRI NIfTI file (.nii or .nii.gz)")
 parser.add_argument("--model", type=str, required=True, help="Path to trained model (.pth)")
 parser.add_argument("--device", type=str, default="cpu", help="cpu or cuda")
+parser.add_argument("--log-level", type=str, default=None, help="DEBUG, INFO, WARNING or ERROR")
+parser.add_argument("--screener", type=str, default=None,
+                    help="Path to a screener checkpoint (see train_screener.py). The full model then only "
+                         "runs when the screener is uncertain.")
+parser.add_argument("--band", type=float, nargs=2, default=None, metavar=("LOW", "HIGH"),
+                    help="Screener probabilities between LOW and HIGH go to the full model "
+                         "(default: the UNCERTAIN band of decide_from_prob, 0.08 0.92)")
+parser.add_argument("--crop-shape", type=int, nargs=3, default=None, metavar=("D", "H", "W"),
+                    help="For a model trained on brain crops (evaluate.py --boxes): its crop shape. The resized "
+                         "scan is cut to this shape around the brain.")
+parser.add_argument("--architecture", type=str, default=None,
+                    help="Architecture the model was trained with (evaluate.py --architecture): a name in "
+                         "model/network.py's ARCHITECTURES or a .json/.yaml spec. Default: the original network.")
 args = parser.parse_args()
+if args.crop_shape and args.screener:
+    parser.error("--crop-shape cannot be combined with --screener (the screener sees the whole scan)")
+
+# Heavy imports only after the arguments are valid, so --help and usage errors return at once
+import torch
+import numpy as np
+from inference_engine import CLASSES, INPUT_SHAPE, load_volume, preprocess, load_network, infer_batch
+from metrics import timed, format_stage_line
+
+# Diagnostics go to stderr through the logger; the results below stay on stdout for callers to parse.
+configure_logging(args.log_level)
+log = get_logger("predict")
+
+# Per-stage wall times, reported on one line at the end for the API to pick up
+timings = {}
+run_start = time.perf_counter()
 
 # ----------------- DEVICE -----------------
 device = torch.device(args.device if torch.cuda.is_available() else "cpu")
-print(f"Using device: {device}")
+log.info("Using device: %s", device)
 
 # ----------------- MODEL -----------------
-input_channels = 1
-input_shape = (200, 200, 150)  # From training
-output_size = 2  # Binary classification
+input_shape = INPUT_SHAPE  # From training
+crop_shape = tuple(args.crop_shape) if args.crop_shape else None
 
-model = Network(input_channels, input_shape, output_size).to(device)
-model.load_state_dict(torch.load(args.model, map_location=device))
-model.eval()
+def load_full_model():
+    return load_network(args.model, device, crop_shape or input_shape, architecture=args.architecture)
 
-# ----------------- LOAD & PREPROCESS MRI -----------------
-print(f"Loading MRI: {args.mri}")
-mri_img = nib.load(args.mri)
-mri_data = mri_img.get_fdata()
+if args.screener:
+    from cascade import ScreenerCascade, SCREENER_SHAPE
+    # The full model is loaded lazily, only if the screener is uncertain about this scan.
+    cascade = ScreenerCascade(load_network(args.screener, device, SCREENER_SHAPE), load_full_model,
+                              band=args.band, device=device)
+else:
+    with timed("model_load", timings):
+        model = load_full_model()
 
-# Normalize intensity values
-mri_data = (mri_data - np.min(mri_data)) / (np.max(mri_data) - np.min(mri_data))
+# ----------------- LOAD & PREPROCESS MRI -----------------
+log.info("Loading MRI: %s", args.mri)
+mri_data = load_volume(args.mri, timings)
 
-# Resize or crop to match (200, 200, 150)
+# Normalize intensity values and resize to match (200, 200, 150)
 if mri_data.shape != input_shape:
-    print(f"WARNING MRI shape {mri_data.shape} does not match {input_shape}. Resizing...")
-    from skimage.transform import resize
-    mri_data = resize(mri_data, input_shape, anti_aliasing=True)
-
-# Convert to tensor
-mri_tensor = torch.tensor(mri_data, dtype=torch.float32).unsqueeze(0).unsqueeze(0)  # Shape: (1, 1, 200, 200, 150)
-mri_tensor = mri_tensor.to(device)
+    log.warning("MRI shape %s does not match %s. Resizing...", mri_data.shape, input_shape)
+mri_data = preprocess(mri_data, input_shape, timings, crop_shape)
 
 # ----------------- PREDICTION -----------------
-with torch.no_grad():
-    output = model(mri_tensor)
-    predicted_class = torch.argmax(output).item()
-    probabilities = torch.softmax(output, dim=0).cpu().numpy()
+if args.screener:
+    # Shape: (1, 1, 200, 200, 150)
+    mri_tensor = torch.from_numpy(mri_data).unsqueeze(0).unsqueeze(0).to(device)
+    with timed("forward", timings):
+        result = cascade.predict(mri_tensor)[0]
+    probabilities = np.array(result["probs"], dtype=np.float32)
+    log.info("Cascade stage: %s (screener probability %.3f)", result["stage"], result["screener_prob"])
+else:
+    # One scan: a sequence of length 1 through the LSTM, as in training
+    probabilities = infer_batch(model, [mri_data], mode="sequence", device=device, timings=timings)[0]
+predicted_class = int(np.argmax(probabilities))
 
 # ----------------- RESULTS -----------------
-classes = ["No Alzheimer's", "Alzheimer's Detected"]
 print("\nPrediction Results:")
-print(f"Predicted Class: {classes[predicted_class]}")
+print(f"Predicted Class: {CLASSES[predicted_class]}")
 print(f"Class Probabilities: {probabilities}")
+
+timings["end_to_end"] = time.perf_counter() - run_start
+log.info("%s", format_stage_line(timings))
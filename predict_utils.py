@@ -4,12 +4,7 @@ import torch
 import torch.nn.functional as F
 import numpy as np
 from typing import List, Tuple, Dict
-from PIL import Image
-import cv2
-
-# Grad-CAM
-from pytorch_grad_cam import GradCAM
-from pytorch_grad_cam.utils.image import show_cam_on_image
+from inference_engine import softmax, decide
 
 # ---------- Model loading helpers ----------
 def load_model_checkpoint(model_class, checkpoint_path, device='cpu'):
@@ -75,10 +70,7 @@ def find_temperature(logits: np.ndarray, labels: np.ndarray, init_temp: float =
     return temp
 
 def apply_temperature_to_logits(logits: np.ndarray, temp: float):
-    scaled = logits / float(temp)
-    ex = np.exp(scaled - np.max(scaled, axis=1, keepdims=True))
-    probs = ex / ex.sum(axis=1, keepdims=True)
-    return probs
+    return softmax(logits / float(temp))
 
 # ---------- Inference helpers ----------
 def predict_with_models(models, input_tensor: torch.Tensor, device='cpu', return_logits=False):
@@ -128,15 +120,7 @@ def decide_from_prob(prob_pos: float, decision_threshold: float = 0.92, calibrat
     decision_threshold: e.g., 0.92 (tune on val to get high precision)
     returns (label_str, reason_str)
     """
-    # Use symmetric thresholds for confident negative vs positive
-    high = decision_threshold
-    low = 1.0 - decision_threshold
-    if prob_pos >= high:
-        return "ALZHEIMER_PRESENT", f"High confidence (prob={prob_pos:.3f}). {calibrate_note}"
-    elif prob_pos <= low:
-        return "ALZHEIMER_NOT_PRESENT", f"High confidence negative (prob={prob_pos:.3f}). {calibrate_note}"
-    else:
-        return "UNCERTAIN", f"Model uncertain (prob={prob_pos:.3f}). Recommend specialist review."
+    return decide(prob_pos, decision_threshold, calibrate_note)
 
 # ---------- Grad-CAM explanation ----------
 def make_gradcam_visual(model, input_tensor: torch.Tensor, target_category: int = None, target_layer = None, device='cpu'):
@@ -145,6 +129,10 @@ def make_gradcam_visual(model, input_tensor: torch.Tensor, target_category: int
     input_tensor: (1,C,H,W) tensor in [0,1] or normalized per model
     returns: numpy image overlay (H,W,3) uint8 for display
     """
+    # Imported here: pytorch_grad_cam (and the OpenCV it pulls in) is only needed when an explanation is asked for
+    from pytorch_grad_cam import GradCAM
+    from pytorch_grad_cam.utils.image import show_cam_on_image
+
     # choose a reasonable target_layer if not provided
     if target_layer is None:
         # try common names
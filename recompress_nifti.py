@@ -0,0 +1,124 @@
+# recompress_nifti.py
+""" Rewrites the scans of a dataset manifest into a format that loads on all cores, and writes a matching
+manifest next to them.
+
+    python recompress_nifti.py Data/Combined_MRI_List.pkl --out Data/bgzf            # block-gzipped .nii.gz
+    python recompress_nifti.py Data/Combined_MRI_List.pkl --out Data/raw --format raw  # uncompressed .nii
+
+bgzf: the same bytes as the original file, re-gzipped as independent 64 KB blocks (inference_engine.bgzf).
+      Still a valid .nii.gz for every other tool, but inflated on all cores by the inference engine and
+      MRIData. Compression runs on all cores too.
+raw:  plain .nii, memory-mapped by the reader (no decompression at all, ~2-4x the disk space).
+
+The manifest keeps its structure ([scan path..., label] entries); only scan paths change. Absolute paths
+stay absolute; relative ones are resolved against --root and written relative to --out, so pass --out as
+MRIData's root_dir. Scans whose output is newer than the source are skipped, so a run can be resumed. """
+
+import argparse
+import gzip
+import os
+import pickle
+import sys
+import time
+
+from inference_engine import bgzf
+from log_utils import configure_logging, get_logger
+
+NIFTI_SUFFIXES = (".nii.gz", ".nii")
+
+log = get_logger("recompress_nifti")
+
+
+def is_scan(item):
+    return isinstance(item, str) and item.lower().endswith(NIFTI_SUFFIXES)
+
+
+def strip_suffix(path):
+    for suffix in NIFTI_SUFFIXES:
+        if path.lower().endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def nifti_bytes(path):
+    """The uncompressed contents of a .nii or .nii.gz file."""
+    if not path.lower().endswith(".gz"):
+        with open(path, "rb") as f:
+            return f.read()
+    if bgzf.is_bgzf(path):
+        return bgzf.decompress(path)
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+
+def output_path(source, out_dir, base, fmt):
+    relative = os.path.relpath(source, base)
+    return os.path.join(out_dir, strip_suffix(relative) + (".nii.gz" if fmt == "bgzf" else ".nii"))
+
+
+def convert(source, target, fmt, level):
+    data = nifti_bytes(source)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    if fmt == "bgzf":
+        bgzf.write(target, data, level)
+    else:
+        tmp = target + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+    return len(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rewrite a NIfTI dataset as BGZF or uncompressed files.")
+    parser.add_argument("manifest", type=str, help="Combined_MRI_List.pkl-style manifest")
+    parser.add_argument("--out", type=str, required=True, help="Output directory")
+    parser.add_argument("--format", type=str, default="bgzf", choices=["bgzf", "raw"])
+    parser.add_argument("--root", type=str, default=".", help="Directory relative scan paths are relative to")
+    parser.add_argument("--level", type=int, default=6, help="Deflate level for bgzf (1 fastest .. 9 smallest)")
+    parser.add_argument("--log-level", type=str, default=None)
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    with open(args.manifest, "rb") as f:
+        entries = pickle.load(f)
+    sources = sorted({os.path.abspath(os.path.join(args.root, item)) for entry in entries for item in entry
+                      if is_scan(item)})
+    if not sources:
+        log.error("No NIfTI paths in %s", args.manifest)
+        return 1
+    # Output mirrors the directory layout below the scans' common parent
+    base = os.path.commonpath([os.path.dirname(path) for path in sources])
+    targets = {source: output_path(source, os.path.abspath(args.out), base, args.format) for source in sources}
+
+    start = time.time()
+    converted = skipped = 0
+    raw_bytes = written = 0
+    for source, target in targets.items():
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+            skipped += 1
+            continue
+        raw_bytes += convert(source, target, args.format, args.level)
+        written += os.path.getsize(target)
+        converted += 1
+        if converted % 50 == 0:
+            log.info("%d/%d scans (%.1f MB/s uncompressed)", converted + skipped, len(targets),
+                     raw_bytes / 2 ** 20 / max(time.time() - start, 1e-9))
+    log.info("Converted %d scans (%d already done) in %.1fs: %.0f MB uncompressed -> %.0f MB",
+             converted, skipped, time.time() - start, raw_bytes / 2 ** 20, written / 2 ** 20)
+
+    def rewrite(item):
+        if not is_scan(item):
+            return item
+        target = targets[os.path.abspath(os.path.join(args.root, item))]
+        return target if os.path.isabs(item) else os.path.relpath(target, args.out)
+
+    manifest_out = os.path.join(args.out, os.path.basename(args.manifest))
+    with open(manifest_out, "wb") as f:
+        pickle.dump([[rewrite(item) for item in entry] for entry in entries], f)
+    log.info("Manifest written to %s", manifest_out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
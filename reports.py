@@ -0,0 +1,254 @@
+# reports.py
+""" PDF prediction reports, shared by app.py and bulk report runs.
+
+The page is split in two layers. Everything that does not depend on the patient (title, rules, section
+headings, empty probability bars, disclaimer) is laid out once per page variant and kept as a reportlab
+Drawing; a report only draws that template and then its own text, bars and donut chart on top. The donut
+is built from reportlab vector shapes, so no matplotlib figure or PNG round trip is involved, and memory
+stays flat across thousands of reports.
+
+    pdf = render_report(patient_info, "scan.nii.gz", "alzheimers_model.pth", "No Alzheimer's",
+                        probs=(0.96, 0.04), conf_text="96%")
+    for index, pdf in render_many(reports, workers=8): ...
+"""
+
+import datetime
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from itertools import islice
+
+from reportlab.graphics import renderPDF
+from reportlab.graphics.charts.piecharts import Doughnut
+from reportlab.graphics.shapes import Drawing, Line, Rect, String
+from reportlab.lib.colors import Color, white
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from inference_engine.decision import CLASSES, PRESENT, NOT_PRESENT, TRIPLE_ZONE_BAND, decide_band
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN_X = 50
+TITLE = "🧠 Alzheimer's Detection MRI Report"
+DISCLAIMER = (
+    "Disclaimer: This is an AI-assisted prediction report intended for research/educational purposes only. "
+    "It should not be used as a definitive medical diagnosis. "
+    "Please consult a qualified medical professional for clinical decisions."
+)
+
+RULE = Color(0 / 255, 102 / 255, 204 / 255)
+POSITIVE = Color(0.9, 0.2, 0.2)      # red
+NEGATIVE = Color(0.2, 0.7, 0.2)      # green
+INCONCLUSIVE = Color(0.5, 0.5, 0.5)  # gray
+BAR_NEGATIVE, BAR_NEGATIVE_BG = Color(0.2, 0.8, 0.2), Color(0.9, 1, 0.9)
+BAR_POSITIVE, BAR_POSITIVE_BG = Color(0.9, 0.2, 0.2), Color(1, 0.9, 0.9)
+DONUT_COLORS = (Color(0x4a / 255, 0xde / 255, 0x80 / 255), Color(0xf8 / 255, 0x71 / 255, 0x71 / 255))
+
+BAR_WIDTH, BAR_HEIGHT, BAR_TEXT_OFFSET = 200, 14, 220
+DONUT_SIZE = 160
+
+
+# ----------------- STATIC TEMPLATE -----------------
+@lru_cache(maxsize=None)
+def template(has_notes, show_probs):
+    """The static layer of one page variant and the y positions of its dynamic fields.
+    Only two flags change the layout: a notes line, and probability bars vs the inconclusive note."""
+    page = Drawing(PAGE_WIDTH, PAGE_HEIGHT)
+    slots = {}
+
+    def rule(y):
+        page.add(Line(MARGIN_X, y, PAGE_WIDTH - MARGIN_X, y, strokeColor=RULE, strokeWidth=2))
+
+    def heading(y, text):
+        page.add(String(MARGIN_X, y, text, fontName="Helvetica-Bold", fontSize=12))
+
+    # ---------- HEADER ----------
+    y = PAGE_HEIGHT - 60
+    page.add(String(PAGE_WIDTH / 2, y, TITLE, fontName="Helvetica-Bold", fontSize=18, textAnchor="middle"))
+    y -= 25
+    slots["generated"] = y
+    y -= 20
+    rule(y)
+    y -= 30
+
+    # ---------- PATIENT INFO ----------
+    heading(y, "Patient Information")
+    y -= 18
+    slots["info"] = y
+    y -= 14 * 5
+    if has_notes:
+        slots["notes"] = y
+        y -= 20
+    rule(y)
+    y -= 30
+
+    # ---------- PREDICTION RESULT ----------
+    heading(y, "Prediction Result")
+    y -= 25
+    slots["result"] = y
+    y -= 50
+    slots["details"] = y
+    y -= 40
+    rule(y)
+    y -= 30
+
+    # ---------- PROBABILITY + DONUT CHART ----------
+    heading(y, "Probability Distribution")
+    y -= 20
+    if show_probs:
+        slots["bars"] = y
+        page.add(Rect(MARGIN_X + 10, y, BAR_WIDTH, BAR_HEIGHT, fillColor=BAR_NEGATIVE_BG, strokeColor=None))
+        page.add(Rect(MARGIN_X + 10, y - 25, BAR_WIDTH, BAR_HEIGHT, fillColor=BAR_POSITIVE_BG, strokeColor=None))
+        y -= 95
+    else:
+        page.add(String(MARGIN_X + 10, y, "Inconclusive case — probabilities not shown due to low confidence.",
+                        fontName="Helvetica", fontSize=10))
+        y -= 25
+    rule(y)
+    y -= 30
+
+    # ---------- DISCLAIMER ----------
+    for line in DISCLAIMER.split(". "):
+        line = line.strip() + ('.' if not line.endswith('.') else '')
+        page.add(String(MARGIN_X, y, line, fontName="Helvetica", fontSize=9))
+        y -= 9 * 1.2
+    return page, slots
+
+
+# ----------------- DONUT CHART -----------------
+def donut(prob_neg, prob_pos, size=DONUT_SIZE):
+    """Vector donut of the two class probabilities (a ring 40% of the radius wide, starting at 12 o'clock)."""
+    drawing = Drawing(size, size)
+    chart = Doughnut()
+    inset = size * 0.2  # room for the labels around the ring
+    chart.x = chart.y = inset
+    chart.width = chart.height = size - 2 * inset
+    chart.startAngle = 90
+    chart.direction = "anticlockwise"
+    chart.innerRadiusFraction = 0.6
+    chart.slices.strokeColor = white
+    chart.slices.fontName = "Helvetica"
+    chart.slices.fontSize = 7
+    # Zero-probability slices are left out: they have no area to draw or label
+    slices = [(p, name, color) for p, name, color in zip((prob_neg, prob_pos), CLASSES, DONUT_COLORS) if p > 0]
+    chart.data = [p for p, _, _ in slices]
+    chart.labels = [f"{name} {p * 100:.1f}%" for p, name, _ in slices]
+    for i, (_, _, color) in enumerate(slices):
+        chart.slices[i].fillColor = color
+    drawing.add(chart)
+    return drawing
+
+
+def donut_svg(prob_neg, prob_pos, size=DONUT_SIZE):
+    """The same donut as an SVG string, for on-screen display."""
+    from reportlab.graphics import renderSVG
+    return renderSVG.drawToString(donut(prob_neg, prob_pos, size))
+
+
+# ----------------- REPORT -----------------
+def headline(prob_pos, band=TRIPLE_ZONE_BAND, decision=None):
+    """app.py's triple-zone result line: (label, confidence text), with no confidence for inconclusive
+    cases. `decision` (PRESENT / NOT_PRESENT / UNCERTAIN) overrides the band when it is already known."""
+    decision = decision or decide_band(prob_pos, *band)
+    if decision == PRESENT:
+        return "Alzheimer's Detected", f"{prob_pos * 100:.0f}%"
+    if decision == NOT_PRESENT:
+        return "No Alzheimer's", f"{(1.0 - prob_pos) * 100:.0f}%"
+    return "Inconclusive", None
+
+
+def result_color(predicted_label):
+    if "Alzheimer" in predicted_label and "No" not in predicted_label and "Inconclusive" not in predicted_label:
+        return POSITIVE
+    if "No Alzheimer" in predicted_label:
+        return NEGATIVE
+    return INCONCLUSIVE
+
+
+def render_report(patient_info, mri_filename, model_name, predicted_label, probs=None, conf_text=None,
+                  generated=None):
+    """One report as PDF bytes. `probs` is (P(no Alzheimer's), P(Alzheimer's)), or None for an inconclusive
+    case, which hides the numbers. `generated` defaults to now."""
+    has_notes = bool(patient_info.get("notes"))
+    page, slots = template(has_notes, probs is not None)
+    generated = generated or datetime.datetime.now()
+    if isinstance(generated, datetime.datetime):
+        generated = generated.strftime('%Y-%m-%d %H:%M:%S')
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    renderPDF.draw(page, c, 0, 0)
+
+    c.setFont("Helvetica", 10)
+    c.drawCentredString(PAGE_WIDTH / 2, slots["generated"], f"Generated: {generated}")
+
+    y = slots["info"]
+    for line in (f"Name: {patient_info['name']}", f"Patient ID: {patient_info['id']}",
+                 f"Age: {patient_info['age']}", f"Contact: {patient_info['contact']}",
+                 f"Report Date: {patient_info['date']}"):
+        c.drawString(MARGIN_X + 10, y, line)
+        y -= 14
+    if has_notes:
+        c.drawString(MARGIN_X + 10, slots["notes"], f"Notes: {patient_info['notes']}")
+
+    y = slots["result"]
+    c.setFillColor(result_color(predicted_label))
+    c.rect(MARGIN_X, y - 10, PAGE_WIDTH - 2 * MARGIN_X, 25, fill=1, stroke=0)
+    c.setFillColorRGB(1, 1, 1)
+    c.setFont("Helvetica-Bold", 12)
+    confidence_text = conf_text if conf_text is not None else "N/A"
+    c.drawCentredString(PAGE_WIDTH / 2, y + 2, f"{predicted_label}  — Confidence: {confidence_text}")
+
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont("Helvetica", 10)
+    c.drawString(MARGIN_X + 10, slots["details"], f"MRI File: {mri_filename}")
+    c.drawString(MARGIN_X + 10, slots["details"] - 15, f"Model Used: {model_name}")
+
+    if probs is not None:
+        prob_neg, prob_pos = float(probs[0]), float(probs[1])
+        y = slots["bars"]
+        for prob, color, label in ((prob_neg, BAR_NEGATIVE, "No Alzheimer's"), (prob_pos, BAR_POSITIVE, "Alzheimer's")):
+            c.setFillColor(color)
+            c.rect(MARGIN_X + 10, y, BAR_WIDTH * prob, BAR_HEIGHT, fill=1, stroke=0)
+            c.setFillColorRGB(0, 0, 0)
+            c.drawString(MARGIN_X + 10 + BAR_TEXT_OFFSET, y + 2, f"{label}: {prob * 100:.2f}%")
+            y -= 25
+        renderPDF.draw(donut(prob_neg, prob_pos), c, PAGE_WIDTH - MARGIN_X - 180, PAGE_HEIGHT / 2 - 80)
+
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+# ----------------- BATCH RENDERING -----------------
+def _render_chunk(reports):
+    return [render_report(**report) for report in reports]
+
+
+def render_many(reports, workers=None, chunksize=16):
+    """Renders an iterable of render_report keyword dicts in a process pool, yielding (index, pdf bytes) in
+    input order. Reports travel to the workers `chunksize` at a time and at most two chunks per worker are
+    in flight, so memory stays bounded however many reports there are. Each worker builds the page
+    templates once and reuses them. workers=1 renders in this process."""
+    workers = workers or os.cpu_count() or 1
+    reports = iter(reports)
+    if workers <= 1:
+        for index, report in enumerate(reports):
+            yield index, render_report(**report)
+        return
+    index = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        while True:
+            while len(pending) < workers * 2:
+                chunk = list(islice(reports, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_render_chunk, chunk))
+            if not pending:
+                return
+            for pdf in pending.popleft().result():
+                yield index, pdf
+                index += 1
@@ -2,8 +2,7 @@ import streamlit as st
 import torch
 import nibabel as nib
 import numpy as np
-from model.network import Network
-from skimage.transform import resize
+from inference_engine import CLASSES, INPUT_SHAPE, load_volume, preprocess, load_network, infer_batch
 import matplotlib.pyplot as plt
 import tempfile
 import datetime
@@ -20,18 +19,12 @@ st.title("🧠 Alzheimer's MRI Prediction System")
 st.write("Upload your MRI scan (.nii or .nii.gz) and enter patient details to get AI-powered prediction results")
 
 # ----------------- MODEL PARAMETERS -----------------
-input_channels = 1
-input_shape = (200, 200, 150)
-output_size = 2
-CLASSES = ["No Alzheimer's", "Alzheimer's Detected"]
+input_shape = INPUT_SHAPE
 
 # ----------------- LOAD MODEL -----------------
 @st.cache_resource
 def load_model():
-    model = Network(input_channels, input_shape, output_size)
-    model.load_state_dict(torch.load("alzheimers_model.pth", map_location="cpu"))
-    model.eval()
-    return model
+    return load_network("alzheimers_model.pth", "cpu", input_shape)
 
 model = load_model()
 
@@ -219,23 +212,16 @@ if uploaded_file is not None:
                 tmp_path = tmp_file.name
 
             # Load MRI file
-            mri_img = nib.load(tmp_path)
-            mri_data = mri_img.get_fdata()
+            mri_data = load_volume(tmp_path)
 
             # Normalize & resize
-            mri_data = (mri_data - np.min(mri_data)) / (np.max(mri_data) - np.min(mri_data))
             if mri_data.shape != input_shape:
                 st.warning(f"⚠ MRI shape {mri_data.shape} does not match {input_shape}. Resizing...")
-                mri_data = resize(mri_data, input_shape, anti_aliasing=True)
-
-            # Convert to tensor
-            mri_tensor = torch.tensor(mri_data, dtype=torch.float32).unsqueeze(0).unsqueeze(0)
+            mri_data = preprocess(mri_data, input_shape)
 
             # Run prediction
-            with torch.no_grad():
-                output = model(mri_tensor)
-                probs = torch.softmax(output, dim=0).numpy()
-                predicted_class = np.argmax(probs)
+            probs = infer_batch(model, [mri_data], mode="sequence")[0]
+            predicted_class = np.argmax(probs)
 
             # ----------------- REPORT DISPLAY -----------------
             st.markdown("## 📋 Prediction Report")
@@ -0,0 +1,195 @@
+""" Golden outputs of the inference engine: preprocessing, batched inference in both modes and the decision
+rule. Most values were recorded when predict.py, app.py, temp.py and the API were unified on this engine
+(softmax over the class axis, NORMALIZE_EPS = 1e-8); a change that moves them changes what every entry
+point reports. The LEGACY section reproduces app.py's analyze_upload as it was before the engine existed
+and checks that the engine still gives its answer, and pins the two intentional differences from the old
+predict.py / temp.py path (softmax axis, normalize epsilon). """
+
+import numpy as np
+import pytest
+
+from inference_engine import (NORMALIZE_EPS, NOT_PRESENT, PRESENT, UNCERTAIN, decide, decide_band, normalize,
+                              preprocess, resize_volume)
+
+# Small enough to run in a second, large enough for the Network's three convolutions
+NETWORK_SHAPE = (100, 100, 80)
+
+
+def volume():
+    return np.random.default_rng(0).normal(100.0, 20.0, (12, 10, 8)).astype(np.float32)
+
+
+# ----------------- PREPROCESSING -----------------
+def test_normalize():
+    scaled = normalize(volume())
+    assert scaled.dtype == np.float32
+    assert scaled.min() == 0.0
+    assert scaled.max() == pytest.approx(1.0, abs=1e-6)
+    assert float(scaled.mean()) == pytest.approx(0.5546313524246216, rel=1e-6)
+    assert float(scaled[3, 4, 5]) == pytest.approx(0.4529581069946289, rel=1e-6)
+
+
+def test_normalize_constant_volume():
+    # NORMALIZE_EPS keeps a blank scan at 0 instead of dividing by zero
+    assert NORMALIZE_EPS == 1e-8
+    assert np.all(normalize(np.full((2, 2, 2), 5.0, dtype=np.float32)) == 0.0)
+
+
+def test_resize_volume():
+    resized = resize_volume(normalize(volume()), (6, 5, 4))
+    assert resized.shape == (6, 5, 4)
+    assert float(resized.mean()) == pytest.approx(0.5541602373123169, rel=1e-5)
+    assert float(resized[1, 2, 3]) == pytest.approx(0.5192597508430481, rel=1e-5)
+    assert float(resized[5, 4, 3]) == pytest.approx(0.543042778968811, rel=1e-5)
+
+
+def test_preprocess():
+    result = preprocess(volume(), (6, 5, 4))
+    assert result.dtype == np.float32
+    assert result.shape == (6, 5, 4)
+    assert float(result.mean()) == pytest.approx(0.5541602373123169, rel=1e-5)
+    assert float(result[1, 2, 3]) == pytest.approx(0.5192597508430481, rel=1e-5)
+
+
+# ----------------- INFERENCE -----------------
+@pytest.fixture(scope="module")
+def network():
+    torch = pytest.importorskip("torch")
+    from inference_engine import build_network
+    model = build_network(NETWORK_SHAPE).eval()
+    # Weights from numpy's generator, so the goldens do not depend on torch's RNG
+    rng = np.random.default_rng(1)
+    with torch.no_grad():
+        for parameter in model.parameters():
+            parameter.copy_(torch.from_numpy(rng.normal(0.0, 0.05, tuple(parameter.shape)).astype(np.float32)))
+    return model
+
+
+@pytest.fixture(scope="module")
+def scans():
+    return [np.random.default_rng(10 + i).random(NETWORK_SHAPE, dtype=np.float32) for i in range(3)]
+
+
+INDEPENDENT = [[0.48682958, 0.51317036], [0.4867874, 0.51321256], [0.486875, 0.51312494]]
+SEQUENCE = [[0.48682958, 0.51317036], [0.48728198, 0.5127181], [0.4875857, 0.5124143]]
+
+
+@pytest.mark.parametrize("batch_size", [None, 1, 2])
+def test_infer_batch_independent(network, scans, batch_size):
+    from inference_engine import infer_batch
+    probs = infer_batch(network, scans, mode="independent", batch_size=batch_size)
+    np.testing.assert_allclose(probs, INDEPENDENT, rtol=1e-5, atol=1e-6)
+    # Softmax over the class axis: every row is a distribution
+    np.testing.assert_allclose(probs.sum(axis=1), 1.0, rtol=1e-6)
+
+
+def test_infer_batch_sequence(network, scans):
+    from inference_engine import infer_batch
+    probs = infer_batch(network, scans, mode="sequence")
+    np.testing.assert_allclose(probs, SEQUENCE, rtol=1e-5, atol=1e-6)
+    # The first scan has no history, so it scores as it does on its own
+    np.testing.assert_allclose(probs[0], INDEPENDENT[0], rtol=1e-5, atol=1e-6)
+
+
+def test_infer_batch_stacked_array(network, scans):
+    from inference_engine import infer_batch
+    np.testing.assert_allclose(infer_batch(network, np.stack(scans)), INDEPENDENT, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("mode", ["independent", "sequence"])
+def test_infer_batch_empty(network, mode):
+    from inference_engine import infer_batch
+    probs = infer_batch(network, [], mode=mode, batch_size=2)
+    assert probs.shape == (0, 2)
+    assert probs.dtype == np.float32
+
+
+# ----------------- LEGACY -----------------
+def legacy_app_probs(model, path):
+    """app.py's analyze_upload before the engine: get_fdata (float64), normalize, resize, float32,
+    softmax over the last axis."""
+    import nibabel as nib
+    import torch
+    from skimage.transform import resize
+    mri_data = nib.load(path).get_fdata()
+    mri_min, mri_max = float(np.min(mri_data)), float(np.max(mri_data))
+    mri_data = (mri_data - mri_min) / (mri_max - mri_min + 1e-8)
+    mri_data = resize(mri_data, NETWORK_SHAPE, anti_aliasing=True, preserve_range=True)
+    volume_tensor = torch.from_numpy(mri_data.astype(np.float32)).unsqueeze(0).unsqueeze(0)
+    with torch.no_grad():
+        probs = torch.softmax(model(volume_tensor), dim=-1).cpu().numpy()
+    return probs[0] if probs.ndim == 2 else probs
+
+
+@pytest.fixture(scope="module")
+def legacy_scan(tmp_path_factory):
+    """An int16 NIfTI with slope/intercept scaling, smaller than NETWORK_SHAPE so it is resampled."""
+    nib = pytest.importorskip("nibabel")
+    raw = np.random.default_rng(2).integers(0, 3000, (40, 36, 30)).astype(np.int16)
+    image = nib.Nifti1Image(raw, np.eye(4))
+    image.header.set_slope_inter(0.5, 10.0)
+    path = str(tmp_path_factory.mktemp("legacy") / "scan.nii")
+    nib.save(image, path)
+    return path
+
+
+# Recorded from legacy_app_probs (the pre-engine app.py) on legacy_scan
+LEGACY_APP = [0.48694265, 0.51305735]
+
+
+def test_legacy_app_golden(network, legacy_scan):
+    np.testing.assert_allclose(legacy_app_probs(network, legacy_scan), LEGACY_APP, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("mode", ["independent", "sequence"])
+def test_engine_matches_legacy_app(network, legacy_scan, mode):
+    from inference_engine import infer_batch, load_volume
+    probs = infer_batch(network, [preprocess(load_volume(legacy_scan), NETWORK_SHAPE)], mode=mode)
+    np.testing.assert_allclose(probs[0], LEGACY_APP, rtol=1e-5, atol=1e-6)
+
+
+def test_softmax_axis_change(network, scans):
+    """The old predict.py and temp.py took softmax over dim=0. For one scan the Network's output is 1-D,
+    so that is the class axis and their answers are unchanged; for several scans dim=0 is the scan axis,
+    which normalized each class across scans instead of giving each scan a distribution."""
+    import torch
+    from inference_engine import get_backend, infer_batch
+    with torch.no_grad():
+        single = network(torch.from_numpy(scans[0])[None, None])
+        assert single.dim() == 1
+        np.testing.assert_allclose(torch.softmax(single, dim=0).numpy(), INDEPENDENT[0], rtol=1e-5, atol=1e-6)
+        logits = get_backend("torch").logits(network, torch.from_numpy(np.stack(scans)).unsqueeze(1), "sequence")
+        legacy = torch.softmax(logits, dim=0).numpy()
+    np.testing.assert_allclose(legacy.sum(axis=0), 1.0, rtol=1e-6)
+    engine = infer_batch(network, scans, mode="sequence")
+    np.testing.assert_allclose(engine.sum(axis=1), 1.0, rtol=1e-6)
+    assert not np.allclose(legacy, engine, atol=1e-3)
+
+
+def test_normalize_epsilon_change():
+    """The old predict.py and temp.py divided by (max - min) alone, so a blank scan became NaN."""
+    blank = np.full((2, 2, 2), 5.0, dtype=np.float32)
+    with np.errstate(invalid="ignore"):
+        assert np.all(np.isnan((blank - blank.min()) / (blank.max() - blank.min())))
+    assert np.all(normalize(blank) == 0.0)
+
+
+# ----------------- DECISIONS -----------------
+@pytest.mark.parametrize("prob, expected", [
+    (0.0, NOT_PRESENT), (0.08, NOT_PRESENT), (0.0800001, UNCERTAIN), (0.5, UNCERTAIN),
+    (0.9199999, UNCERTAIN), (0.92, PRESENT), (1.0, PRESENT),
+])
+def test_decide_band_boundaries(prob, expected):
+    assert decide_band(prob, 0.08, 0.92) == expected
+
+
+@pytest.mark.parametrize("prob, expected", [
+    (1.0 - 0.92, NOT_PRESENT), (0.0799999, NOT_PRESENT),
+    # low is 1 - 0.92 = 0.07999999999999996 in floating point, so 0.08 itself is uncertain (as it was in
+    # predict_utils.decide_from_prob before the engine existed)
+    (0.08, UNCERTAIN), (0.5, UNCERTAIN), (0.9199999, UNCERTAIN), (0.92, PRESENT),
+])
+def test_decide_boundaries(prob, expected):
+    label, reason = decide(prob)
+    assert label == expected
+    assert f"prob={prob:.3f}" in reason
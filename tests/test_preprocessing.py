@@ -0,0 +1,109 @@
+""" read_volume against nibabel's own get_fdata on plain, gzipped and block-gzipped (BGZF) NIfTI files, with
+and without scaling and across several slabs, and the brain crop. """
+
+import numpy as np
+import pytest
+
+nib = pytest.importorskip("nibabel")
+
+from inference_engine import bgzf, preprocessing  # noqa: E402
+from inference_engine.preprocessing import crop, read_volume  # noqa: E402
+
+SHAPE = (20, 18, 16)
+
+
+def raw_volume(shape=SHAPE):
+    return np.random.default_rng(3).integers(-500, 3000, shape).astype(np.int16)
+
+
+def save(tmp_path, name, data, slope=None, inter=None):
+    image = nib.Nifti1Image(data, np.eye(4))
+    if slope is not None:
+        image.header.set_slope_inter(slope, inter)
+    path = str(tmp_path / name)
+    nib.save(image, path)
+    return path
+
+
+def save_bgzf(tmp_path, name, plain_path):
+    path = str(tmp_path / name)
+    with open(plain_path, "rb") as f:
+        bgzf.write(path, f.read())
+    return path
+
+
+def expected(path):
+    return nib.load(path).get_fdata().astype(np.float32)
+
+
+@pytest.fixture(params=["plain", "gzip", "bgzf"])
+def kind(request):
+    return request.param
+
+
+def write(tmp_path, kind, data, slope=None, inter=None):
+    plain = save(tmp_path, "scan.nii", data, slope, inter)
+    if kind == "plain":
+        return plain
+    if kind == "gzip":
+        path = save(tmp_path, "scan.nii.gz", data, slope, inter)
+        assert not bgzf.is_bgzf(path)
+        return path
+    path = save_bgzf(tmp_path, "scan.bgzf.nii.gz", plain)
+    assert bgzf.is_bgzf(path)
+    return path
+
+
+# ----------------- read_volume -----------------
+def test_read_volume_unscaled(tmp_path, kind):
+    path = write(tmp_path, kind, raw_volume())
+    volume = read_volume(path)
+    assert volume.dtype == np.float32
+    np.testing.assert_array_equal(volume, expected(path))
+
+
+def test_read_volume_scaled(tmp_path, kind):
+    path = write(tmp_path, kind, raw_volume(), slope=0.5, inter=10.0)
+    np.testing.assert_allclose(read_volume(path), expected(path), rtol=1e-6)
+
+
+def test_read_volume_many_slabs(tmp_path, kind, monkeypatch):
+    # Two slices per slab, and a last slab that is shorter
+    monkeypatch.setattr(preprocessing, "READ_CHUNK_BYTES", SHAPE[0] * SHAPE[1] * 8 * 2)
+    path = write(tmp_path, kind, raw_volume((20, 18, 15)), slope=2.0, inter=-1.0)
+    np.testing.assert_allclose(read_volume(path), expected(path), rtol=1e-6)
+
+
+def test_read_volume_trailing_singleton(tmp_path, kind):
+    path = write(tmp_path, kind, raw_volume(SHAPE + (1,)), slope=0.25, inter=0.0)
+    volume = read_volume(path)
+    assert volume.shape == SHAPE
+    np.testing.assert_allclose(volume, expected(path)[..., 0], rtol=1e-6)
+
+
+def test_read_volume_float64(tmp_path, kind):
+    path = write(tmp_path, kind, raw_volume(), slope=0.5, inter=10.0)
+    volume = read_volume(path, dtype=np.float64)
+    assert volume.dtype == np.float64
+    np.testing.assert_allclose(volume, nib.load(path).get_fdata())
+
+
+# ----------------- crop -----------------
+def test_crop_centres_on_brain():
+    volume = np.random.default_rng(4).random((64, 64, 48), dtype=np.float32) * 0.05
+    volume[20:40, 24:44, 10:30] = 1.0
+    cropped = crop(volume, (32, 32, 32))
+    assert cropped.shape == (32, 32, 32)
+    assert cropped.flags.c_contiguous
+    # The whole bright box fits in the window, with background around it
+    assert int((cropped == 1.0).sum()) == 20 * 20 * 20
+    assert cropped.min() < 0.05
+
+
+def test_crop_blank_volume():
+    # Nothing bright: the box is the whole volume and the window is taken from its middle
+    volume = np.zeros((40, 40, 40), dtype=np.float32)
+    volume[12, 12, 12] = volume[27, 27, 27] = 1e-3
+    cropped = crop(volume, (16, 16, 16))
+    assert cropped.shape == (16, 16, 16)
+    assert cropped[0, 0, 0] == cropped[-1, -1, -1] == np.float32(1e-3)
@@ -0,0 +1,217 @@
+""" Distills the full Network into a small screener for the early-exit cascade (cascade.py) and measures
+how many scans the cascade short-circuits versus how much accuracy it gives up.
+
+    python train_screener.py --teacher alzheimers_model.pth --epochs 5 --out screener.pth
+    python train_screener.py --teacher alzheimers_model.pth --evaluate-only --screener screener.pth
+"""
+
+import argparse
+import json
+import math
+import os
+import pickle
+import random
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.utils.data import DataLoader
+
+sys.path.insert(1, './model')
+from data_loader import MRIData, load_split, split_path
+from cascade import (SCREENER_SHAPE, FULL_SHAPE, build_screener, downsample, load_network,
+                     band_from_decision_threshold)
+from log_utils import configure_logging, get_logger
+
+# ----------------- ARGUMENT PARSING -----------------
+parser = argparse.ArgumentParser(description='Distill and evaluate the cascade screener.')
+parser.add_argument('--teacher', type=str, default='alzheimers_model.pth', help='Full model checkpoint')
+parser.add_argument('--screener', type=str, default=None, help='Screener checkpoint to start from / evaluate')
+parser.add_argument('--out', type=str, default='screener.pth', help='Where to save the trained screener')
+parser.add_argument('--data', type=str, default='./Data/Combined_MRI_List.pkl', help='Patient list pickle')
+parser.add_argument('--split', type=str, default=None,
+                    help='Train/test split the teacher was trained with (default: the .split.json saved next '
+                         'to --teacher by evaluate.py / evaluate_half_tensor.py)')
+parser.add_argument('--epochs', type=int, default=5)
+parser.add_argument('--learning-rate', type=float, default=0.01)
+parser.add_argument('--temperature', type=float, default=2.0, help='Distillation softmax temperature')
+parser.add_argument('--alpha', type=float, default=0.7,
+                    help='Weight of the distillation term; 1 - alpha weights the cross entropy on labels')
+parser.add_argument('--scan-batch', type=int, default=4, help='Scans per forward pass')
+parser.add_argument('--thresholds', type=float, nargs='+', default=[0.80, 0.85, 0.90, 0.92, 0.95],
+                    help='decide_from_prob-style thresholds t; the cascade band is (1 - t, t)')
+parser.add_argument('--evaluate-only', action='store_true', default=False)
+parser.add_argument('--report-json', type=str, default=None, help='Write the evaluation table to this file')
+parser.add_argument('--store', type=str, default=None,
+                    help='Volume store written by pack_volumes.py; scans are read from it instead of '
+                         'decoded from NIfTI files.')
+parser.add_argument('--disable-cuda', action='store_true', default=False)
+parser.add_argument('--log-level', type=str, default=None)
+args = parser.parse_args()
+
+configure_logging(args.log_level)
+log = get_logger("train_screener")
+
+device = torch.device('cuda' if torch.cuda.is_available() and not args.disable_cuda else 'cpu')
+log.info("Using device: %s", device)
+
+torch.manual_seed(1)
+random.seed(1)
+
+# ----------------- LOAD DATA -----------------
+# The teacher's own split, so the cascade is evaluated on patients the teacher did not see.
+split_file = args.split or split_path(args.teacher)
+if os.path.exists(split_file):
+    training_list, test_list = load_split(split_file)
+    log.info("Using the teacher's split from %s: %d train, %d test patients", split_file, len(training_list),
+             len(test_list))
+else:
+    if args.split:
+        raise FileNotFoundError(f"Split file {args.split} not found")
+    log.warning("No split file %s: splitting %s with seed 1, which only matches a teacher trained by "
+                "evaluate_half_tensor.py; the test set may contain the teacher's training patients", split_file,
+                args.data)
+    MRI_images_list = pickle.load(open(args.data, "rb"))
+    random.shuffle(MRI_images_list)
+    train_size = int(0.7 * len(MRI_images_list))
+    training_list, test_list = MRI_images_list[:train_size], MRI_images_list[train_size:]
+train_loader = DataLoader(MRIData('./', training_list, store=args.store), batch_size=1, shuffle=True)
+test_loader = DataLoader(MRIData('./', test_list, store=args.store), batch_size=1, shuffle=False)
+
+# ----------------- MODELS -----------------
+teacher = load_network(args.teacher, FULL_SHAPE, device=device)
+if args.screener:
+    screener = load_network(args.screener, SCREENER_SHAPE, device=device)
+else:
+    screener = build_screener().to(device)
+
+
+def patient_scans(patient_data):
+    """The real (unpadded) scans of the single patient in a batch, as (N, 1, D, H, W), plus labels."""
+    num_images = int(patient_data['num_images'][0])
+    scans = patient_data['images'][0][:num_images].unsqueeze(1)
+    labels = torch.full((num_images,), int(patient_data['label'][0]), dtype=torch.long)
+    return scans, labels
+
+
+def chunks(scans, labels):
+    for start in range(0, scans.shape[0], args.scan_batch):
+        yield (scans[start:start + args.scan_batch].to(device),
+               labels[start:start + args.scan_batch].to(device))
+
+
+# ----------------- DISTILLATION -----------------
+def distill_epoch(optimizer):
+    screener.train()
+    total_loss, batches = 0.0, 0
+    for i, patient_data in enumerate(train_loader):
+        if i % (max(1, math.floor(len(train_loader) / 5))) == 0:
+            log.info("Distillation Progress: %.1f%%", i / len(train_loader) * 100)
+        scans, labels = patient_scans(patient_data)
+        for scan_batch, label_batch in chunks(scans, labels):
+            with torch.no_grad():
+                teacher_logits = teacher.classify_scans(scan_batch)
+            student_logits = screener.classify_scans(downsample(scan_batch))
+
+            T = args.temperature
+            distill_loss = F.kl_div(F.log_softmax(student_logits / T, dim=-1),
+                                    F.softmax(teacher_logits / T, dim=-1),
+                                    reduction='batchmean') * T * T
+            label_loss = F.cross_entropy(student_logits, label_batch)
+            loss = args.alpha * distill_loss + (1 - args.alpha) * label_loss
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            batches += 1
+    return total_loss / max(1, batches)
+
+
+# ----------------- CASCADE EVALUATION -----------------
+@torch.no_grad()
+def collect_probabilities():
+    """Screener and full-model P(Alzheimer's) for every test scan, with the patient label."""
+    screener.eval()
+    screener_probs, full_probs, labels_all = [], [], []
+    screener_seconds = full_seconds = 0.0
+    for patient_data in test_loader:
+        scans, labels = patient_scans(patient_data)
+        for scan_batch, label_batch in chunks(scans, labels):
+            start = time.perf_counter()
+            screener_probs += torch.softmax(screener.classify_scans(downsample(scan_batch)), -1)[:, 1].tolist()
+            screener_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            full_probs += torch.softmax(teacher.classify_scans(scan_batch), -1)[:, 1].tolist()
+            full_seconds += time.perf_counter() - start
+            labels_all += label_batch.tolist()
+    return screener_probs, full_probs, labels_all, screener_seconds, full_seconds
+
+
+def evaluate_cascade():
+    screener_probs, full_probs, labels, screener_seconds, full_seconds = collect_probabilities()
+    n = len(labels)
+    if n == 0:
+        log.warning("No test scans to evaluate.")
+        return []
+    full_correct = sum((p >= 0.5) == bool(y) for p, y in zip(full_probs, labels))
+    full_accuracy = full_correct / n
+    mean_screener = screener_seconds / n
+    mean_full = full_seconds / n
+
+    rows = []
+    for threshold in args.thresholds:
+        low, high = band_from_decision_threshold(threshold)
+        short_circuited = 0
+        correct = agree = 0
+        for s_prob, f_prob, y in zip(screener_probs, full_probs, labels):
+            if low < s_prob < high:
+                final = f_prob
+            else:
+                final = s_prob
+                short_circuited += 1
+            correct += (final >= 0.5) == bool(y)
+            agree += (final >= 0.5) == (f_prob >= 0.5)
+        fraction = short_circuited / n
+        rows.append({
+            'threshold': threshold,
+            'band': [low, high],
+            'short_circuit_fraction': fraction,
+            'cascade_accuracy': correct / n,
+            'full_accuracy': full_accuracy,
+            'accuracy_loss': full_accuracy - correct / n,
+            'agreement_with_full': agree / n,
+            # every scan pays for the screener, only the uncertain ones for the full model
+            'expected_seconds_per_scan': mean_screener + (1 - fraction) * mean_full,
+            'full_seconds_per_scan': mean_full,
+        })
+
+    print(f"\nCascade evaluation on {n} test scans")
+    print(f"{'threshold':>10}{'band':>16}{'short-circuited':>17}{'accuracy':>10}{'acc. loss':>11}"
+          f"{'agreement':>11}{'s/scan':>9}")
+    for row in rows:
+        band = f"({row['band'][0]:.2f}, {row['band'][1]:.2f})"
+        print(f"{row['threshold']:>10.2f}{band:>16}{row['short_circuit_fraction'] * 100:>16.1f}%"
+              f"{row['cascade_accuracy'] * 100:>9.1f}%{row['accuracy_loss'] * 100:>10.1f}%"
+              f"{row['agreement_with_full'] * 100:>10.1f}%{row['expected_seconds_per_scan']:>9.3f}")
+    print(f"Full model alone: accuracy {full_accuracy * 100:.1f}%, {mean_full:.3f} s/scan")
+    return rows
+
+
+# ----------------- MAIN -----------------
+if not args.evaluate_only:
+    optimizer = optim.SGD(screener.parameters(), lr=args.learning_rate, momentum=0.9)
+    for epoch in range(args.epochs):
+        start_time = time.time()
+        train_loss = distill_epoch(optimizer)
+        log.info("Epoch %d/%d | distillation loss %.4f | %.0fs", epoch + 1, args.epochs, train_loss,
+                 time.time() - start_time)
+    torch.save(screener.state_dict(), args.out)
+    log.info("Screener saved at: %s", args.out)
+
+rows = evaluate_cascade()
+if args.report_json:
+    with open(args.report_json, 'w') as f:
+        json.dump(rows, f, indent=2)